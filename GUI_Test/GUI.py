@@ -1,8 +1,20 @@
 import os
+import sys
+import shutil
 import subprocess
+import tempfile
+import time
 import tkinter as tk
 from tkinter import ttk, scrolledtext, filedialog, Menu
 
+from run_scheduler import RunScheduler
+from z16sim import (REG_NAMES, DEFAULT_BUDGET, disassemble, describe_stop, describe_summary,
+                    parse_budget_option, register_state)
+from z16trace import Step, Output, Load, Final, read_records
+
+# Milliseconds between checks for output from the run worker
+POLL_INTERVAL = 50
+
 class Z16IDE:
     def __init__(self, root):
         self.root = root
@@ -29,6 +41,10 @@ class Z16IDE:
         run_menu = Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Run", menu=run_menu)
         run_menu.add_command(label="Run", command=self.run_code)
+        self.fast_run = tk.BooleanVar(value=False)
+        run_menu.add_checkbutton(label="Run to Completion (no trace)", variable=self.fast_run)
+        run_menu.add_command(label="Run Budgets...", command=self.show_budget_dialog)
+        self.budget = DEFAULT_BUDGET
         
         # Main frame
         main_frame = ttk.PanedWindow(root, orient=tk.HORIZONTAL)
@@ -73,7 +89,14 @@ class Z16IDE:
         self.asm_file = "temp.asm"
         self.bin_file = "temp.bin"
         self.assembler_path = "GUI_Test\z16asm.exe"
-        self.disassembler_path = "GUI_Test\z16sim.exe"
+        # The simulator runs with --trace=binary; the bundled z16sim.exe predates
+        # that option, so use the Python engine unless a rebuilt z16sim is configured
+        self.disassembler_path = [sys.executable,
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), "z16sim.py")]
+        
+        # Background build/run pipeline
+        self.scheduler = RunScheduler()
+        self.polling = False
     
     def open_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("Assembly Files", "*.asm *.s"), ("All Files", "*.*")])
@@ -88,6 +111,39 @@ class Z16IDE:
             with open(file_path, 'w') as file:
                 file.write(self.assembly_input.get(1.0, tk.END))
     
+    def show_budget_dialog(self):
+        # Instruction, wall-clock and output limits for later runs (0 = unlimited)
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Run Budgets")
+        dialog.transient(self.root)
+        entries = []
+        for row, (label, option, value) in enumerate((
+                ("Max instructions:", "--max-instructions", self.budget.instructions),
+                ("Time limit (s):", "--timeout", self.budget.seconds),
+                ("Max output (bytes):", "--max-output", self.budget.output))):
+            ttk.Label(dialog, text=label).grid(row=row, column=0, sticky=tk.W, padx=5, pady=2)
+            entry = ttk.Entry(dialog)
+            entry.insert(0, str(value) if value else "0")
+            entry.grid(row=row, column=1, padx=5, pady=2)
+            entries.append((option, entry))
+        
+        def apply():
+            budget = self.budget
+            for option, entry in entries:
+                try:
+                    budget = parse_budget_option(f"{option}={entry.get().strip()}", budget)
+                except ValueError:
+                    entry.focus_set()
+                    entry.select_range(0, tk.END)
+                    return
+            self.budget = budget
+            dialog.destroy()
+        
+        buttons = ttk.Frame(dialog)
+        buttons.grid(row=3, column=0, columnspan=2, pady=5)
+        ttk.Button(buttons, text="OK", command=apply).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="Cancel", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+    
     def update_output(self, text_widget, text):
         text_widget.config(state=tk.NORMAL)
         text_widget.insert(tk.END, text)
@@ -95,95 +151,129 @@ class Z16IDE:
         text_widget.see(tk.END)
     
     def run_code(self):
-        # Save assembly to temp file
-        with open(self.asm_file, 'w') as file:
-            file.write(self.assembly_input.get(1.0, tk.END))
+        source = self.assembly_input.get(1.0, tk.END)
+        fast = self.fast_run.get()
+        budget = self.budget
         
         # Clear previous output
         self.disassembler_output.config(state=tk.NORMAL)
         self.disassembler_output.delete(1.0, tk.END)
         self.disassembler_output.config(state=tk.DISABLED)
         
-        # Run assembler
+        # Assemble and simulate on a worker thread; starting a new run kills
+        # the previous one and discards whatever it still prints
+        self.scheduler.submit(
+            lambda token, emit: self.build_and_run(source, fast, budget, token, emit),
+            on_output=lambda chunks: self.update_output(self.disassembler_output, "".join(chunks)),
+            on_done=self.update_registers,
+            on_error=lambda e: self.update_output(self.disassembler_output, f"Error: {str(e)}\n"))
+        if not self.polling:
+            self.polling = True
+            self.root.after(POLL_INTERVAL, self.poll_run)
+    
+    def poll_run(self):
+        # Merge worker output into the widgets on the Tk thread
+        self.scheduler.poll()
+        if self.scheduler.busy:
+            self.root.after(POLL_INTERVAL, self.poll_run)
+        else:
+            self.polling = False
+    
+    def build_and_run(self, source, fast, budget, token, emit):
+        # Runs on the worker thread. Every run gets its own temporary files so
+        # a run that is being killed cannot clobber the next one's binary
+        work_dir = tempfile.mkdtemp(prefix="z16run")
         try:
+            asm_file = os.path.join(work_dir, self.asm_file)
+            bin_file = os.path.join(work_dir, self.bin_file)
+            with open(asm_file, 'w') as file:
+                file.write(source)
+            
+            # Run assembler inside the run directory so its messages name
+            # temp.lst/temp.bin rather than the temporary path
             assembler_process = subprocess.Popen(
-                [self.assembler_path, self.asm_file, "-o", self.bin_file], 
+                [os.path.abspath(self.assembler_path), self.asm_file, "-o", self.bin_file], 
                 stdout=subprocess.PIPE, 
                 stderr=subprocess.STDOUT,
-                text=True
+                text=True,
+                cwd=work_dir
             )
+            token.attach(assembler_process)
             
             # Display assembler output
             for line in assembler_process.stdout:
-                self.update_output(self.disassembler_output, line)
+                emit(line)
             
             assembler_process.wait()
+            token.check()
             
             # Run disassembler if assembler succeeded
-            if assembler_process.returncode == 0:
-                self.run_disassembler()
-        except Exception as e:
-            self.update_output(self.disassembler_output, f"Error: {str(e)}\n")
+            if assembler_process.returncode != 0:
+                return None
+            return self.run_disassembler(bin_file, fast, budget, token, emit)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
     
-    def run_disassembler(self):
-        try:
-            disassembler_process = subprocess.Popen(
-                [self.disassembler_path, self.bin_file], 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.STDOUT,
-                text=True
-            )
-            
-            in_register_section = False
-            output_lines = []
-            
-            # Collect all output lines
-            for line in disassembler_process.stdout:
-                output_lines.append(line)
-                self.update_output(self.disassembler_output, line)
-            
-            # Process the collected output for register values
-            for i, line in enumerate(output_lines):
-                # Check if we're entering the register state section
-                if "--- Final Register State ---" in line:
-                    in_register_section = True
-                    continue
-                    
-                # Check if we're exiting the register state section
-                if in_register_section and "---------------------------" in line:
-                    break
-                    
-                # Parse register values in the register section
-                if in_register_section and ":" in line:
-                    if line.startswith("PC:"):
-                        # Special handling for PC
-                        parts = line.split(":")
-                        if len(parts) >= 2:
-                            pc_value = parts[1].strip().split()[0]  # Get just the hex value
-                            
-                            # Update PC in table
-                            for item_id in self.register_table.get_children():
-                                if self.register_table.item(item_id)["values"][0] == "PC":
-                                    self.register_table.item(item_id, values=("PC", pc_value))
-                    else:
-                        # Handle regular register lines like "t0 (x0): 0x000F (15)"
-                        parts = line.split(":")
-                        if len(parts) >= 2:
-                            # Extract register name from format like "t0 (x0)"
-                            reg_part = parts[0].strip()
-                            reg_name = reg_part.split()[0]  # Get just the register name
-                            
-                            # Extract hex value from format like "0x000F (15)"
-                            val_part = parts[1].strip()
-                            reg_value = val_part.split()[0]  # Get just the hex value
-                            
-                            # Update register in table
-                            for item_id in self.register_table.get_children():
-                                if self.register_table.item(item_id)["values"][0] == reg_name:
-                                    self.register_table.item(item_id, values=(reg_name, reg_value))
-                                    
-        except Exception as e:
-            self.update_output(self.disassembler_output, f"Error: {str(e)}\n")
+    def run_disassembler(self, bin_file, fast, budget, token, emit):
+        # Read structured trace records instead of scraping the text output;
+        # in fast mode the simulator sends no per-instruction records
+        options = ["--trace=binary",
+                   f"--max-instructions={budget.instructions or 0}",
+                   f"--timeout={budget.seconds or 0}",
+                   f"--max-output={budget.output or 0}"]
+        if fast:
+            options.append("--fast")
+        start = time.perf_counter()
+        disassembler_process = subprocess.Popen(
+            self.disassembler_path + options + [bin_file], 
+            stdout=subprocess.PIPE, 
+            stderr=subprocess.PIPE
+        )
+        token.attach(disassembler_process)
+        
+        final = None
+        pending_output = []
+        for record in read_records(disassembler_process.stdout):
+            if isinstance(record, Step):
+                lines = [f"0x{record.pc:04X}: {record.inst:04X} {disassemble(record.inst, record.pc)}\n"]
+                # ecall output arrives before the record of the ecall itself
+                lines += pending_output
+                pending_output = []
+                emit("".join(lines))
+            elif isinstance(record, Output):
+                if fast:
+                    emit(record.text)
+                else:
+                    pending_output.append(record.text)
+            elif isinstance(record, Load):
+                emit(f"Loaded {record.size} bytes into memory\n")
+            elif isinstance(record, Final):
+                final = record
+        
+        disassembler_process.wait()
+        elapsed = time.perf_counter() - start
+        token.check()
+        errors = disassembler_process.stderr.read().decode(errors="replace")
+        if final is None:
+            emit(errors)
+            return None
+        emit(describe_stop(final.reason, final.pc, final.count, budget))
+        emit(register_state(final.regs, final.pc))
+        if fast:
+            # Wall time of the whole simulator process, start-up included
+            emit(describe_summary(final.count, elapsed))
+        return final
+    
+    def update_registers(self, final):
+        # 'final' is the simulator's final-state trace record (None if it failed)
+        if final is None:
+            return
+        values = dict(zip(REG_NAMES, final.regs))
+        values["PC"] = final.pc
+        for item_id in self.register_table.get_children():
+            reg_name = self.register_table.item(item_id)["values"][0]
+            if reg_name in values:
+                self.register_table.item(item_id, values=(reg_name, f"0x{values[reg_name]:04X}"))
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -1,15 +1,48 @@
+import math
+import re
 import sys
 import os
-import subprocess
-import re
+import time
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QTextEdit, QPlainTextEdit,
                              QPushButton, QVBoxLayout, QHBoxLayout,
-                             QWidget, QLabel, QTableWidget, QTableWidgetItem,
-                             QHeaderView, QFileDialog, QMenu, QMenuBar, QAction,
-                             QDialog, QLineEdit, QCheckBox)
-from PyQt5.QtCore import QProcess, Qt, QRect, QSize
-from PyQt5.QtGui import (QTextDocument, QFont, QTextCursor, QTextCharFormat,
-                         QColor, QPainter, QTextFormat)
+                             QWidget, QLabel, QFileDialog, QMenu, QMenuBar, QAction,
+                             QDialog, QLineEdit, QCheckBox, QToolTip, QTabWidget)
+from PyQt5.QtCore import Qt, QRect, QSize, QTimer, QEvent, QPoint, pyqtSignal
+from PyQt5.QtGui import QFont, QTextCursor, QColor, QPainter, QTextFormat
+
+from z16asm import AssemblerError, IncrementalAssembler
+from z16sim import (Z16Simulator, DEFAULT_BUDGET, STOP_BREAKPOINT, STOP_ECALL,
+                    STOP_TIME_LIMIT, describe_stop, describe_summary, parse_budget_option)
+from source_map import SourceMap
+from z16session import DebugSession, SessionError
+from run_scheduler import RunScheduler
+from trace_view import TraceChunk, TraceView
+from register_view import RegisterView
+from memory_view import MemoryView
+from profile_view import ProfileView, line_hits
+from syntax_highlighter import Z16Highlighter
+from z16lint import Linter, Diagnostic, ERROR, WARNING
+from text_search import MatchIndex, compile_query
+
+# Instructions simulated between cancellation checks / output flushes
+RUN_SLICE = 5000
+# Milliseconds of typing pause before the buffer is re-assembled and re-checked
+EDIT_DELAY = 300
+# Gutter marker and line tint of each diagnostic severity
+DIAGNOSTIC_MARKERS = {ERROR: QColor("#D00000"), WARNING: QColor("#E09000")}
+DIAGNOSTIC_TINTS = {ERROR: QColor(255, 215, 215), WARNING: QColor(255, 238, 200)}
+# Find matches highlighted at once; the count still covers every match
+MAX_SEARCH_HIGHLIGHTS = 2000
+# Gutter marker of a breakpoint, and the tint of the line about to execute
+BREAKPOINT_COLOR = QColor("#800000")
+EXECUTION_TINT = QColor(200, 235, 200)
+# Pixels of the gutter strip shaded by how often each line executed
+HEAT_WIDTH = 5
+
+
+def heatColor(level):
+    """Pale yellow for rarely executed lines through to red for the hottest (level 0..1)"""
+    return QColor.fromHsv(int(55 * (1 - level)), int(80 + 175 * level), 255)
 
 
 class LineNumberArea(QWidget):
@@ -23,12 +56,45 @@ class LineNumberArea(QWidget):
     def paintEvent(self, event):
         self.editor.lineNumberAreaPaintEvent(event)
 
+    def event(self, event):
+        # Hovering the gutter shows that line's diagnostics and execution count
+        if event.type() == QEvent.ToolTip:
+            text = self.editor.gutterTextAt(event.pos().y())
+            if text:
+                QToolTip.showText(event.globalPos(), text, self)
+            else:
+                QToolTip.hideText()
+            return True
+        return super().event(event)
+
+    def mousePressEvent(self, event):
+        # Clicking the gutter toggles a breakpoint on that line
+        if event.button() == Qt.LeftButton:
+            self.editor.toggleBreakpoint(
+                self.editor.cursorForPosition(QPoint(0, event.pos().y())).blockNumber() + 1)
+
 
 class LineNumberTextEdit(QPlainTextEdit):
+    breakpointsChanged = pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.lineNumberArea = LineNumberArea(self)
 
+        # Breakpoints as cursors at the start of their lines, so they move with edits
+        self.breakpointCursors = []
+        # Line about to execute while debugging
+        self.executionSelections = []
+
+        # Diagnostics by block number, and their line tints as extra selections
+        self.diagnostics = {}
+        self.diagnosticSelections = []
+        # Find matches highlighted by the Find and Replace dialog
+        self.searchSelections = []
+        # Instructions executed per block number in the last run, for the heat strip
+        self.heat = {}
+        self.heatMax = 0
+
         self.blockCountChanged.connect(self.updateLineNumberAreaWidth)
         self.updateRequest.connect(self.updateLineNumberArea)
         self.cursorPositionChanged.connect(self.highlightCurrentLine)
@@ -44,7 +110,11 @@ class LineNumberTextEdit(QPlainTextEdit):
             digits += 1
 
         space = 3 + self.fontMetrics().width('9') * digits  # Changed for PyQt5 v5.5
-        return space
+        return space + self.markerWidth() + HEAT_WIDTH
+
+    def markerWidth(self):
+        # Gutter column for the diagnostic markers
+        return self.fontMetrics().height()
 
     def updateLineNumberAreaWidth(self, _):
         self.setViewportMargins(self.lineNumberAreaWidth(), 0, 0, 0)
@@ -77,7 +147,102 @@ class LineNumberTextEdit(QPlainTextEdit):
             selection.cursor.clearSelection()
             extraSelections.append(selection)
 
-        self.setExtraSelections(extraSelections)  # Fixed method name to plural
+        # Diagnostic tints go over the current line, then the execution line and search matches
+        self.setExtraSelections(extraSelections + self.diagnosticSelections
+                                + self.executionSelections
+                                + self.searchSelections)  # Fixed method name to plural
+
+    def setSearchMatches(self, spans):
+        """Highlight every (start, end) match at once; an empty list clears them"""
+        selections = []
+        for start, end in spans[:MAX_SEARCH_HIGHLIGHTS]:
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(QColor(255, 200, 60))
+            selection.cursor = QTextCursor(self.document())
+            selection.cursor.setPosition(start)
+            selection.cursor.setPosition(end, QTextCursor.KeepAnchor)
+            selections.append(selection)
+        self.searchSelections = selections
+        self.highlightCurrentLine()
+
+    def setDiagnostics(self, diagnostics):
+        """Replace every diagnostic marker at once; 'diagnostics' carry 1-based line numbers"""
+        index = {}
+        for diagnostic in diagnostics:
+            index.setdefault(diagnostic.line - 1, []).append(diagnostic)
+        document = self.document()
+        selections = []
+        for number, items in index.items():
+            block = document.findBlockByNumber(number)
+            if not block.isValid():
+                continue
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(DIAGNOSTIC_TINTS[self.severityOf(items)])
+            selection.format.setProperty(QTextFormat.FullWidthSelection, True)
+            selection.cursor = QTextCursor(block)
+            selections.append(selection)
+        self.diagnostics = index
+        self.diagnosticSelections = selections
+        self.highlightCurrentLine()
+        self.lineNumberArea.update()
+
+    @staticmethod
+    def severityOf(items):
+        return ERROR if any(d.severity == ERROR for d in items) else WARNING
+
+    def gutterTextAt(self, y):
+        """Diagnostics and execution count of the line at viewport height 'y' ('' if none)"""
+        number = self.cursorForPosition(QPoint(0, y)).blockNumber()
+        lines = [f"{d.severity}: {d.message}" for d in self.diagnostics.get(number, ())]
+        if number in self.heat:
+            lines.append(f"Executed {self.heat[number]} times")
+        return "\n".join(lines)
+
+    def setHeatMap(self, hits):
+        """Shade the gutter by {1-based line: instructions executed}; an empty dict clears it"""
+        self.heat = {line - 1: count for line, count in hits.items() if count}
+        self.heatMax = max(self.heat.values(), default=0)
+        self.lineNumberArea.update()
+
+    def jumpToLine(self, line):
+        """Put the cursor at the start of 1-based 'line' and scroll it into view"""
+        block = self.document().findBlockByNumber(line - 1)
+        if block.isValid():
+            self.setTextCursor(QTextCursor(block))
+            self.centerCursor()
+            self.setFocus()
+
+    def breakpointLines(self):
+        """Sorted 1-based lines that have a breakpoint"""
+        return sorted({cursor.blockNumber() + 1 for cursor in self.breakpointCursors})
+
+    def toggleBreakpoint(self, line):
+        """Set or clear the breakpoint on 1-based 'line'"""
+        block = self.document().findBlockByNumber(line - 1)
+        if not block.isValid():
+            return
+        # Deleting lines can leave several cursors on one line; toggling clears them all
+        kept = [c for c in self.breakpointCursors if c.blockNumber() != block.blockNumber()]
+        if len(kept) == len(self.breakpointCursors):
+            kept.append(QTextCursor(block))
+        self.breakpointCursors = kept
+        self.lineNumberArea.update()
+        self.breakpointsChanged.emit()
+
+    def setExecutionLine(self, line):
+        """Tint 1-based 'line' as the next to execute and scroll to it; None clears it"""
+        selections = []
+        block = self.document().findBlockByNumber(line - 1) if line else None
+        if block is not None and block.isValid():
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(EXECUTION_TINT)
+            selection.format.setProperty(QTextFormat.FullWidthSelection, True)
+            selection.cursor = QTextCursor(block)
+            selections.append(selection)
+            self.setTextCursor(QTextCursor(block))
+            self.ensureCursorVisible()
+        self.executionSelections = selections
+        self.highlightCurrentLine()
 
     def lineNumberAreaPaintEvent(self, event):
         painter = QPainter(self.lineNumberArea)
@@ -88,12 +253,33 @@ class LineNumberTextEdit(QPlainTextEdit):
         top = self.blockBoundingGeometry(
             block).translated(self.contentOffset()).top()
         bottom = top + self.blockBoundingRect(block).height()
+        height = self.fontMetrics().height()
+        marker = self.markerWidth()
+        size = height // 2
+        breakpoints = {cursor.blockNumber() for cursor in self.breakpointCursors}
+        heat, scale = self.heat, math.log1p(self.heatMax)
+        heat_left = self.lineNumberArea.width() - HEAT_WIDTH
+        painter.setRenderHint(QPainter.Antialiasing)
 
         while block.isValid() and top <= event.rect().bottom():
             if block.isVisible() and bottom >= event.rect().top():
+                if blockNumber in breakpoints:
+                    # Diagnostic dots are drawn on top of the breakpoint disc
+                    painter.setPen(Qt.NoPen)
+                    painter.setBrush(BREAKPOINT_COLOR)
+                    painter.drawEllipse(2, int(top) + 2, marker - 4, height - 4)
+                items = self.diagnostics.get(blockNumber)
+                if items:
+                    painter.setPen(Qt.NoPen)
+                    painter.setBrush(DIAGNOSTIC_MARKERS[self.severityOf(items)])
+                    painter.drawEllipse((marker - size) // 2, int(top) + (height - size) // 2, size, size)
+                if blockNumber in heat:
+                    # Log scale, so a hot loop does not wash out everything else
+                    painter.fillRect(heat_left, int(top), HEAT_WIDTH, int(bottom - top),
+                                     heatColor(math.log1p(heat[blockNumber]) / scale))
                 number = str(blockNumber + 1)
                 painter.setPen(Qt.black)
-                painter.drawText(0, int(top), self.lineNumberArea.width(), self.fontMetrics().height(),
+                painter.drawText(marker, int(top), heat_left - marker - 1, height,
                                  Qt.AlignRight, number)
 
             block = block.next()
@@ -113,6 +299,7 @@ class Z16IDE(QMainWindow):
         file_menu = menubar.addMenu("File")
         edit_menu = menubar.addMenu("Edit")
         run_menu = menubar.addMenu("Run")
+        debug_menu = menubar.addMenu("Debug")
 
         # File menu actions
         open_asm_action = QAction("Open Assembly", self)
@@ -163,12 +350,77 @@ class Z16IDE(QMainWindow):
         edit_menu.addSeparator()
         edit_menu.addAction(find_replace_action)
 
+        next_problem_action = QAction("Go to Next Problem", self)
+        next_problem_action.setShortcut("F8")
+        next_problem_action.triggered.connect(self.next_problem)
+        edit_menu.addAction(next_problem_action)
+
         # Run menu actions
         run_action = QAction("Run", self)
         run_action.setShortcut("F1")
         run_action.triggered.connect(self.run_code)
         run_menu.addAction(run_action)
 
+        # Run mode: skip the per-instruction trace and only report ecall output,
+        # the final state and an instruction count / elapsed-time summary
+        self.fast_run_action = QAction("Run to Completion (no trace)", self)
+        self.fast_run_action.setCheckable(True)
+        run_menu.addAction(self.fast_run_action)
+
+        # Instruction / wall-clock / output limits applied to every run
+        self.budget = DEFAULT_BUDGET
+        budget_action = QAction("Run Budgets...", self)
+        budget_action.triggered.connect(self.show_budget_dialog)
+        run_menu.addAction(budget_action)
+
+        # Debug menu actions
+        start_debug_action = QAction("Start / Restart Debugging", self)
+        start_debug_action.setShortcut("Ctrl+F5")
+        start_debug_action.triggered.connect(self.start_debugging)
+
+        continue_action = QAction("Continue", self)
+        continue_action.setShortcut("F5")
+        continue_action.triggered.connect(self.continue_debugging)
+
+        step_action = QAction("Step", self)
+        step_action.setShortcut("F10")
+        step_action.triggered.connect(self.step_debugging)
+
+        step_back_action = QAction("Step Back", self)
+        step_back_action.setShortcut("Alt+F10")
+        step_back_action.triggered.connect(self.step_back_debugging)
+
+        reverse_continue_action = QAction("Reverse Continue", self)
+        reverse_continue_action.setShortcut("Alt+F5")
+        reverse_continue_action.triggered.connect(self.reverse_continue_debugging)
+
+        toggle_breakpoint_action = QAction("Toggle Breakpoint", self)
+        toggle_breakpoint_action.setShortcut("F9")
+        toggle_breakpoint_action.triggered.connect(self.toggle_breakpoint)
+
+        save_snapshot_action = QAction("Save Snapshot...", self)
+        save_snapshot_action.triggered.connect(self.save_snapshot)
+
+        resume_snapshot_action = QAction("Resume Snapshot...", self)
+        resume_snapshot_action.triggered.connect(self.resume_snapshot)
+
+        stop_debug_action = QAction("Stop Debugging", self)
+        stop_debug_action.setShortcut("Shift+F5")
+        stop_debug_action.triggered.connect(self.stop_debugging)
+
+        debug_menu.addAction(start_debug_action)
+        debug_menu.addAction(continue_action)
+        debug_menu.addAction(step_action)
+        debug_menu.addAction(step_back_action)
+        debug_menu.addAction(reverse_continue_action)
+        debug_menu.addSeparator()
+        debug_menu.addAction(toggle_breakpoint_action)
+        debug_menu.addSeparator()
+        debug_menu.addAction(save_snapshot_action)
+        debug_menu.addAction(resume_snapshot_action)
+        debug_menu.addSeparator()
+        debug_menu.addAction(stop_debug_action)
+
         # Main layout
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -182,52 +434,75 @@ class Z16IDE(QMainWindow):
         self.assembly_input = LineNumberTextEdit()
         left_layout.addWidget(input_label)
         left_layout.addWidget(self.assembly_input)
-
-        # Disassembler output
-        output_label = QLabel("Disassembler Text Output")
-        self.disassembler_output = QTextEdit()
-        self.disassembler_output.setReadOnly(True)
-        left_layout.addWidget(output_label)
-        left_layout.addWidget(self.disassembler_output)
+        self.highlighter = Z16Highlighter(self.assembly_input.document())
+
+        # Disassembler output, and the memory and profile of the last run beside it
+        self.disassembler_output = TraceView()
+        self.memory_view = MemoryView()
+        self.profile_view = ProfileView()
+        self.output_tabs = QTabWidget()
+        self.output_tabs.addTab(self.disassembler_output, "Disassembler Text Output")
+        self.output_tabs.addTab(self.memory_view, "Memory")
+        self.output_tabs.addTab(self.profile_view, "Profile")
+        left_layout.addWidget(self.output_tabs)
 
         # Right side - register display
         right_layout = QVBoxLayout()
-        register_label = QLabel("Register")
+        register_label = QLabel("Registers")
         register_label.setAlignment(Qt.AlignCenter)
-        value_label = QLabel("Value")
-        value_label.setAlignment(Qt.AlignCenter)
-
-        header_layout = QHBoxLayout()
-        header_layout.addWidget(register_label)
-        header_layout.addWidget(value_label)
-        right_layout.addLayout(header_layout)
-
-        # Register table
-        self.register_table = QTableWidget(9, 2)  # 9 registers including PC
-        self.register_table.setHorizontalHeaderLabels(["Register", "Value"])
-        self.register_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.register_table.verticalHeader().setVisible(False)
-
-        # Initialize register display
-        registers = ["t0", "ra", "sp", "s0", "s1", "t1", "a0", "a1", "PC"]
-        for i, reg in enumerate(registers):
-            self.register_table.setItem(i, 0, QTableWidgetItem(reg))
-            self.register_table.setItem(i, 1, QTableWidgetItem("0x0000"))
+        right_layout.addWidget(register_label)
 
-        right_layout.addWidget(self.register_table)
+        # Register table (8 registers and the PC); registers changed by the
+        # last update are highlighted
+        self.register_view = RegisterView()
+        self.registers = self.register_view.model()
+        right_layout.addWidget(self.register_view)
 
         # Add layouts to main layout
         main_layout.addLayout(left_layout, 3)
         main_layout.addLayout(right_layout, 1)
 
-        # Temporary file paths
-        self.asm_file = "temp.asm"
-        self.bin_file = "temp.bin"
-
-        # Get the absolute path based on script location
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        self.assembler_path = os.path.join(script_dir, "z16asm.exe")
-        self.disassembler_path = os.path.join(script_dir, "z16sim.exe")
+        # Binary file opened through File -> Open Binary
+        self.bin_file = None
+
+        # In-process assembler and simulator results of the last run
+        self.assembly = None
+        self.assembly_error = None
+        self.simulator = None
+        # Source line of each PC of the program last run or debugged
+        self.source_map = SourceMap()
+        self.disassembler_output.pcActivated.connect(self.show_pc_line)
+        self.profile_view.pcActivated.connect(self.show_pc_line)
+
+        # Re-assemble and re-check the buffer once typing pauses; only changed
+        # lines are re-encoded and re-checked, and the checks run on a worker
+        self.assembler = IncrementalAssembler()
+        self.linter = Linter()
+        self.diagnostics = []
+        self.edit_timer = QTimer(self)
+        self.edit_timer.setSingleShot(True)
+        self.edit_timer.setInterval(EDIT_DELAY)
+        self.edit_timer.timeout.connect(self.buffer_edited)
+        self.assembly_input.textChanged.connect(self.edit_timer.start)
+        self.lint_scheduler = RunScheduler()
+        self.lint_timer = QTimer(self)
+        self.lint_timer.setInterval(30)
+        self.lint_timer.timeout.connect(self.poll_lint)
+
+        # Runs execute on a worker thread; a new run cancels the previous one
+        # and the poll timer merges results back on the UI thread
+        self.scheduler = RunScheduler()
+        self.run_timer = QTimer(self)
+        self.run_timer.setInterval(30)
+        self.run_timer.timeout.connect(self.poll_run)
+
+        # Debugger: one simulator session kept warm for the whole IDE session;
+        # a continue runs on the run worker, steps run on the UI thread
+        self.debug_chunk = TraceChunk()
+        self.debug_job_output = None  # [chunk] of a continue running on the worker
+        self.session = DebugSession(write=self.write_debug_output)
+        self.debugging = False
+        self.assembly_input.breakpointsChanged.connect(self.sync_breakpoints)
 
         # Status bar for messages
         self.statusBar().showMessage("Ready")
@@ -235,6 +510,11 @@ class Z16IDE(QMainWindow):
         # Now apply fonts after all widgets are created
         self.setup_fonts()
 
+        # Error/warning summary of the live checks, kept beside status messages
+        self.diagnostics_label = QLabel()
+        self.diagnostics_label.setFont(QFont("Segoe UI", 9))
+        self.statusBar().addPermanentWidget(self.diagnostics_label)
+
     def setup_fonts(self):
         """Configure fonts for the entire application"""
         # Create font objects
@@ -257,7 +537,7 @@ class Z16IDE(QMainWindow):
         # Table styling
         header_font = QFont("Segoe UI", 10)
         header_font.setBold(True)
-        self.register_table.horizontalHeader().setFont(header_font)
+        self.register_view.horizontalHeader().setFont(header_font)
 
         # Apply stylesheet for consistent styling
         self.setStyleSheet("""
@@ -275,7 +555,7 @@ class Z16IDE(QMainWindow):
                 font-size: 11pt;
                 line-height: 1.2;
             }
-            QTableWidget {
+            RegisterView {
                 font-family: 'Segoe UI';
                 font-size: 10pt;
             }
@@ -285,35 +565,6 @@ class Z16IDE(QMainWindow):
             }
         """)
 
-    def is_valid_instruction(self, line):
-        """Check if a line contains a valid Z16 instruction"""
-        # Extract the instruction part (before any potential operands)
-        parts = line.split()
-        if not parts:
-            return True  # Empty line is valid
-
-        instruction = parts[0].lower()
-
-        # List of valid Z16 instructions
-        valid_instructions = [
-            "add", "sub", "slt", "sltu", "sll", "srl", "sra", "or", "and", "xor", "mv", "jr", "jalr",
-            "addi", "slti", "sltui", "slli", "srli", "srai", "ori", "andi", "xori", "li",
-            "beq", "bne", "bz", "bnz", "blt", "bge", "bltu", "bgeu",
-            "lb", "lw", "lbu", "sb", "sw",
-            "j", "jal", "lui", "auipc", "ecall"
-        ]
-
-        # Valid directives
-        valid_directives = [".text", ".data", ".org",
-                            ".asciiz", ".byte", ".word", ".space"]
-
-        # Check if it's a label definition (ends with a colon)
-        if instruction.endswith(':'):
-            return True
-
-        # Check if it's a valid instruction or directive
-        return instruction in valid_instructions or instruction in valid_directives
-
     def undo(self):
         self.assembly_input.undo()
 
@@ -333,7 +584,7 @@ class Z16IDE(QMainWindow):
         """Show the find and replace dialog"""
         find_dialog = QDialog(self)
         find_dialog.setWindowTitle("Find and Replace")
-        find_dialog.setFixedSize(400, 200)
+        find_dialog.setFixedSize(440, 230)
 
         layout = QVBoxLayout()
 
@@ -363,85 +614,175 @@ class Z16IDE(QMainWindow):
         button_layout.addWidget(replace_button)
         button_layout.addWidget(replace_all_button)
 
-        # Case sensitivity option
+        # Matching options
         self.case_sensitive = QCheckBox("Case sensitive")
+        self.whole_word = QCheckBox("Whole word")
+        self.use_regex = QCheckBox("Regular expression")
+        options_layout = QHBoxLayout()
+        options_layout.addWidget(self.case_sensitive)
+        options_layout.addWidget(self.whole_word)
+        options_layout.addWidget(self.use_regex)
+
+        # Match count, or why the pattern is invalid
+        self.match_count = QLabel("")
+        self.match_count.setFont(QFont("Segoe UI", 9))
+
+        # Every match is highlighted and counted as the query changes
+        self.find_text.textChanged.connect(self.refresh_search)
+        for option in (self.case_sensitive, self.whole_word, self.use_regex):
+            option.toggled.connect(self.refresh_search)
+        find_dialog.finished.connect(lambda _: self.assembly_input.setSearchMatches([]))
 
         # Add all layouts to main layout
         layout.addLayout(find_layout)
         layout.addLayout(replace_layout)
-        layout.addWidget(self.case_sensitive)
+        layout.addLayout(options_layout)
+        layout.addWidget(self.match_count)
         layout.addLayout(button_layout)
 
         find_dialog.setLayout(layout)
         self.find_dialog = find_dialog  # Store reference to keep dialog alive
+        self.search_index = None
         find_dialog.show()
+        self.refresh_search()
 
-    def find_text_in_editor(self):
-        """Find the text in the editor"""
-        find_text = self.find_text.text()
-        if not find_text:
-            return
+    def show_budget_dialog(self):
+        """Show the dialog that sets the run budgets (0 = unlimited)"""
+        budget_dialog = QDialog(self)
+        budget_dialog.setWindowTitle("Run Budgets")
 
-        # Create a QTextDocument.FindFlags object
-        flags = QTextDocument.FindFlag(0)  # Initialize with 0 for PyQt5 v5.5
-        if self.case_sensitive.isChecked():
-            flags |= QTextDocument.FindCaseSensitively
+        layout = QVBoxLayout()
+        fields = []
+        for label, option, value in (("Max instructions:", "--max-instructions", self.budget.instructions),
+                                     ("Time limit (s):", "--timeout", self.budget.seconds),
+                                     ("Max output (bytes):", "--max-output", self.budget.output)):
+            row = QHBoxLayout()
+            edit = QLineEdit(str(value) if value else "0")
+            row.addWidget(QLabel(label))
+            row.addWidget(edit)
+            layout.addLayout(row)
+            fields.append((option, edit))
+
+        def apply():
+            budget = self.budget
+            for option, edit in fields:
+                try:
+                    budget = parse_budget_option(f"{option}={edit.text().strip()}", budget)
+                except ValueError:
+                    edit.setStyleSheet("background-color: #ffdddd;")
+                    return
+            self.budget = budget
+            budget_dialog.accept()
 
-        # Try to find the text using the document's find method
-        cursor = self.assembly_input.textCursor()
-        document = self.assembly_input.document()
+        button_layout = QHBoxLayout()
+        ok_button = QPushButton("OK")
+        ok_button.clicked.connect(apply)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(budget_dialog.reject)
+        button_layout.addWidget(ok_button)
+        button_layout.addWidget(cancel_button)
+        layout.addLayout(button_layout)
 
-        # Try to find from current position
-        found_cursor = document.find(find_text, cursor, flags)
+        budget_dialog.setLayout(layout)
+        self.budget_dialog = budget_dialog  # Store reference to keep dialog alive
+        budget_dialog.show()
+
+    def current_search(self):
+        """
+        Match index of the Find query over the current buffer, rebuilt only
+        when the query, its options or the text changed; None if the query
+        is empty or not a valid pattern.
+        """
+        query = self.find_text.text()
+        if not query:
+            return None
+        document = self.assembly_input.document()
+        key = (query, self.case_sensitive.isChecked(), self.whole_word.isChecked(),
+               self.use_regex.isChecked(), document.revision())
+        if self.search_index is None or self.search_index[0] != key:
+            try:
+                pattern = compile_query(query, regex=key[3], whole_word=key[2], case_sensitive=key[1])
+            except re.error as e:
+                self.search_index = (key, None, f"Invalid pattern: {e.msg}")
+            else:
+                self.search_index = (key, MatchIndex(pattern, document.toPlainText()), None)
+        return self.search_index[1]
+
+    def refresh_search(self):
+        """Recount and re-highlight the Find query's matches"""
+        dialog = getattr(self, "find_dialog", None)
+        if dialog is None or not dialog.isVisible():
+            return
+        index = self.current_search()
+        if index is None:
+            error = self.search_index[2] if self.find_text.text() else None
+            self.match_count.setText(error or "")
+            self.match_count.setStyleSheet("color: #C00000;")
+            self.assembly_input.setSearchMatches([])
+            return
+        self.match_count.setText(f"{len(index)} match{'es' * (len(index) != 1)}")
+        self.match_count.setStyleSheet("")
+        self.assembly_input.setSearchMatches(index.spans)
 
-        if found_cursor.isNull():
-            # If not found, try from beginning
-            cursor.setPosition(0)
-            found_cursor = document.find(find_text, cursor, flags)
+    def select_match(self, index, i):
+        start, end = index.spans[i]
+        cursor = self.assembly_input.textCursor()
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        self.assembly_input.setTextCursor(cursor)
+        self.match_count.setText(f"{i + 1} of {len(index)} matches")
 
-        if not found_cursor.isNull():
-            self.assembly_input.setTextCursor(found_cursor)
+    def find_text_in_editor(self):
+        """Select the next match after the cursor, wrapping around to the first"""
+        index = self.current_search()
+        if index is None:
+            return
+        i = index.next_after(self.assembly_input.textCursor().position())
+        if i is None:
+            self.match_count.setText("No matches")
+            return
+        self.select_match(index, i)
 
     def replace_text_in_editor(self):
-        """Replace the selected text in the editor"""
+        """Replace the selected match, then select the next one"""
+        index = self.current_search()
+        if index is None:
+            return
         cursor = self.assembly_input.textCursor()
-        if cursor.hasSelection():
-            cursor.insertText(self.replace_text.text())
-        else:
-            # If no selection, find the next occurrence
-            self.find_text_in_editor()
+        i = index.find(cursor.selectionStart(), cursor.selectionEnd())
+        if i is not None:
+            try:
+                replacement = index.replacement(i, self.replace_text.text(), self.use_regex.isChecked())
+            except re.error as e:
+                self.match_count.setText(f"Invalid replacement: {e.msg}")
+                return
+            cursor.insertText(replacement)
+        self.find_text_in_editor()
+        self.refresh_search()
 
     def replace_all_in_editor(self):
-        """Replace all occurrences of the text in the editor"""
-        find_text = self.find_text.text()
-        replace_text = self.replace_text.text()
-        if not find_text:
+        """Replace every match as a single edit (one undo step)"""
+        index = self.current_search()
+        if index is None:
+            return
+        try:
+            replacements = index.replacements(self.replace_text.text(), self.use_regex.isChecked())
+        except re.error as e:
+            self.match_count.setText(f"Invalid replacement: {e.msg}")
             return
 
-        # Track replacements
-        replacements = 0
-
-        # Create a QTextDocument.FindFlags object
-        flags = QTextDocument.FindFlag(0)  # Initialize with 0 for PyQt5 v5.5
-        if self.case_sensitive.isChecked():
-            flags |= QTextDocument.FindCaseSensitively
-
-        # Start from beginning
-        cursor = self.assembly_input.textCursor()
-        cursor.setPosition(0)
-        self.assembly_input.setTextCursor(cursor)
-
-        # Find and replace all occurrences
-        document = self.assembly_input.document()
-        cursor = document.find(find_text, 0, flags)
-
-        while not cursor.isNull():
-            cursor.insertText(replace_text)
-            replacements += 1
-            cursor = document.find(find_text, cursor, flags)
+        # Last match first, so the offsets of the ones before stay valid
+        cursor = QTextCursor(self.assembly_input.document())
+        cursor.beginEditBlock()
+        for start, end, text in replacements:
+            cursor.setPosition(start)
+            cursor.setPosition(end, QTextCursor.KeepAnchor)
+            cursor.insertText(text)
+        cursor.endEditBlock()
 
         # Show number of replacements
-        self.statusBar().showMessage(f"Replaced {replacements} occurrences")
+        self.statusBar().showMessage(f"Replaced {len(replacements)} occurrences")
+        self.refresh_search()
 
     def open_assembly_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -468,16 +809,17 @@ class Z16IDE(QMainWindow):
                 self.statusBar().showMessage(
                     f"Opened binary file: {file_path}")
 
-                # Clear previous input and output
+                # Drop any run in progress, clear previous input and output
+                self.stop_debugging()
+                self.scheduler.cancel()
                 self.assembly_input.clear()
                 self.assembly_input.setPlaceholderText(
                     f"Binary file loaded directly: {os.path.basename(file_path)}")
                 self.disassembler_output.clear()
 
                 # Reset register values
-                for i in range(self.register_table.rowCount()):
-                    self.register_table.setItem(
-                        i, 1, QTableWidgetItem("0x0000"))
+                self.registers.reset()
+                self.memory_view.model.reset()
 
                 # Run disassembler directly on the binary file
                 self.run_disassembler_on_binary()
@@ -500,25 +842,22 @@ class Z16IDE(QMainWindow):
                 self.statusBar().showMessage(f"Error saving file: {str(e)}")
 
     def validate_assembly_code(self, code):
-        lines = code.split('\n')
-        errors = []
-
-        for i, line in enumerate(lines):
-            # Strip comments and whitespace
-            line = line.split('#')[0].strip()
-            if not line:
-                continue
-
-            # Check for valid instructions and syntax
-            if not self.is_valid_instruction(line):
-                errors.append((i+1, f"Invalid instruction: {line}"))
-
-        return errors
+        """(line, message) for each error in 'code'; warnings do not stop a run"""
+        self.show_diagnostics(self.linter.lint(code.split('\n')))
+        return [(d.line, d.message) for d in self.diagnostics if d.severity == ERROR]
 
     def run_code(self):
-        # Clear previous output
+        # Drop any run still in progress and clear previous output
+        self.stop_debugging()
+        self.scheduler.cancel()
         self.disassembler_output.clear()
 
+        if not self.assemble_for_run():
+            return
+        self.run_disassembler()
+
+    def assemble_for_run(self):
+        """Check and assemble the buffer; shows what is wrong and returns False if it cannot run"""
         # Check code for syntax errors
         code = self.assembly_input.toPlainText()
         errors = self.validate_assembly_code(code)
@@ -528,174 +867,440 @@ class Z16IDE(QMainWindow):
             for line_num, error_msg in errors:
                 self.disassembler_output.append(
                     f"Line {line_num}: {error_msg}")
+            self.assembly_input.jumpToLine(errors[0][0])
             self.statusBar().showMessage("Syntax errors found")
-            return
+            return False
 
         self.statusBar().showMessage("Running assembly code...")
 
-        # Save assembly to temp file
-        try:
-            with open(self.asm_file, 'w') as file:
-                file.write(self.assembly_input.toPlainText())
-        except Exception as e:
-            self.disassembler_output.append(
-                f"Error creating assembly file: {str(e)}")
-            self.statusBar().showMessage("Error running code")
-            return
-
-        # Run assembler process
-        assembler_process = QProcess()
-        assembler_process.setProcessChannelMode(QProcess.MergedChannels)
-
-        # Connect signals
-        assembler_process.finished.connect(
-            lambda exit_code, exit_status: self.run_disassembler())
-        assembler_process.readyReadStandardOutput.connect(
-            lambda: self.handle_process_output(assembler_process)
-        )
+        # The buffer is already assembled in memory; this only picks up
+        # lines edited since typing last paused
+        self.assemble_buffer()
+        if self.assembly_error is not None:
+            self.disassembler_output.append(str(self.assembly_error))
+            if self.assembly_error.line_no:
+                # Shown with the live diagnostics until the next check replaces them
+                self.assembly_input.setDiagnostics(self.diagnostics + [
+                    Diagnostic(self.assembly_error.line_no, ERROR, self.assembly_error.message)])
+                self.assembly_input.jumpToLine(self.assembly_error.line_no)
+            self.statusBar().showMessage("Assembly failed")
+            return False
+        return True
+
+    def buffer_blocks(self):
+        """The editor buffer as (revision, text) pairs, one per block"""
+        blocks = []
+        block = self.assembly_input.document().begin()
+        while block.isValid():
+            blocks.append((block.revision(), block.text()))
+            block = block.next()
+        return blocks
 
-        # Start the assembler
+    def assemble_buffer(self, blocks=None):
+        """Incrementally re-assemble the editor buffer"""
+        if blocks is None:
+            blocks = self.buffer_blocks()
         try:
-            assembler_process.start(self.assembler_path, [
-                                    self.asm_file, "-o", self.bin_file])
-        except Exception as e:
-            self.disassembler_output.append(
-                f"Error running assembler: {str(e)}")
-            self.statusBar().showMessage("Error running assembler")
-
-    def handle_process_output(self, process):
-        """Handle output from a QProcess"""
-        output = bytes(process.readAllStandardOutput()
-                       ).decode('utf-8', errors='replace')
-
-        # Check for error patterns in the output
-        error_pattern = re.compile(r'error.*line\s+(\d+)', re.IGNORECASE)
-        for line in output.split('\n'):
-            match = error_pattern.search(line)
-            if match:
-                line_num = match.group(1)
-                self.highlight_error_line(int(line_num))
-
-        self.disassembler_output.append(output)
-
-    def highlight_error_line(self, line_num):
-        """Highlight an error line in the editor"""
-        # Create a text cursor
-        cursor = self.assembly_input.textCursor()
-
-        # Move to the beginning of the document
-        cursor.movePosition(QTextCursor.Start)
-
-        # Move down to the error line
-        for _ in range(line_num - 1):
-            cursor.movePosition(QTextCursor.Down)
-
-        # Select the line
-        cursor.movePosition(QTextCursor.EndOfLine, QTextCursor.KeepAnchor)
-
-        # Apply formatting (e.g., red background)
-        format = QTextCharFormat()
-        format.setBackground(QColor("red"))
-        format.setForeground(QColor("white"))
-
-        # Apply the format
-        cursor.mergeCharFormat(format)
+            self.assembly = self.assembler.update(blocks)
+            self.assembly_error = None
+        except AssemblerError as e:
+            self.assembly = None
+            self.assembly_error = e
+
+    def buffer_edited(self):
+        """Typing paused: re-assemble the buffer and re-check it on the lint worker"""
+        self.refresh_search()
+        # Execution counts were for the text as it was run
+        self.assembly_input.setHeatMap({})
+        blocks = self.buffer_blocks()
+        self.assemble_buffer(blocks)
+        texts = [text for _, text in blocks]
+        self.lint_scheduler.submit(lambda token, emit: self.linter.lint(texts),
+                                   on_done=self.show_diagnostics)
+        self.lint_timer.start()
+
+    def poll_lint(self):
+        """Deliver the diagnostics of the latest check; stale ones are dropped"""
+        self.lint_scheduler.poll()
+        if not self.lint_scheduler.busy:
+            self.lint_timer.stop()
+
+    def show_diagnostics(self, diagnostics):
+        """Mark the live checks' results in the editor and summarize them in the status bar"""
+        self.diagnostics = diagnostics
+        self.assembly_input.setDiagnostics(diagnostics)
+        if not diagnostics:
+            self.diagnostics_label.clear()
+            self.diagnostics_label.setToolTip("")
+            return
+        errors = sum(d.severity == ERROR for d in diagnostics)
+        warnings = len(diagnostics) - errors
+        first = next((d for d in diagnostics if d.severity == ERROR), diagnostics[0])
+        self.diagnostics_label.setText(
+            f"{errors} error{'s' * (errors != 1)}, {warnings} warning{'s' * (warnings != 1)}"
+            f" - line {first.line}: {first.message}")
+        self.diagnostics_label.setStyleSheet("color: #C00000;" if errors else "color: #A06000;")
+        self.diagnostics_label.setToolTip("\n".join(
+            f"Line {d.line}: {d.severity}: {d.message}" for d in diagnostics[:30]))
+
+    def next_problem(self):
+        """Move the cursor to the next line with a diagnostic, wrapping around"""
+        if not self.diagnostics:
+            self.statusBar().showMessage("No problems found")
+            return
+        line = self.assembly_input.textCursor().blockNumber() + 1
+        target = next((d for d in self.diagnostics if d.line > line), self.diagnostics[0])
+        self.assembly_input.jumpToLine(target.line)
+        self.statusBar().showMessage(f"Line {target.line}: {target.message}")
 
     def run_disassembler(self):
-        """Run the disassembler on the generated binary file"""
+        """Run the simulator on the freshly assembled image"""
         self.statusBar().showMessage("Running disassembler...")
-
-        # Run disassembler process
-        disassembler_process = QProcess()
-        disassembler_process.setProcessChannelMode(QProcess.MergedChannels)
-
-        # Connect signals
-        disassembler_process.readyReadStandardOutput.connect(
-            lambda: self.process_disassembler_output(disassembler_process)
-        )
-        disassembler_process.finished.connect(
-            lambda exit_code, exit_status: self.statusBar().showMessage("Execution complete")
-        )
-
-        # Start the disassembler
-        try:
-            disassembler_process.start(self.disassembler_path, [self.bin_file])
-        except Exception as e:
-            self.disassembler_output.append(
-                f"Error running disassembler: {str(e)}")
-            self.statusBar().showMessage("Error running disassembler")
+        self.memory_view.model.set_symbols(
+            {name: symbol.address for name, symbol in self.assembly.symbols.items()})
+        self.source_map = self.assembly.source_map()
+        self.run_simulator(self.assembly.image, "Execution complete")
 
     def run_disassembler_on_binary(self):
-        """Run the disassembler directly on a loaded binary file"""
+        """Run the simulator directly on a loaded binary file"""
         self.statusBar().showMessage("Disassembling binary file...")
-
-        # Run disassembler process
-        disassembler_process = QProcess()
-        disassembler_process.setProcessChannelMode(QProcess.MergedChannels)
-
-        # Connect signals
-        disassembler_process.readyReadStandardOutput.connect(
-            lambda: self.process_disassembler_output(disassembler_process)
-        )
-        disassembler_process.finished.connect(
-            lambda exit_code, exit_status: self.statusBar().showMessage("Disassembly complete")
-        )
-
-        # Start the disassembler
         try:
-            disassembler_process.start(self.disassembler_path, [self.bin_file])
-        except Exception as e:
+            with open(self.bin_file, 'rb') as file:
+                image = file.read()
+        except OSError as e:
             self.disassembler_output.append(
-                f"Error running disassembler: {str(e)}")
+                f"Error running disassembler: {e.strerror}")
             self.statusBar().showMessage("Error running disassembler")
+            return
+        self.memory_view.model.set_symbols({})
+        self.source_map = SourceMap()
+        self.run_simulator(image, "Disassembly complete")
+
+    def run_simulator(self, image, done_message):
+        """Run a memory image on a worker thread, superseding any run in progress"""
+        fast = self.fast_run_action.isChecked()
+        budget = self.budget
+
+        def job(token, emit):
+            chunk = TraceChunk()
+            simulator = Z16Simulator(write=lambda text: chunk.write(text), max_output=budget.output)
+            loaded = simulator.load(image)
+            chunk.write(f"Loaded {loaded} bytes into memory\n")
+
+            # Run in slices so a newer run can cancel this one between them;
+            # the simulator's watchdog enforces the time limit inside a slice
+            start = time.perf_counter()
+            deadline = start + budget.seconds if budget.seconds else None
+            limit = budget.instructions
+            reason = None
+            while limit is None or simulator.instruction_count < limit:
+                count = RUN_SLICE if limit is None else min(RUN_SLICE, limit - simulator.instruction_count)
+                reason = simulator.run(count, None if fast else chunk.trace, deadline)
+                chunk.state = (tuple(simulator.regs), simulator.pc, bytes(simulator.memory))
+                emit(chunk)
+                chunk = TraceChunk()
+                token.check()
+                if reason is not None:
+                    break
+            elapsed = time.perf_counter() - start
+            chunk.write(describe_stop(reason, simulator.pc, simulator.instruction_count, budget))
+            chunk.write(simulator.register_state())
+            if fast:
+                chunk.write(describe_summary(simulator.instruction_count, elapsed))
+            emit(chunk)
+            return simulator, elapsed, simulator.profile()
+
+        def done(result):
+            simulator, elapsed, profile = result
+            # The registers already show the state of the last slice
+            self.simulator = simulator
+            message = (f"{done_message}: {simulator.instruction_count} instructions "
+                       f"in {elapsed * 1000:.1f} ms")
+            line = self.source_map.line_of(simulator.pc)
+            if simulator.stop_reason != STOP_ECALL and line:
+                # A run that did not end with an exit ecall (a limit, a zero
+                # instruction): mark where it stopped
+                stop = describe_stop(simulator.stop_reason, simulator.pc,
+                                     simulator.instruction_count, budget).strip()
+                self.assembly_input.setDiagnostics(self.diagnostics + [Diagnostic(line, ERROR, stop)])
+                message += f" - stopped at line {line}"
+            self.show_profile(profile)
+            self.statusBar().showMessage(message)
+
+        self.simulator = None
+        self.registers.reset()
+        self.memory_view.model.reset()
+        self.show_profile(None)
+        self.scheduler.submit(job, on_output=self.show_run_output,
+                              on_done=done, on_error=self.run_failed)
+        self.run_timer.start()
+
+    def poll_run(self):
+        """Deliver results of the current run; stop polling once it has finished"""
+        self.scheduler.poll()
+        if not self.scheduler.busy:
+            self.run_timer.stop()
+
+    def run_failed(self, error):
+        self.disassembler_output.append(f"Error running simulator: {error}")
+        self.statusBar().showMessage("Error running simulator")
+
+    def show_run_output(self, chunks):
+        """Append a run's output and show registers and memory as of its latest slice"""
+        self.disassembler_output.append_chunks(chunks)
+        state = next((chunk.state for chunk in reversed(chunks) if chunk.state is not None), None)
+        if state is not None:
+            # Both highlight what changed since the previous refresh
+            regs, pc, memory = state
+            self.registers.set_registers(regs, pc)
+            self.memory_view.model.set_memory(memory)
+
+    # -----------------------
+    # Debugging
+    # -----------------------
+
+    def start_debugging(self):
+        """Load the program into the debug session, paused before its first instruction"""
+        self.scheduler.cancel()
+        self.disassembler_output.clear()
+        if self.bin_file and not self.assembly_input.toPlainText().strip():
+            # A binary opened directly: no source lines to map addresses to
+            try:
+                with open(self.bin_file, 'rb') as file:
+                    image = file.read()
+            except OSError as e:
+                self.disassembler_output.append(f"Error opening binary file: {e.strerror}")
+                self.statusBar().showMessage("Error opening binary file")
+                return
+            symbols, self.source_map = {}, SourceMap()
+        else:
+            if not self.assemble_for_run():
+                return
+            image = self.assembly.image
+            symbols = {name: symbol.address for name, symbol in self.assembly.symbols.items()}
+            self.source_map = self.assembly.source_map()
+
+        # Waits for a cancelled continue to finish its slice
+        loaded = self.session.load(image)
+        self.session.simulator.max_output = self.budget.output
+        self.debugging = True
+        self.session.set_breakpoints(self.breakpoint_addresses())
+        self.debug_chunk = TraceChunk()
+        self.debug_job_output = None
+        self.debug_chunk.write(f"Loaded {loaded} bytes into memory\n")
+        self.memory_view.model.set_symbols(symbols)
+        self.registers.reset()
+        self.memory_view.model.reset()
+        self.show_debug_state("Debugging: paused before the first instruction")
+
+    def save_snapshot(self):
+        """Save the paused debug session to a snapshot file"""
+        if not self.debugging or self.scheduler.busy:
+            self.statusBar().showMessage("Pause a debug session to save a snapshot of it")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Save Snapshot", "", "Z16 Snapshots (*.z16s);;All Files (*)")
+        if not file_path:
+            return
+        try:
+            self.session.save_snapshot(file_path)
+        except SessionError as e:
+            self.statusBar().showMessage(f"Error saving snapshot: {e}")
+            return
+        self.statusBar().showMessage(f"Saved snapshot: {file_path}")
 
-    def process_disassembler_output(self, process):
-        """Process and display output from the disassembler"""
-        output = bytes(process.readAllStandardOutput()
-                       ).decode('utf-8', errors='replace')
-        self.disassembler_output.append(output)
+    def resume_snapshot(self):
+        """Debug from a snapshot; the editor's program supplies source lines and labels"""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Resume Snapshot", "", "Z16 Snapshots (*.z16s);;All Files (*)")
+        if not file_path:
+            return
+        self.scheduler.cancel()
+        try:
+            self.session.resume(file_path)
+        except SessionError as e:
+            self.statusBar().showMessage(f"Error resuming snapshot: {e}")
+            return
+        self.disassembler_output.clear()
+        symbols, self.source_map = {}, SourceMap()
+        if self.assembly_input.toPlainText().strip():
+            self.assemble_buffer()
+            if self.assembly is not None:
+                symbols = {name: symbol.address for name, symbol in self.assembly.symbols.items()}
+                self.source_map = self.assembly.source_map()
+        self.session.simulator.max_output = self.budget.output
+        self.debugging = True
+        self.session.set_breakpoints(self.breakpoint_addresses())
+        simulator = self.session.simulator
+        self.debug_chunk = TraceChunk()
+        self.debug_job_output = None
+        self.debug_chunk.write(f"Resumed from snapshot at 0x{simulator.pc:04X} "
+                               f"after {simulator.instruction_count} instructions\n")
+        self.memory_view.model.set_symbols(symbols)
+        self.registers.reset()
+        self.memory_view.model.reset()
+        self.show_debug_state(f"Debugging: resumed {os.path.basename(file_path)}")
+
+    def stop_debugging(self):
+        if not self.debugging:
+            return
+        self.scheduler.cancel()
+        self.debugging = False
+        self.assembly_input.setExecutionLine(None)
+        self.statusBar().showMessage("Debugging stopped")
+
+    def step_debugging(self):
+        """Execute one instruction; starts debugging if no session is active"""
+        if not self.debugging:
+            self.start_debugging()
+            return
+        if self.scheduler.busy:
+            return
+        if self.session.stopped:
+            self.statusBar().showMessage("The program has stopped; restart debugging to run it again")
+            return
+        simulator = self.session.simulator
+        inst = simulator.fetch()
+        if inst != 0:
+            # A zero word is not traced; step() reports it as the end of the program
+            self.debug_chunk.trace(simulator.pc, inst)
+        self.show_debug_state(self.debug_stop_message(self.session.step()))
+
+    def continue_debugging(self):
+        """Run to the next breakpoint or the end of the program on the run worker"""
+        if not self.debugging:
+            self.start_debugging()
+            if not self.debugging:
+                return
+        if self.scheduler.busy:
+            return
+        if self.session.stopped:
+            self.statusBar().showMessage("The program has stopped; restart debugging to run it again")
+            return
+        session = self.session
+        seconds = self.budget.seconds
+        # The job's own output chunk; self.debug_chunk belongs to the UI thread
+        output = [TraceChunk()]
+
+        def job(token, emit):
+            # Slices let breakpoint changes and cancellation in between them;
+            # running out of time pauses the program rather than ending it
+            deadline = time.perf_counter() + seconds if seconds else None
+            while True:
+                reason = session.cont(RUN_SLICE, deadline)
+                token.check()
+                chunk, output[0] = output[0], TraceChunk()
+                regs, pc = session.registers()
+                chunk.state = (regs, pc, bytes(session.simulator.memory))
+                emit(chunk)
+                if reason is not None:
+                    return reason
+
+        def done(reason):
+            self.debug_job_output = None
+            self.show_debug_state(self.debug_stop_message(reason))
+
+        def failed(error):
+            self.debug_job_output = None
+            self.run_failed(error)
+
+        self.debug_job_output = output
+        self.assembly_input.setExecutionLine(None)
+        self.statusBar().showMessage("Running...")
+        self.scheduler.submit(job, on_output=self.show_run_output, on_done=done, on_error=failed)
+        self.run_timer.start()
+
+    def step_back_debugging(self):
+        """Undo the last instruction: the session replays from its nearest checkpoint"""
+        if not self.debugging or self.scheduler.busy:
+            return
+        if not self.session.step_back():
+            self.statusBar().showMessage("At the start of the program")
+            return
+        self.show_debug_state(self.rewind_message())
 
-        # Parse register values from output
-        self.parse_register_values(output)
+    def reverse_continue_debugging(self):
+        """Go back to the last breakpoint hit on the run worker (it may replay the whole run)"""
+        if not self.debugging or self.scheduler.busy:
+            return
+        session = self.session
+
+        def job(token, emit):
+            return session.reverse_cont()
+
+        self.assembly_input.setExecutionLine(None)
+        self.statusBar().showMessage("Going back...")
+        self.scheduler.submit(job, on_done=lambda reason: self.show_debug_state(self.rewind_message(reason)),
+                              on_error=self.run_failed)
+        self.run_timer.start()
+
+    def rewind_message(self, reason=None):
+        """Status bar message after stepping back or a reverse continue"""
+        simulator = self.session.simulator
+        pc, count = simulator.pc, simulator.instruction_count
+        if reason == STOP_BREAKPOINT:
+            return f"Back at breakpoint 0x{pc:04X} after {count} instructions"
+        if count == self.session.history.start:
+            return "Back at the start of the program"
+        return f"Back at 0x{pc:04X} after {count} instructions"
+
+    def debug_stop_message(self, reason):
+        """Report why a step or continue stopped in the output; returns the status bar message"""
+        simulator = self.session.simulator
+        pc, count = simulator.pc, simulator.instruction_count
+        if reason is None:
+            return f"Paused at 0x{pc:04X} after {count} instructions"
+        if reason == STOP_BREAKPOINT:
+            self.debug_chunk.write(describe_stop(reason, pc, count, self.budget))
+            return f"Breakpoint at 0x{pc:04X} after {count} instructions"
+        if reason == STOP_TIME_LIMIT:
+            self.debug_chunk.write(f"Paused at 0x{pc:04X}: time limit ({self.budget.seconds:g} s) reached\n")
+            return f"Paused at 0x{pc:04X} after {count} instructions (time limit); Continue resumes"
+        self.debug_chunk.write(describe_stop(reason, pc, count, self.budget))
+        self.debug_chunk.write(simulator.register_state())
+        return f"Program stopped after {count} instructions"
+
+    def write_debug_output(self, text):
+        """Debug session output: to the running continue's own chunk, else to debug_chunk"""
+        output = self.debug_job_output
+        (output[0] if output is not None else self.debug_chunk).write(text)
+
+    def show_debug_state(self, message):
+        """Show the session's output, registers, memory and next line"""
+        chunk, self.debug_chunk = self.debug_chunk, TraceChunk()
+        regs, pc = self.session.registers()
+        chunk.state = (regs, pc, bytes(self.session.simulator.memory))
+        self.show_run_output([chunk])
+        self.assembly_input.setExecutionLine(None if self.session.stopped else self.source_map.line_of(pc))
+        self.show_profile(self.session.profile())
+        self.statusBar().showMessage(message)
+
+    def show_profile(self, profile):
+        """Fill the Profile tab and the editor's heat strip; None clears both"""
+        self.profile_view.set_profile(profile, self.source_map)
+        self.assembly_input.setHeatMap({} if profile is None else line_hits(profile, self.source_map))
+
+    def show_pc_line(self, pc):
+        """Trace click-through: put the editor cursor on the source line of 'pc'"""
+        line = self.source_map.line_of(pc)
+        if line:
+            self.assembly_input.jumpToLine(line)
+            self.statusBar().showMessage(f"0x{pc:04X} is line {line}")
+        else:
+            self.statusBar().showMessage(f"No source line for 0x{pc:04X}")
 
-    def parse_register_values(self, output):
-        """Parse register values from disassembler output"""
-        lines = output.split('\n')
+    def toggle_breakpoint(self):
+        self.assembly_input.toggleBreakpoint(self.assembly_input.textCursor().blockNumber() + 1)
 
-        # Look for final register state section
-        in_register_section = False
-        for line in lines:
-            if "--- Final Register State ---" in line:
-                in_register_section = True
-                continue
+    def breakpoint_addresses(self):
+        """Address of the first instruction at or after each breakpoint line"""
+        addresses = (self.source_map.address_of(line) for line in self.assembly_input.breakpointLines())
+        return {address for address in addresses if address is not None}
 
-            if in_register_section and ":" in line:
-                # Look for register values like "t0 (x0): 0x0000 (0)"
-                parts = line.split(':')
-                if len(parts) >= 2:
-                    reg_part = parts[0].strip()
-                    val_part = parts[1].strip().split()[0]  # Get the hex value
-
-                    # Extract register name from format like "t0 (x0)"
-                    if "(" in reg_part:
-                        reg_name = reg_part.split()[0].strip()
-                    else:
-                        reg_name = reg_part.strip()
-
-                    # Update register in table
-                    self.update_register_value(reg_name, val_part)
-
-            # Exit if reaching the end of register section
-            if in_register_section and "---------------------------" in line:
-                break
-
-    def update_register_value(self, reg_name, value):
-        """Update a register value in the table"""
-        for i in range(self.register_table.rowCount()):
-            table_reg = self.register_table.item(i, 0).text()
-            if table_reg.lower() == reg_name.lower():
-                self.register_table.setItem(i, 1, QTableWidgetItem(value))
-                break
+    def sync_breakpoints(self):
+        """Pass the editor's breakpoints to the session; a running continue sees them at its next slice"""
+        if self.debugging:
+            self.session.set_breakpoints(self.breakpoint_addresses())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+"""
+Virtualized view of simulator memory
+
+A hex/ASCII table over the whole 64KB address space, 16 bytes per row.
+The model keeps its own copy of memory, taken from a snapshot the run
+hands over with each slice, so it never reads memory the worker is still
+writing. Qt only asks for the cells it paints, so showing all 4096 rows
+costs nothing until they scroll into view.
+
+refresh() finds what changed by comparing each 256-byte page against a
+shadow copy of what was last shown; unchanged pages are one memoryview
+comparison each, and only rows of changed pages emit dataChanged. Bytes
+changed by the last refresh are highlighted.
+
+Addresses can be given as numbers or relative to a label ("msg",
+"buffer+4", "loop-2"), and cell tooltips name the nearest label below.
+"""
+
+import re
+from bisect import bisect_right
+
+from PyQt5.QtWidgets import (QWidget, QTableView, QLineEdit, QHBoxLayout, QVBoxLayout,
+                             QAbstractItemView, QHeaderView)
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QColor, QFont, QFontMetrics
+
+from z16sim import MEM_SIZE
+
+BYTES_PER_ROW = 16
+PAGE_SIZE = 256
+ROWS = MEM_SIZE // BYTES_PER_ROW
+ASCII_COLUMN = BYTES_PER_ROW
+
+CHANGED_COLOR = QColor(255, 230, 150)
+
+_ADDRESS = re.compile(r"\s*([A-Za-z_.][\w.]*|[-+]?(?:0[xX][0-9A-Fa-f]+|\d+))\s*(?:([-+])\s*(0[xX][0-9A-Fa-f]+|\d+))?\s*$")
+
+
+def _printable(byte):
+    return chr(byte) if 0x20 <= byte < 0x7F else "."
+
+
+class MemoryModel(QAbstractTableModel):
+    """Table model over a 64KB memory buffer: 16 hex columns and an ASCII column"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.buffer = bytearray(MEM_SIZE)
+        self.memory = memoryview(self.buffer)
+        self.shadow = bytearray(MEM_SIZE)  # memory as of the last refresh
+        self.changed = set()               # addresses changed by the last refresh
+        self._fresh = True                 # next set_memory() shows a new program
+        self.symbols = {}                  # lower-case label -> address
+        self._labels = []                  # (address, name) sorted by address
+        self._label_addresses = []
+        self._font = QFont("Consolas", 10)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else ROWS
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else BYTES_PER_ROW + 1
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            if orientation == Qt.Vertical:
+                return f"{section * BYTES_PER_ROW:04X}"
+            return "ASCII" if section == ASCII_COLUMN else f"{section:X}"
+        if role == Qt.FontRole:
+            return self._font
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        row, column = index.row(), index.column()
+        base = row * BYTES_PER_ROW
+        if role == Qt.DisplayRole:
+            if column == ASCII_COLUMN:
+                return "".join(map(_printable, self.memory[base:base + BYTES_PER_ROW]))
+            return f"{self.memory[base + column]:02X}"
+        if role == Qt.FontRole:
+            return self._font
+        if column == ASCII_COLUMN:
+            return None
+        address = base + column
+        if role == Qt.BackgroundRole and address in self.changed:
+            return CHANGED_COLOR
+        if role == Qt.ToolTipRole:
+            value = self.memory[address]
+            word = value | self.memory[address + 1] << 8 if address + 1 < MEM_SIZE else value
+            label = self.label_of(address)
+            return (f"0x{address:04X}" + (f" ({label})" if label else "")
+                    + f"\nbyte 0x{value:02X} ({value}), word 0x{word:04X}")
+        return None
+
+    # --- Contents ---
+
+    def set_memory(self, memory):
+        """Copy 64KB of 'memory' into the model and highlight what changed since the last call"""
+        self.buffer[:] = memory
+        if not self._fresh:
+            return self.refresh()
+        # First state of a new program: show it without highlighting its load
+        self._fresh = False
+        self.beginResetModel()
+        self.shadow[:] = self.buffer
+        self.changed = set()
+        self.endResetModel()
+        return 0
+
+    def reset(self):
+        """Clear memory; the next set_memory() starts a new program"""
+        self.beginResetModel()
+        self.buffer[:] = bytes(MEM_SIZE)
+        self.shadow[:] = self.buffer
+        self.changed = set()
+        self._fresh = True
+        self.endResetModel()
+
+    def refresh(self):
+        """Repaint what changed since the last refresh; returns the number of dirty pages"""
+        memory, shadow = self.memory, self.shadow
+        shadow_view = memoryview(shadow)
+        old_changed = self.changed
+        changed = set()
+        dirty_rows = {address // BYTES_PER_ROW for address in old_changed}
+        pages = 0
+        for page in range(0, MEM_SIZE, PAGE_SIZE):
+            end = page + PAGE_SIZE
+            if memory[page:end] == shadow_view[page:end]:
+                continue
+            pages += 1
+            for row in range(page, end, BYTES_PER_ROW):
+                row_end = row + BYTES_PER_ROW
+                if memory[row:row_end] != shadow_view[row:row_end]:
+                    dirty_rows.add(row // BYTES_PER_ROW)
+                    changed.update(a for a in range(row, row_end) if memory[a] != shadow[a])
+            shadow[page:end] = memory[page:end]
+        shadow_view.release()
+        self.changed = changed
+        for row in sorted(dirty_rows):
+            self.dataChanged.emit(self.index(row, 0), self.index(row, ASCII_COLUMN))
+        return pages
+
+    # --- Labels ---
+
+    def set_symbols(self, symbols):
+        """Labels for addressing, as a name -> address mapping"""
+        self.symbols = {name.lower(): address for name, address in symbols.items()}
+        self._labels = sorted((address, name) for name, address in symbols.items())
+        self._label_addresses = [address for address, _ in self._labels]
+
+    def label_of(self, address):
+        """'name' or 'name+offset' for the nearest label at or below 'address' ('' if none)"""
+        i = bisect_right(self._label_addresses, address)
+        if not i:
+            return ""
+        base, name = self._labels[i - 1]
+        return name if base == address else f"{name}+{address - base}"
+
+    def parse_address(self, text):
+        """Address of "0x1F", "64", "label", "label+4" or "label-0x2"; raises ValueError"""
+        match = _ADDRESS.match(text)
+        if not match:
+            raise ValueError(f"bad address '{text}'")
+        base, sign, offset = match.groups()
+        if base[0].isalpha() or base[0] in "_.":
+            if base.lower() not in self.symbols:
+                raise ValueError(f"unknown label '{base}'")
+            address = self.symbols[base.lower()]
+        else:
+            address = int(base, 0)
+        if offset is not None:
+            address += int(offset, 0) if sign == "+" else -int(offset, 0)
+        if not 0 <= address < MEM_SIZE:
+            raise ValueError(f"address 0x{address:X} is outside memory")
+        return address
+
+
+class MemoryView(QWidget):
+    """Memory table with a go-to-address field"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.model = MemoryModel(self)
+
+        self.table_view = QTableView()
+        self.table_view.setModel(self.model)
+        self.table_view.setShowGrid(False)
+        self.table_view.setWordWrap(False)
+        # Fixed sizes: sizing to contents would sample rows on every relayout
+        header = self.table_view.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.Fixed)
+        header.setDefaultSectionSize(QFontMetrics(self.model._font).width("000") + 4)
+        header.setStretchLastSection(True)
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+        self.address_input = QLineEdit()
+        self.address_input.setPlaceholderText("Go to address or label, e.g. 0x100 or msg+4")
+        self.address_input.returnPressed.connect(self.go_to_input)
+
+        bar = QHBoxLayout()
+        bar.setContentsMargins(0, 0, 0, 0)
+        bar.addWidget(self.address_input)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(bar)
+        layout.addWidget(self.table_view)
+
+    def go_to(self, address):
+        """Scroll to and select the byte at 'address'"""
+        index = self.model.index(address // BYTES_PER_ROW, address % BYTES_PER_ROW)
+        self.table_view.scrollTo(index, QAbstractItemView.PositionAtTop)
+        self.table_view.setCurrentIndex(index)
+
+    def go_to_input(self):
+        try:
+            address = self.model.parse_address(self.address_input.text())
+        except ValueError as e:
+            self.address_input.setToolTip(str(e))
+            self.address_input.setStyleSheet("background-color: #FFD0D0;")
+            return
+        self.address_input.setToolTip("")
+        self.address_input.setStyleSheet("")
+        self.go_to(address)
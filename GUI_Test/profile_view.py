@@ -0,0 +1,158 @@
+"""
+Profile of the last run
+
+The simulator counts instructions retired at each PC and taken branches
+at each branch PC on every run (see Z16Simulator.profile). This module
+shows those counts two ways: a sortable "hot spots" table with one row
+per executed PC, and line_hits(), the counts summed per source line that
+the editor paints as a heat-map strip beside the line numbers.
+
+Only executed PCs become rows, so sorting and repainting cost nothing
+for the unused part of the 64KB address space.
+"""
+
+from PyQt5.QtWidgets import (QWidget, QTableView, QLabel, QVBoxLayout,
+                             QAbstractItemView, QHeaderView)
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtGui import QFont
+
+from z16sim import disassemble
+
+ADDRESS, LINE, HITS, SHARE, TAKEN, NOT_TAKEN, INSTRUCTION = range(7)
+COLUMNS = ("Address", "Line", "Hits", "%", "Taken", "Not taken", "Instruction")
+
+
+def line_hits(profile, source_map):
+    """Instructions executed per source line: {line: hits} (lines with no hits left out)"""
+    counts = {}
+    for pc in profile.insts:
+        line = source_map.line_of(pc)
+        if line:
+            counts[line] = counts.get(line, 0) + profile.hits[pc]
+    return counts
+
+
+class ProfileModel(QAbstractTableModel):
+    """One row per executed PC"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.profile = None
+        self.source_map = None
+        self.rows = []  # executed PCs in display order
+        self._font = QFont("Consolas", 10)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.FontRole:
+            return self._font
+        if role == Qt.TextAlignmentRole:
+            if index.column() in (INSTRUCTION, ADDRESS):
+                return int(Qt.AlignLeft | Qt.AlignVCenter)
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role != Qt.DisplayRole:
+            return None
+        pc = self.rows[index.row()]
+        value = self.value(pc, index.column())
+        if index.column() == ADDRESS:
+            return f"0x{pc:04X}"
+        if index.column() == SHARE:
+            return f"{value:.1f}"
+        if value is None or (index.column() == LINE and not value):
+            return ""
+        return str(value)
+
+    def value(self, pc, column):
+        """Sort key and raw value of one cell (None where it does not apply)"""
+        profile = self.profile
+        if column == ADDRESS:
+            return pc
+        if column == LINE:
+            return self.source_map.line_of(pc) if self.source_map is not None else 0
+        if column == HITS:
+            return profile.hits[pc]
+        if column == SHARE:
+            return 100.0 * profile.hits[pc] / profile.instructions
+        if column == INSTRUCTION:
+            return disassemble(profile.insts[pc], pc)
+        if not profile.is_branch(pc):
+            return None
+        return profile.taken[pc] if column == TAKEN else profile.hits[pc] - profile.taken[pc]
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if self.profile is None:
+            return
+        self.layoutAboutToBeChanged.emit()
+        # Cells without a value (non-branches in the branch columns) sort first
+        def key(pc):
+            value = self.value(pc, column)
+            return (value is not None, value if value is not None else 0, pc)
+        self.rows.sort(key=key, reverse=order == Qt.DescendingOrder)
+        self.layoutChanged.emit()
+
+    def set_profile(self, profile, source_map=None):
+        """Show a Profile; None clears the table"""
+        self.beginResetModel()
+        self.profile = profile
+        self.source_map = source_map
+        self.rows = [] if profile is None else [pc for pc, _ in profile.hot_spots()]
+        self.endResetModel()
+
+
+class ProfileView(QWidget):
+    """Run totals above the hot spots table; activating a row emits its PC"""
+
+    pcActivated = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.model = ProfileModel(self)
+
+        self.totals = QLabel()
+        self.totals.setObjectName("profileTotals")
+
+        self.table_view = QTableView()
+        self.table_view.setModel(self.model)
+        self.table_view.setShowGrid(False)
+        self.table_view.setWordWrap(False)
+        self.table_view.verticalHeader().hide()
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table_view.horizontalHeader().setStretchLastSection(True)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.sortByColumn(HITS, Qt.DescendingOrder)
+        self.table_view.activated.connect(
+            lambda index: self.pcActivated.emit(self.model.rows[index.row()]))
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.totals)
+        layout.addWidget(self.table_view)
+
+    def set_profile(self, profile, source_map=None):
+        self.model.set_profile(profile, source_map)
+        if profile is None:
+            self.totals.clear()
+            return
+        # Keep the sort the user picked
+        header = self.table_view.horizontalHeader()
+        self.model.sort(header.sortIndicatorSection(), header.sortIndicatorOrder())
+        self.totals.setText(
+            f"{profile.instructions} instructions, {profile.loads} loads, {profile.stores} stores, "
+            f"{profile.branches} branches ({profile.branches_taken} taken, "
+            f"{profile.branches - profile.branches_taken} not taken)")
+
+    def clear(self):
+        self.set_profile(None)
@@ -0,0 +1,115 @@
+"""
+Register panel
+
+A table model over the eight registers and the PC, shown as hex, signed
+and unsigned. Updates go through a name-to-row index and only rows whose
+value actually changed emit dataChanged, so refreshing the panel after
+every step or every run slice repaints just the registers that moved.
+Those registers are highlighted until the next update, and their tooltip
+shows the value they had before it.
+"""
+
+from PyQt5.QtWidgets import QTableView, QHeaderView, QAbstractItemView
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QColor, QFont
+
+from z16sim import REG_NAMES
+
+NAME, HEX, SIGNED, UNSIGNED = range(4)
+COLUMNS = ("Register", "Hex", "Signed", "Unsigned")
+REGISTERS = REG_NAMES + ("PC",)
+
+CHANGED_COLOR = QColor(255, 230, 150)
+
+
+def signed16(value):
+    return value - 0x10000 if value & 0x8000 else value
+
+
+class RegisterModel(QAbstractTableModel):
+    """Register values with per-update change tracking"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = {name: row for row, name in enumerate(REGISTERS)}
+        self.values = [0] * len(REGISTERS)
+        self.previous = [0] * len(REGISTERS)  # values before the last update
+        self.changed = set()                  # rows the last update changed
+        self._bold = QFont()
+        self._bold.setBold(True)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(REGISTERS)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        row, column = index.row(), index.column()
+        if role == Qt.DisplayRole:
+            value = self.values[row]
+            if column == NAME:
+                return REGISTERS[row]
+            if column == HEX:
+                return f"0x{value:04X}"
+            if column == SIGNED:
+                return str(signed16(value))
+            return str(value)
+        if row in self.changed:
+            if role == Qt.BackgroundRole:
+                return CHANGED_COLOR
+            if role == Qt.FontRole:
+                return self._bold
+            if role == Qt.ToolTipRole:
+                return f"was 0x{self.previous[row]:04X} ({signed16(self.previous[row])})"
+        if role == Qt.TextAlignmentRole and column != NAME:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def set_registers(self, regs, pc):
+        """Show a new machine state; 'regs' are x0..x7"""
+        self._update(list(regs) + [pc])
+
+    def set_value(self, name, value):
+        """Change one register (or "PC"), leaving the others as they are"""
+        values = list(self.values)
+        values[self.rows["PC" if name.lower() == "pc" else name.lower()]] = value & 0xFFFF
+        self._update(values)
+
+    def reset(self):
+        """All registers back to zero, with nothing marked as changed"""
+        rows = {row for row, value in enumerate(self.values) if value} | self.changed
+        self.values = [0] * len(REGISTERS)
+        self.previous = [0] * len(REGISTERS)
+        self.changed = set()
+        self._repaint(rows)
+
+    def _update(self, values):
+        # Rows to repaint: those that change now, and those highlighted by the last update
+        old_changed = self.changed
+        self.changed = {row for row, (old, new) in enumerate(zip(self.values, values)) if old != new}
+        self.previous = self.values
+        self.values = values
+        self._repaint(self.changed | old_changed)
+
+    def _repaint(self, rows):
+        last = len(COLUMNS) - 1
+        for row in sorted(rows):
+            self.dataChanged.emit(self.index(row, 0), self.index(row, last))
+
+
+class RegisterView(QTableView):
+    """Compact table view over a RegisterModel"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setModel(RegisterModel(self))
+        self.verticalHeader().setVisible(False)
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
@@ -0,0 +1,141 @@
+"""
+Build/run scheduler shared by the Qt and Tk frontends
+
+Every build or run is submitted as a job that executes on a worker thread
+and is tagged with a generation number. Submitting a new job cancels the
+previous one (killing its child process, if it has one), and poll(), called
+from the UI thread, only delivers results of the newest generation. The UI
+never blocks on a run, and output of a superseded run never reaches it.
+
+A job is a callable job(token, emit): 'token' is the job's CancelToken and
+'emit' sends a chunk of output (text, or whatever the frontend's on_output
+expects) to the UI. Its return value is handed to the on_done callback.
+"""
+
+import queue
+import threading
+
+# Kinds of messages a worker posts back to the UI thread
+_OUTPUT, _DONE, _ERROR = range(3)
+
+
+class Cancelled(Exception):
+    """Raised inside a job once a newer run has superseded it"""
+
+
+class CancelToken:
+    """Cancellation flag for one job, plus the child process to kill on cancel"""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._process = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            process = self._process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def check(self):
+        """Raise Cancelled if this job has been superseded"""
+        if self._event.is_set():
+            raise Cancelled()
+
+    def attach(self, process):
+        """Register a subprocess.Popen that must be killed if the job is cancelled"""
+        with self._lock:
+            self._process = process
+            cancelled = self._event.is_set()
+        if cancelled:
+            process.kill()
+            raise Cancelled()
+
+
+class RunScheduler:
+    """Runs one job at a time on a worker thread; a new submit() supersedes the running job"""
+
+    def __init__(self):
+        self.generation = 0
+        self._token = None
+        self._handlers = (None, None, None)
+        self._results = queue.Queue()
+
+    @property
+    def busy(self):
+        """True while the current job has not delivered its result yet"""
+        return self._token is not None
+
+    def submit(self, job, on_output=None, on_done=None, on_error=None):
+        """Cancel the running job (if any) and start 'job'; returns its generation"""
+        self.cancel()
+        self.generation += 1
+        token = CancelToken(self.generation)
+        self._token = token
+        self._handlers = (on_output, on_done, on_error)
+        threading.Thread(target=self._work, args=(job, token), daemon=True).start()
+        return token.generation
+
+    def cancel(self):
+        """Cancel the running job; anything it still produces is discarded"""
+        if self._token is not None:
+            self._token.cancel()
+            self._token = None
+            # Retire its generation, so poll() drops results already queued
+            self.generation += 1
+
+    def _work(self, job, token):
+        generation = token.generation
+
+        def emit(text):
+            if not token.cancelled:
+                self._results.put((generation, _OUTPUT, text))
+
+        try:
+            result = job(token, emit)
+        except Cancelled:
+            return
+        except Exception as e:
+            if not token.cancelled:
+                self._results.put((generation, _ERROR, e))
+            return
+        if not token.cancelled:
+            self._results.put((generation, _DONE, result))
+
+    def poll(self):
+        """
+        Deliver queued results of the current generation to their callbacks.
+        Must be called from the UI thread. Output chunks that arrived since the
+        last poll are passed as one list to a single on_output call, so the UI
+        refreshes at most once per poll however fast the worker emits.
+        """
+        on_output, on_done, on_error = self._handlers
+        chunks = []
+        finished = None
+        while finished is None:
+            try:
+                generation, kind, payload = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.generation:
+                continue  # result of a superseded run
+            if kind == _OUTPUT:
+                chunks.append(payload)
+            else:
+                finished = (kind, payload)
+
+        if chunks and on_output is not None:
+            on_output(chunks)
+        if finished is not None:
+            self._token = None
+            kind, payload = finished
+            if kind == _DONE and on_done is not None:
+                on_done(payload)
+            elif kind == _ERROR and on_error is not None:
+                on_error(payload)
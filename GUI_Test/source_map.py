@@ -0,0 +1,94 @@
+"""
+Address-to-source-line map
+
+The assembler knows the source line of every instruction it emits; the
+source map keeps that as one entry per 16-bit word of the address space,
+so the line of any PC is lines[pc >> 1], one array lookup. Words with no
+instruction (data, gaps) map to line 0.
+
+Both assemblers write the map next to the .bin as a .map file:
+
+    "Z16M"                 magic
+    uint16 count           number of entries that follow
+    uint16 line[count]     source line of the word at address 2*i (0 = none)
+
+all little-endian. Entries past 'count' are 0, so a program in low memory
+gives a map about as small as its text section. Source lines above MAX_LINE
+do not fit a uint16 and are written as 0, like words with no instruction.
+"""
+
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+MAGIC = b"Z16M"
+WORDS = 0x8000  # 16-bit words in the 64KB address space
+MAX_LINE = 0xFFFF  # highest source line a map entry can hold
+
+
+class SourceMapError(Exception):
+    """A .map file is malformed"""
+
+
+class SourceMap:
+    """Source line of each instruction word: lines[pc >> 1]"""
+
+    def __init__(self, lines=None):
+        self.lines = array('H', bytes(2 * WORDS)) if lines is None else lines
+        self._starts = None  # (line, address) of the first word of each line, by line
+
+    def line_of(self, pc):
+        """Source line of the instruction at 'pc' (0 if unknown)"""
+        return self.lines[(pc & 0xFFFF) >> 1]
+
+    def address_of(self, line):
+        """Address of the first instruction on 'line' or the next line that has one (None if none)"""
+        starts = self._line_starts()
+        i = bisect_left(starts, (line, 0))
+        return starts[i][1] if i < len(starts) else None
+
+    def _line_starts(self):
+        if self._starts is None:
+            first = {}
+            for word, line in enumerate(self.lines):
+                if line and line not in first:
+                    first[line] = word << 1
+            self._starts = sorted(first.items())
+        return self._starts
+
+    # --- .map files ---
+
+    def to_bytes(self):
+        count = len(self.lines)
+        while count and not self.lines[count - 1]:
+            count -= 1
+        body = self.lines[:count]
+        if sys.byteorder == "big":
+            body.byteswap()
+        return MAGIC + struct.pack("<H", count) + body.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < 6 or data[:4] != MAGIC:
+            raise SourceMapError("not a Z16 source map")
+        count, = struct.unpack_from("<H", data, 4)
+        if len(data) < 6 + 2 * count:
+            raise SourceMapError("truncated source map")
+        if count > WORDS:
+            raise SourceMapError("source map covers more than 64KB")
+        lines = array('H', data[6:6 + 2 * count])
+        if sys.byteorder == "big":
+            lines.byteswap()
+        lines.frombytes(bytes(2 * (WORDS - count)))
+        return cls(lines)
+
+    def save(self, filename):
+        with open(filename, "wb") as fp:
+            fp.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, filename):
+        """Read a .map file; raises OSError or SourceMapError"""
+        with open(filename, "rb") as fp:
+            return cls.from_bytes(fp.read())
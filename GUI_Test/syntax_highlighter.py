@@ -0,0 +1,103 @@
+"""
+Z16 syntax highlighting for the editor
+
+Highlights mnemonics, registers, labels, directives, %hi/%lo, numbers,
+strings and comments, splitting lines the way z16asm does: a comment
+starts at the first '#' or ';', and a label is whatever precedes the
+first ':' of the rest.
+
+A line's colours depend on nothing but its own text, so the highlighter
+never changes a block's state and Qt re-highlights only the blocks that
+were edited. Tokenizing is one pass of precompiled regular expressions,
+and the resulting spans are cached by line text, so reloading or
+re-highlighting a multi-thousand-line file mostly replays cached spans.
+"""
+
+import re
+from functools import lru_cache
+
+from PyQt5.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor, QFont
+
+from z16asm import INSTRUCTION_SET, DIRECTIVES, REGISTERS
+
+MNEMONICS = frozenset(INSTRUCTION_SET)
+DIRECTIVE_NAMES = frozenset(DIRECTIVES)
+REGISTER_NAMES = frozenset(REGISTERS)
+
+# Token kinds, each drawn with one format
+MNEMONIC, DIRECTIVE, REGISTER, LABEL, NUMBER, RELOCATION, STRING, COMMENT = range(8)
+
+# Label (text before the first colon) and the mnemonic/directive after it
+_STATEMENT = re.compile(r"\s*(?:(?P<label>[^:]*?)\s*:)?\s*(?P<mnemonic>\S+)?")
+# Operand tokens; identifiers are looked up to tell registers from label references
+_OPERAND = re.compile(r"""
+    (?P<string>"(?:[^"\\]|\\.)*"?)
+  | (?P<relocation>%(?:hi|lo)\b)
+  | (?P<number>[-+]?\b(?:0[xX][0-9A-Fa-f]+|0[bB][01]+|\d+)\b)
+  | (?P<word>[A-Za-z_.][\w.]*)
+""", re.VERBOSE)
+_GROUP_KINDS = {"string": STRING, "relocation": RELOCATION, "number": NUMBER}
+
+
+@lru_cache(maxsize=8192)
+def highlight_spans(text):
+    """(start, length, kind) spans for one line of source"""
+    spans = []
+    cut = min((i for i in (text.find("#"), text.find(";")) if i >= 0), default=-1)
+    code = text if cut < 0 else text[:cut]
+
+    match = _STATEMENT.match(code)
+    label = match.group("label")
+    if label:
+        spans.append((match.start("label"), len(label), LABEL))
+    operands_start = match.end()
+    mnemonic = match.group("mnemonic")
+    if mnemonic:
+        name = mnemonic.lower()
+        if name in MNEMONICS:
+            spans.append((match.start("mnemonic"), len(mnemonic), MNEMONIC))
+        elif name in DIRECTIVE_NAMES:
+            spans.append((match.start("mnemonic"), len(mnemonic), DIRECTIVE))
+
+    for token in _OPERAND.finditer(code, operands_start):
+        group = token.lastgroup
+        if group == "word":
+            if token.group().lower() in REGISTER_NAMES:
+                spans.append((token.start(), token.end() - token.start(), REGISTER))
+        else:
+            spans.append((token.start(), token.end() - token.start(), _GROUP_KINDS[group]))
+
+    if cut >= 0:
+        spans.append((cut, len(text) - cut, COMMENT))
+    return tuple(spans)
+
+
+def _format(color, bold=False, italic=False):
+    fmt = QTextCharFormat()
+    fmt.setForeground(QColor(color))
+    if bold:
+        fmt.setFontWeight(QFont.Bold)
+    fmt.setFontItalic(italic)
+    return fmt
+
+
+class Z16Highlighter(QSyntaxHighlighter):
+    """QSyntaxHighlighter for Z16 assembly"""
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.formats = {
+            MNEMONIC: _format("#0000C0", bold=True),
+            DIRECTIVE: _format("#8000A0", bold=True),
+            REGISTER: _format("#B05000"),
+            LABEL: _format("#007070", bold=True),
+            NUMBER: _format("#008000"),
+            RELOCATION: _format("#A00060"),
+            STRING: _format("#A03000"),
+            COMMENT: _format("#808080", italic=True),
+        }
+
+    def highlightBlock(self, text):
+        formats = self.formats
+        for start, length, kind in highlight_spans(text):
+            self.setFormat(start, length, formats[kind])
@@ -0,0 +1,79 @@
+"""
+Find and replace over the editor buffer
+
+The whole buffer is searched with one compiled regular expression, giving
+an index of match ranges that Find Next, the match count and the
+highlight-all layer share until the text or the query changes. Plain
+searches are regular expressions with the query escaped; whole-word
+matching is done with lookarounds so a query that starts or ends with a
+non-word character (such as "%lo(") still works.
+
+Positions are UTF-16 offsets, the unit QTextDocument counts in; they only
+differ from Python string indices when the buffer holds characters outside
+the Basic Multilingual Plane.
+"""
+
+import re
+from bisect import bisect_left
+
+
+def compile_query(query, regex=False, whole_word=False, case_sensitive=False):
+    """Compile a Find query; raises re.error for a bad regular expression"""
+    pattern = query if regex else re.escape(query)
+    if whole_word:
+        pattern = r"(?<!\w)(?:%s)(?!\w)" % pattern
+    flags = re.MULTILINE
+    if not case_sensitive:
+        flags |= re.IGNORECASE
+    return re.compile(pattern, flags)
+
+
+def _utf16_converter(text):
+    """Maps string indices of 'text' to UTF-16 offsets; None when they are the same"""
+    if text.isascii():
+        return None
+    # Characters outside the BMP take two UTF-16 units
+    wide = [i for i, ch in enumerate(text) if ord(ch) > 0xFFFF]
+    if not wide:
+        return None
+    return lambda index: index + bisect_left(wide, index)
+
+
+class MatchIndex:
+    """Every match of a compiled query in one snapshot of the buffer"""
+
+    def __init__(self, pattern, text):
+        # Empty matches (e.g. "^" or "x*") cannot be selected or replaced
+        self.matches = [m for m in pattern.finditer(text) if m.end() > m.start()]
+        convert = _utf16_converter(text)
+        if convert is None:
+            self.spans = [m.span() for m in self.matches]
+        else:
+            self.spans = [(convert(m.start()), convert(m.end())) for m in self.matches]
+        self.starts = [start for start, _ in self.spans]
+
+    def __len__(self):
+        return len(self.spans)
+
+    def next_after(self, position):
+        """Index of the first match starting at or after 'position', wrapping to the first"""
+        if not self.spans:
+            return None
+        i = bisect_left(self.starts, position)
+        return i if i < len(self.spans) else 0
+
+    def find(self, start, end):
+        """Index of the match covering exactly start..end, or None"""
+        i = bisect_left(self.starts, start)
+        if i < len(self.spans) and self.spans[i] == (start, end):
+            return i
+        return None
+
+    def replacement(self, i, template, regex):
+        """Text that replaces match 'i': the template with \\1, \\g<name> expanded in regex mode"""
+        return self.matches[i].expand(template) if regex else template
+
+    def replacements(self, template, regex):
+        """(start, end, new text) for every match, last match first so earlier offsets stay valid"""
+        return [(start, end, self.replacement(i, template, regex))
+                for i, (start, end) in reversed(list(enumerate(self.spans)))]
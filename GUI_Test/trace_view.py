@@ -0,0 +1,352 @@
+"""
+Virtualized view of simulator output
+
+The simulator retires up to MAX_INSTRUCTIONS instructions per run, and
+putting one QTextEdit line per instruction makes the window stall. Here
+each row is two 16-bit entries (pc, inst) in compact arrays. Text rows
+(program output, messages) use inst 0: a zero word halts the simulator,
+so it is never traced. Rows are formatted only when the list view paints
+them. Appends arrive in batches at the scheduler's poll rate. A filter
+is an index array over the rows, so filtering and jumping work on
+millions of rows without touching the text layout.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import compress
+from operator import and_
+
+from PyQt5.QtWidgets import (QWidget, QTableView, QLineEdit, QHBoxLayout,
+                             QVBoxLayout, QAbstractItemView, QHeaderView)
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QEvent, pyqtSignal
+
+from z16sim import disassemble
+
+
+@lru_cache(maxsize=None)
+def mnemonic(inst):
+    """Mnemonic of an instruction word, as printed in the trace"""
+    return disassemble(inst, 0).split(" ", 1)[0]
+
+
+def parse_address(text):
+    """Parse a hex (0x...) or decimal address; raises ValueError"""
+    return int(text.strip(), 0) & 0xFFFF
+
+
+class TraceChunk:
+    """Rows produced by a worker between two polls; filled off the UI thread"""
+
+    __slots__ = ("pcs", "insts", "texts", "state")
+
+    def __init__(self):
+        self.pcs = array('H')
+        self.insts = array('H')
+        self.texts = {}  # row within this chunk -> text
+        self.state = None  # (registers, pc, memory) when the chunk was emitted, for live views
+
+    def __len__(self):
+        return len(self.pcs)
+
+    def trace(self, pc, inst):
+        """Simulator trace callback: one row per retired instruction"""
+        self.pcs.append(pc)
+        self.insts.append(inst)
+
+    def write(self, text):
+        """Simulator write callback: one text row per output line"""
+        lines = text.split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        for line in lines:
+            self.texts[len(self.pcs)] = line
+            self.pcs.append(0)
+            self.insts.append(0)
+
+
+class TraceModel(QAbstractListModel):
+    """List model over the trace arrays, optionally through a filter index"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pcs = array('H')
+        self.insts = array('H')
+        self.texts = {}
+        self.text_rows = []     # sorted rows holding text, for instruction numbering
+        self.rows = None        # array('I') of visible rows while a filter is active
+        self._pc_flags = None   # bytearray(65536): PC passes the filter
+        self._inst_flags = None  # bytearray(65536): instruction word passes the filter
+        self._mnemonic = None
+
+    # -----------------------
+    # Qt model interface
+    # -----------------------
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.pcs) if self.rows is None else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        return self.row_text(self.source_row(index.row()))
+
+    # -----------------------
+    # Rows
+    # -----------------------
+
+    def source_row(self, view_row):
+        return view_row if self.rows is None else self.rows[view_row]
+
+    def view_row(self, row):
+        """View row showing 'row', or the next visible row after it"""
+        if self.rows is None:
+            return row
+        return min(bisect_left(self.rows, row), len(self.rows) - 1)
+
+    def row_text(self, row):
+        inst = self.insts[row]
+        if inst == 0:
+            return self.texts[row]
+        pc = self.pcs[row]
+        return f"0x{pc:04X}: {inst:04X} {disassemble(inst, pc)}"
+
+    def clear(self):
+        self.beginResetModel()
+        self.pcs = array('H')
+        self.insts = array('H')
+        self.texts = {}
+        self.text_rows = []
+        if self.rows is not None:
+            self.rows = array('I')
+        self.endResetModel()
+
+    def append_chunks(self, chunks):
+        """Append worker chunks with a single row insertion"""
+        pcs = array('H')
+        insts = array('H')
+        texts = {}
+        base = len(self.pcs)
+        for chunk in chunks:
+            offset = base + len(pcs)
+            for row, text in chunk.texts.items():
+                texts[offset + row] = text
+            pcs.extend(chunk.pcs)
+            insts.extend(chunk.insts)
+        if not pcs:
+            return
+
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), base, base + len(pcs) - 1)
+            self._extend(pcs, insts, texts)
+            self.endInsertRows()
+            return
+
+        self._update_inst_flags(insts)
+        matches = self._matching(pcs, insts, base)
+        self._extend(pcs, insts, texts)
+        if matches:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(matches) - 1)
+            self.rows.extend(matches)
+            self.endInsertRows()
+
+    def _extend(self, pcs, insts, texts):
+        self.pcs.extend(pcs)
+        self.insts.extend(insts)
+        self.texts.update(texts)
+        self.text_rows.extend(sorted(texts))
+
+    # -----------------------
+    # Filtering
+    # -----------------------
+
+    def set_filter(self, pc_range=None, mnemonic_name=None):
+        """
+        Show only instruction rows with lo <= pc <= hi and/or the given
+        mnemonic; with neither, show every row again
+        """
+        self.beginResetModel()
+        if pc_range is None and not mnemonic_name:
+            self.rows = None
+            self._pc_flags = self._inst_flags = None
+        else:
+            lo, hi = pc_range if pc_range is not None else (0, 0xFFFF)
+            self._pc_flags = bytearray(65536)
+            if lo <= hi:
+                self._pc_flags[lo:hi + 1] = b"\x01" * (hi - lo + 1)
+            self._mnemonic = mnemonic_name.lower() if mnemonic_name else None
+            self._inst_flags = bytearray(65536)
+            self._update_inst_flags(self.insts)
+            self.rows = self._matching(self.pcs, self.insts, 0)
+        self.endResetModel()
+
+    def _update_inst_flags(self, insts):
+        # Text rows (inst 0) never pass a filter
+        flags = self._inst_flags
+        for inst in set(insts):
+            if inst and not flags[inst]:
+                flags[inst] = self._mnemonic is None or mnemonic(inst) == self._mnemonic
+
+    def _matching(self, pcs, insts, base):
+        keep = map(and_, map(self._pc_flags.__getitem__, pcs),
+                   map(self._inst_flags.__getitem__, insts))
+        return array('I', compress(range(base, base + len(pcs)), keep))
+
+    # -----------------------
+    # Navigation
+    # -----------------------
+
+    def instruction_row(self, number):
+        """Row of the number-th retired instruction (0-based), or None"""
+        if number < 0:
+            return None
+        # row = number + (text rows before it); iterate to the fixed point
+        row = number
+        while True:
+            target = number + bisect_right(self.text_rows, row)
+            if target == row:
+                break
+            row = target
+        return row if row < len(self.pcs) else None
+
+    def next_pc_row(self, pc, start):
+        """First instruction row at or after 'start' that executed 'pc', or None"""
+        while True:
+            try:
+                row = self.pcs.index(pc, start)
+            except ValueError:
+                return None
+            if self.insts[row]:
+                return row
+            start = row + 1
+
+
+class TraceView(QWidget):
+    """Trace list with a PC-range/mnemonic filter bar and a jump field"""
+
+    # Emitted with the PC of an instruction row that is double-clicked or given Enter
+    pcActivated = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.model = TraceModel(self)
+
+        # A single-column table with fixed row heights: unlike QListView,
+        # it never walks every row to lay them out
+        self.table_view = QTableView()
+        self.table_view.setModel(self.model)
+        self.table_view.setShowGrid(False)
+        self.table_view.setWordWrap(False)
+        self.table_view.horizontalHeader().hide()
+        self.table_view.horizontalHeader().setStretchLastSection(True)
+        self.table_view.verticalHeader().hide()
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table_view.activated.connect(self.row_activated)
+
+        self.pc_filter = QLineEdit()
+        self.pc_filter.setPlaceholderText("PC range, e.g. 0x10-0x40")
+        self.pc_filter.returnPressed.connect(self.apply_filter)
+        self.mnemonic_filter = QLineEdit()
+        self.mnemonic_filter.setPlaceholderText("Mnemonic")
+        self.mnemonic_filter.returnPressed.connect(self.apply_filter)
+        self.jump_input = QLineEdit()
+        self.jump_input.setPlaceholderText("Go to #instruction or 0xPC")
+        self.jump_input.returnPressed.connect(self.jump)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.setContentsMargins(0, 0, 0, 0)
+        filter_layout.addWidget(self.pc_filter)
+        filter_layout.addWidget(self.mnemonic_filter)
+        filter_layout.addWidget(self.jump_input)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(filter_layout)
+        layout.addWidget(self.table_view)
+        self.update_row_height()
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.FontChange:
+            self.update_row_height()
+        super().changeEvent(event)
+
+    def update_row_height(self):
+        # Rows are a single line of text; the default section size is much taller
+        self.table_view.verticalHeader().setDefaultSectionSize(
+            self.fontMetrics().height() + 2)
+
+    # QTextEdit-style interface used by the IDE for messages
+
+    def append(self, text):
+        self.append_chunks([_text_chunk(text)])
+
+    def clear(self):
+        self.model.clear()
+
+    def toPlainText(self):
+        model = self.model
+        return "\n".join(model.row_text(model.source_row(i))
+                         for i in range(model.rowCount()))
+
+    def append_chunks(self, chunks):
+        """Append a poll's worth of worker output, following the tail if it was in view"""
+        scrollbar = self.table_view.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        self.model.append_chunks(chunks)
+        if at_bottom:
+            self.table_view.scrollToBottom()
+
+    def row_activated(self, index):
+        row = self.model.source_row(index.row())
+        if self.model.insts[row]:
+            self.pcActivated.emit(self.model.pcs[row])
+
+    def apply_filter(self):
+        """Apply the PC range and mnemonic typed into the filter bar"""
+        pc_range = None
+        text = self.pc_filter.text().strip()
+        self.pc_filter.setStyleSheet("")
+        if text:
+            try:
+                lo, _, hi = text.partition("-")
+                lo = parse_address(lo)
+                pc_range = (lo, parse_address(hi) if hi.strip() else lo)
+            except ValueError:
+                self.pc_filter.setStyleSheet("background-color: #ffdddd;")
+                return
+        self.model.set_filter(pc_range, self.mnemonic_filter.text().strip())
+
+    def jump(self):
+        """Select '#N' (N-th retired instruction) or the next execution of a PC"""
+        text = self.jump_input.text().strip()
+        model = self.model
+        self.jump_input.setStyleSheet("")
+        try:
+            if text.startswith("#"):
+                row = model.instruction_row(int(text[1:], 0))
+            else:
+                current = self.table_view.currentIndex()
+                start = model.source_row(current.row()) + 1 if current.isValid() else 0
+                row = model.next_pc_row(parse_address(text), start)
+                if row is None and start:
+                    row = model.next_pc_row(parse_address(text), 0)  # wrap around
+        except ValueError:
+            row = None
+        if row is None or model.rowCount() == 0:
+            self.jump_input.setStyleSheet("background-color: #ffdddd;")
+            return
+        index = model.index(model.view_row(row))
+        self.table_view.setCurrentIndex(index)
+        self.table_view.scrollTo(index, QAbstractItemView.PositionAtCenter)
+
+
+def _text_chunk(text):
+    chunk = TraceChunk()
+    chunk.write(text + "\n")
+    return chunk
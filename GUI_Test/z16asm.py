@@ -0,0 +1,835 @@
+"""
+A 2-pass assembler for the Z16 16-bit ISA - in-process version
+
+Python port of z16asm.c. Instead of reading a source file and writing
+.bin/.lst/.map files, assemble() works on a source string and returns the
+memory image, the symbol table, the per-line listing and the source map as
+in-memory objects.
+Errors are raised as AssemblerError and carry the source line number.
+
+Usage:
+python z16asm.py [-v] [-d] [-o <binary_file>] <sourcefile>
+"""
+
+import sys
+from array import array
+from collections import namedtuple
+
+from source_map import MAX_LINE, SourceMap, WORDS
+
+MEM_SIZE = 65536  # Total memory is 64KB
+
+# C isspace() characters, used wherever z16asm.c calls trim()
+WHITESPACE = " \t\n\v\f\r"
+
+SECTION_NONE, SECTION_TEXT, SECTION_DATA = 0, 1, 2
+SECTION_NAMES = {SECTION_NONE: "NONE", SECTION_TEXT: "TEXT", SECTION_DATA: "DATA"}
+
+INST_R, INST_I, INST_B, INST_L, INST_J, INST_U, INST_S = range(7)
+
+
+class AssemblerError(Exception):
+    """An assembly error; 'line_no' is the 1-based source line (0 if unknown)"""
+
+    def __init__(self, line_no, message):
+        self.line_no = line_no
+        self.message = message
+        if line_no:
+            super().__init__(f"Error on line {line_no}: {message}")
+        else:
+            super().__init__(f"Error: {message}")
+
+
+# -----------------------
+# Utility Functions
+# -----------------------
+
+def strtol(text, base=0):
+    """Parse the longest integer prefix of 'text' like C (int)strtol(); returns 0 if there is none"""
+    s = text.lstrip(WHITESPACE)
+    sign = 1
+    if s[:1] in ("+", "-"):
+        if s[0] == "-":
+            sign = -1
+        s = s[1:]
+    if base == 0:
+        if s[:2] in ("0x", "0X") and s[2:3] and s[2] in "0123456789abcdefABCDEF":
+            base, s = 16, s[2:]
+        elif s[:1] == "0":
+            base = 8
+        else:
+            base = 10
+    value = 0
+    for ch in s:
+        digit = int(ch, 36) if ch.isalnum() and ch.isascii() else 99
+        if digit >= base:
+            break
+        value = value * base + digit
+    value *= sign
+    # Truncate to a 32-bit int like the (int) cast in z16asm.c
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def split_values(operands):
+    """Split a directive operand string on commas, skipping empty fields like strtok()"""
+    return [v for v in operands.split(",") if v]
+
+
+def split_operands(operands):
+    """Split an instruction operand string on commas, spaces and tabs like strtok(ops, ", \\t")"""
+    return operands.replace(",", " ").replace("\t", " ").split(" ") if operands else []
+
+
+def symbol_references(operands):
+    """Return every operand string the encoder may look up in the symbol table, in lower-case"""
+    if not operands:
+        return frozenset()
+    names = {operands}
+    names.update(v.strip(WHITESPACE) for v in split_values(operands))
+    for token in split_operands(operands):
+        names.add(token)
+        if "(" in token:
+            # offset(register) and %hi(label)/%lo(label) look up both parts
+            head, _, tail = token.partition("(")
+            names.add(head)
+            names.add(tail.split(")")[0])
+    return frozenset(n.lower() for n in names if n)
+
+
+def unescape_string(src):
+    """Process \\n, \\t, \\r, \\\\, \\" and \\0 escapes in an operand string"""
+    escapes = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"', "0": "\0"}
+    out = []
+    i = 0
+    while i < len(src):
+        ch = src[i]
+        if ch == "\\" and i + 1 < len(src):
+            out.append(escapes.get(src[i + 1], src[i + 1]))
+            i += 2
+        else:
+            out.append(ch)
+            i += 1
+    # A NUL ends the C string, so anything after an escaped \0 is dropped
+    return "".join(out).split("\0")[0]
+
+
+def parse_fields(original):
+    """
+    Split a source line into (label, mnemonic, operands). Comments (starting
+    with '#' or ';') are removed, the mnemonic is converted to lower-case and
+    .asciiz operands lose their surrounding quotes. Missing fields are None.
+    """
+    text = original
+    cut = min((i for i in (text.find("#"), text.find(";")) if i >= 0), default=-1)
+    if cut >= 0:
+        text = text[:cut]
+    text = text.strip(WHITESPACE)
+    label = None
+    if text:
+        colon = text.find(":")
+        if colon >= 0:
+            label = text[:colon].strip(WHITESPACE)
+            text = text[colon + 1:].strip(WHITESPACE)
+    if not text:
+        return label, None, None
+    end = min((i for i in (text.find(" "), text.find("\t")) if i >= 0), default=len(text))
+    mnemonic = text[:end].lower()
+    operands = None
+    if end < len(text):
+        operands = unescape_string(text[end + 1:].lstrip(WHITESPACE))
+        if mnemonic == ".asciiz" and operands[:1] == '"' and operands[-1:] == '"':
+            operands = operands[1:-1]
+    return label, mnemonic, operands
+
+
+# -----------------------
+# Instruction Encoding Table
+# -----------------------
+
+InstructionDef = namedtuple("InstructionDef", "mnemonic type opcode funct3 funct4")
+
+INSTRUCTION_SET = {d.mnemonic: d for d in (
+    InstructionDef("add", INST_R, 0, 0, 0x0),
+    InstructionDef("sub", INST_R, 0, 0, 0x1),
+    InstructionDef("slt", INST_R, 0, 1, 0x0),
+    InstructionDef("sltu", INST_R, 0, 2, 0x0),
+    InstructionDef("sll", INST_R, 0, 3, 0x2),
+    InstructionDef("srl", INST_R, 0, 3, 0x4),
+    InstructionDef("sra", INST_R, 0, 3, 0x8),
+    InstructionDef("or", INST_R, 0, 4, 0x1),
+    InstructionDef("and", INST_R, 0, 5, 0x0),
+    InstructionDef("xor", INST_R, 0, 6, 0x0),
+    InstructionDef("mv", INST_R, 0, 7, 0x0),
+    InstructionDef("jr", INST_R, 0, 0, 0x4),
+    InstructionDef("jalr", INST_R, 0, 0, 0x8),
+    InstructionDef("addi", INST_I, 1, 0, 0),
+    InstructionDef("slti", INST_I, 1, 1, 0),
+    InstructionDef("sltui", INST_I, 1, 2, 0),
+    InstructionDef("slli", INST_I, 1, 3, 0),
+    InstructionDef("srli", INST_I, 1, 3, 0),
+    InstructionDef("srai", INST_I, 1, 3, 0),
+    InstructionDef("ori", INST_I, 1, 4, 0),
+    InstructionDef("andi", INST_I, 1, 5, 0),
+    InstructionDef("xori", INST_I, 1, 6, 0),
+    InstructionDef("li", INST_I, 1, 7, 0),
+    InstructionDef("beq", INST_B, 2, 0, 0),
+    InstructionDef("bne", INST_B, 2, 1, 0),
+    InstructionDef("bz", INST_B, 2, 2, 0),
+    InstructionDef("bnz", INST_B, 2, 3, 0),
+    InstructionDef("blt", INST_B, 2, 4, 0),
+    InstructionDef("bge", INST_B, 2, 5, 0),
+    InstructionDef("bltu", INST_B, 2, 6, 0),
+    InstructionDef("bgeu", INST_B, 2, 7, 0),
+    InstructionDef("lb", INST_L, 4, 0, 0),
+    InstructionDef("lw", INST_L, 4, 1, 0),
+    InstructionDef("lbu", INST_L, 4, 4, 0),
+    InstructionDef("sb", INST_L, 3, 0, 0),
+    InstructionDef("sw", INST_L, 3, 1, 0),
+    InstructionDef("j", INST_J, 5, 0, 0),
+    InstructionDef("jal", INST_J, 5, 0, 0),
+    InstructionDef("lui", INST_U, 6, 0, 0),
+    InstructionDef("auipc", INST_U, 6, 0, 0),
+    InstructionDef("ecall", INST_S, 7, 0, 0),
+)}
+
+DIRECTIVES = (".text", ".data", ".org", ".asciiz", ".byte", ".word", ".space")
+
+REGISTERS = {"t0": 0, "ra": 1, "sp": 2, "s0": 3, "s1": 4, "t1": 5, "a0": 6, "a1": 7}
+
+# Byte width of each listing column for 1- and 2-byte code elements
+_LISTING_WIDTH = {1: 2, 2: 4}
+
+
+Symbol = namedtuple("Symbol", "name address section")
+
+
+class SourceLine:
+    """One source line: its parsed fields, computed address and encoded code elements"""
+
+    __slots__ = ("line_no", "original", "address", "section", "label",
+                 "mnemonic", "operands", "code", "element_size")
+
+    def __init__(self, line_no, original, section):
+        self.line_no = line_no
+        self.original = original
+        self.address = 0
+        self.section = section
+        self.label = None
+        self.mnemonic = None
+        self.operands = None
+        self.code = []          # code elements, each stored in 16 bits
+        self.element_size = 0  # size in bytes of each code element (1 or 2)
+
+    def size(self):
+        """Number of bytes this line occupies in the memory image"""
+        return len(self.code) * self.element_size
+
+
+class Assembly:
+    """Result of assembling a source buffer"""
+
+    def __init__(self, image, symbols, lines, text_size, data_size):
+        self.image = image        # bytes of the memory image, starting at 0x0000
+        self.symbols = symbols    # lower-case label name -> Symbol
+        self.lines = lines        # SourceLine records in source order
+        self.text_size = text_size
+        self.data_size = data_size
+
+    def listing(self):
+        """Return the .lst listing text generated by z16asm.c"""
+        out = ["Line   Address   Machine Code    Source\n",
+               "-----------------------------------------------------\n"]
+        for line in self.lines:
+            if line.section in (SECTION_TEXT, SECTION_DATA):
+                out.append("%4d   0x%04X   " % (line.line_no, line.address))
+            else:
+                out.append("%4d           " % line.line_no)
+            if line.code:
+                width = _LISTING_WIDTH.get(line.element_size, 4)
+                out.append("".join("%0*X " % (width, c) for c in line.code))
+                out.append(" " * max(0, 12 - len(line.code) * (width + 1)))
+            else:
+                out.append(" " * 14)
+            out.append(" " + line.original)
+        return "".join(out)
+
+    def source_map(self):
+        """SourceMap of the text section: the source line of each instruction word"""
+        lines = array('H', bytes(2 * WORDS))
+        for line in self.lines:
+            if line.section == SECTION_TEXT and line.element_size == 2 and line.code:
+                word = line.address >> 1
+                number = line.line_no if line.line_no <= MAX_LINE else 0
+                for i in range(word, min(word + len(line.code), WORDS)):
+                    lines[i] = number
+        return SourceMap(lines)
+
+    def verbose(self):
+        """Return the symbol table and memory usage dump printed by 'z16asm -v'"""
+        out = ["\n--- Symbol Table ---\n"]
+        for sym in reversed(list(self.symbols.values())):
+            out.append("%-10s  0x%04X  %s\n" % (sym.name, sym.address, SECTION_NAMES[sym.section]))
+        out.append("\nMemory usage:\n")
+        out.append("  Text section: %d bytes\n" % self.text_size)
+        out.append("  Data section: %d bytes\n" % self.data_size)
+        return "".join(out)
+
+
+# -----------------------
+# Assembler
+# -----------------------
+
+class Z16Assembler:
+    """Two-pass assembler state: symbol table, source lines and location counters"""
+
+    def __init__(self):
+        self.symbols = {}
+        self.lines = []
+        self.loc_text = 0  # text section location counter (in bytes)
+        self.loc_data = 0  # data section location counter (in bytes)
+        self.current_section = SECTION_NONE
+
+    # --- Symbols ---
+
+    def add_symbol(self, name, address, section, line_no):
+        key = name.lower()
+        if key in self.symbols:
+            raise AssemblerError(line_no, f"Duplicate label {name}")
+        self.symbols[key] = Symbol(key, address, section)
+
+    def find_symbol(self, name):
+        return self.symbols.get(name.lower())
+
+    # --- Register and Immediate Parsing ---
+
+    def parse_register(self, token, line_no):
+        """Convert a register name (e.g. "X3" or "s0") to its register number"""
+        if token[:1] in ("x", "X"):
+            reg = strtol(token[1:], 10)
+            if reg < 0 or reg > 7:
+                raise AssemblerError(line_no, f"Invalid register number '{token}'")
+            return reg
+        reg = REGISTERS.get(token.lower())
+        if reg is None:
+            raise AssemblerError(line_no, f"Unknown register '{token}'")
+        return reg
+
+    def parse_immediate(self, token):
+        """Parse an immediate value. Supports labels, decimal, octal, hex, binary, %hi(...) and %lo(...)"""
+        sym = self.find_symbol(token)
+        if sym:
+            return sym.address
+        if token.startswith("%hi(") or token.startswith("%lo("):
+            inner = token[4:].split(")")[0]
+            sym = self.find_symbol(inner)
+            value = sym.address if sym else strtol(inner)
+            return value >> 7 if token[1] == "h" else value & 0x7F
+        # Support binary constants with "0b" or "0B" prefix.
+        if token[:2] in ("0b", "0B"):
+            return strtol(token[2:], 2)
+        return strtol(token)
+
+    # --- Source Line Parsing ---
+
+    def parse_source_line(self, line):
+        """Parse a source line and add its label (if any) to the symbol table"""
+        line.label, line.mnemonic, line.operands = parse_fields(line.original)
+        self.define_label(line)
+
+    def define_label(self, line):
+        """Add the line's label at the current location of the current section"""
+        if line.label is not None:
+            address = self.loc_text if self.current_section == SECTION_TEXT else self.loc_data
+            self.add_symbol(line.label, address, self.current_section, line.line_no)
+
+    # --- Pass 1: Build Symbol Table and Assign Addresses ---
+
+    def pass1(self, source):
+        for line_no, original in enumerate(_fgets_lines(source), 1):
+            line = SourceLine(line_no, original, self.current_section)
+            self.parse_source_line(line)
+            self.place_line(line)
+            self.lines.append(line)
+
+    def place_line(self, line):
+        """Assign a parsed line its section and address and advance the location counters"""
+        line.section = self.current_section
+        if self.current_section == SECTION_TEXT:
+            line.address = self.loc_text
+        elif self.current_section == SECTION_DATA:
+            line.address = self.loc_data
+        else:
+            line.address = 0
+
+        mnemonic = line.mnemonic
+        if mnemonic and mnemonic[0] == ".":
+            if mnemonic == ".text":
+                self.current_section = SECTION_TEXT
+            elif mnemonic == ".data":
+                self.current_section = SECTION_DATA
+            elif mnemonic == ".org":
+                self._require_operand(line, ".org missing operand")
+                new_org = strtol(line.operands)
+                if self.current_section == SECTION_TEXT:
+                    self.loc_text = line.address = new_org
+                elif self.current_section == SECTION_DATA:
+                    self.loc_data = line.address = new_org
+            elif mnemonic == ".asciiz":
+                self._require_operand(line, ".asciiz missing string operand")
+                line.element_size = 1  # each character is a byte
+                self.loc_data += len(line.operands.encode("utf-8")) + 1
+            elif mnemonic == ".byte":
+                self._require_operand(line, ".byte missing operand")
+                line.element_size = 1
+                self.loc_data += len(split_values(line.operands))
+            elif mnemonic == ".word":
+                self._require_operand(line, ".word missing operand")
+                line.element_size = 2
+                self.loc_data += len(split_values(line.operands)) * 2
+            elif mnemonic == ".space":
+                self._require_operand(line, ".space missing operand")
+                line.element_size = 1
+                self.loc_data += strtol(line.operands)
+        elif mnemonic:
+            # For instructions, each produces 2 bytes.
+            if self.current_section == SECTION_TEXT:
+                line.element_size = 2
+                self.loc_text += 2
+
+    @staticmethod
+    def _require_operand(line, message):
+        if line.operands is None:
+            raise AssemblerError(line.line_no, message)
+
+    # --- Pass 2: Encode Instructions and Process Data Directives ---
+
+    def pass2(self):
+        self.loc_text = 0
+        self.loc_data = 0
+        for line in self.lines:
+            self.encode_line(line)
+            self.count_line(line)
+
+    def encode_line(self, line):
+        """Fill in the code elements of an instruction or data directive line"""
+        mnemonic = line.mnemonic
+        if not mnemonic:
+            return
+        if mnemonic[0] != ".":
+            line.code = [self.encode_instruction(line)]
+            line.element_size = 2
+        elif mnemonic == ".asciiz":
+            # One code element per character, including the null terminator
+            data = line.operands.encode("utf-8") + b"\0"
+            # z16asm.c stores each (signed) char in 16 bits, so bytes >= 0x80 list as FFxx
+            line.code = [c | 0xFF00 if c & 0x80 else c for c in data]
+        elif mnemonic == ".byte":
+            line.code = [self.parse_immediate(v.strip(WHITESPACE)) & 0xFF
+                         for v in split_values(line.operands)]
+        elif mnemonic == ".word":
+            line.code = [self.parse_immediate(v.strip(WHITESPACE)) & 0xFFFF
+                         for v in split_values(line.operands)]
+
+    def count_line(self, line):
+        """Advance the pass 2 location counters (reported by the verbose dump) past a line"""
+        mnemonic = line.mnemonic
+        if not mnemonic:
+            return
+        if mnemonic[0] != ".":
+            self.loc_text += 2
+        elif mnemonic == ".org":
+            if self.current_section == SECTION_TEXT and line.section == SECTION_TEXT:
+                self.loc_text = line.address
+            elif self.current_section == SECTION_DATA and line.section == SECTION_DATA:
+                self.loc_data = line.address
+        elif mnemonic in (".asciiz", ".byte"):
+            self.loc_data += len(line.code)
+        elif mnemonic == ".word":
+            self.loc_data += len(line.code) * 2
+        elif mnemonic == ".space":
+            self.loc_data += strtol(line.operands)  # no code produced
+        elif mnemonic == ".text":
+            self.current_section = SECTION_TEXT
+        elif mnemonic == ".data":
+            self.current_section = SECTION_DATA
+
+    def resolve_label(self, token, line):
+        sym = self.find_symbol(token)
+        if sym is None:
+            raise AssemblerError(line.line_no, f"Undefined label '{token}'")
+        return sym.address
+
+    def encode_instruction(self, line):
+        """Encode an instruction line into its 16-bit machine word"""
+        inst = INSTRUCTION_SET.get(line.mnemonic)
+        line_no = line.line_no
+        if inst is None:
+            raise AssemblerError(line_no, f"Unknown mnemonic '{line.mnemonic}'")
+        tokens = [t for t in split_operands(line.operands) if t]
+
+        if inst.type == INST_R:
+            # R-type: Expect two register operands ("jr" takes a single register).
+            if line.operands is None:
+                raise AssemblerError(line_no, f"Missing operands for '{line.mnemonic}'")
+            if not tokens:
+                raise AssemblerError(line_no, "Expected register operand")
+            reg1 = self.parse_register(tokens[0], line_no)
+            if len(tokens) < 2:
+                if inst.mnemonic != "jr":
+                    raise AssemblerError(line_no, "Expected second register operand")
+                reg2 = reg1
+            elif inst.mnemonic == "jr":
+                raise AssemblerError(line_no, "Unexpected second operand for 'jr'")
+            else:
+                reg2 = self.parse_register(tokens[1], line_no)
+            return ((inst.funct4 & 0xF) << 12 | (reg2 & 0x7) << 9 | (reg1 & 0x7) << 6
+                    | (inst.funct3 & 0x7) << 3 | inst.opcode)
+
+        if inst.type == INST_I:
+            # I-type: Expect register, immediate.
+            if line.operands is None:
+                raise AssemblerError(line_no, f"Missing operands for '{line.mnemonic}'")
+            if not tokens:
+                raise AssemblerError(line_no, "Expected register operand")
+            reg = self.parse_register(tokens[0], line_no)
+            if len(tokens) < 2:
+                raise AssemblerError(line_no, "Expected immediate operand")
+            imm = self.parse_immediate(tokens[1])
+            if inst.mnemonic == "srli":
+                imm = (0x2 << 4) | (imm & 0xF)
+            elif inst.mnemonic == "srai":
+                imm = (0x4 << 4) | (imm & 0xF)
+            elif inst.mnemonic == "slli":
+                imm = (0x1 << 4) | (imm & 0xF)
+            return (imm & 0x7F) << 9 | (reg & 0x7) << 6 | (inst.funct3 & 0x7) << 3 | inst.opcode
+
+        if inst.type == INST_B:
+            # Branch instructions: bz/bnz take one register, the rest take two.
+            if line.operands is None:
+                raise AssemblerError(line_no, "Missing operands for branch")
+            if line.mnemonic in ("bz", "bnz"):
+                if not tokens:
+                    raise AssemblerError(line_no, "Expected register operand for branch")
+                rs1 = self.parse_register(tokens[0], line_no)
+                rs2 = 0
+                label_index = 1
+            else:
+                if not tokens:
+                    raise AssemblerError(line_no, "Expected first register operand for branch")
+                rs1 = self.parse_register(tokens[0], line_no)
+                if len(tokens) < 2:
+                    raise AssemblerError(line_no, "Expected second register operand for branch")
+                rs2 = self.parse_register(tokens[1], line_no)
+                label_index = 2
+            if len(tokens) <= label_index:
+                raise AssemblerError(line_no, "Expected label for branch")
+            offset = (self.resolve_label(tokens[label_index], line) - line.address) >> 1
+            if offset < -8 or offset > 7:
+                raise AssemblerError(line_no, "Branch offset out of range")
+            return ((offset & 0xF) << 12 | (rs2 & 0x7) << 9 | (rs1 & 0x7) << 6
+                    | (inst.funct3 & 0x7) << 3 | inst.opcode)
+
+        if inst.type == INST_L:
+            # Loads: rd, offset(rs). Stores: rs2, offset(rs1).
+            if line.operands is None:
+                raise AssemblerError(line_no, f"Missing operands for '{inst.mnemonic}'")
+            is_load = inst.opcode == 4
+            kind = "load" if is_load else "store"
+            if not tokens:
+                what = "destination" if is_load else "source"
+                raise AssemblerError(line_no, f"Expected {what} register for {kind}")
+            reg = self.parse_register(tokens[0], line_no)
+            if len(tokens) < 2:
+                raise AssemblerError(line_no, f"Expected memory operand for {kind}")
+            operand = tokens[1]
+            open_paren = operand.find("(")
+            close_paren = operand.find(")")
+            if open_paren < 0 or close_paren < 0:
+                raise AssemblerError(line_no, "Memory operand format error, expected offset(register)")
+            imm = self.parse_immediate(operand[:open_paren])
+            base = self.parse_register(operand[open_paren + 1:close_paren], line_no)
+            if is_load:
+                rs2, rd_rs1 = base, reg
+            else:
+                rs2, rd_rs1 = reg, base
+            return ((imm & 0xF) << 12 | (rs2 & 0x7) << 9 | (rd_rs1 & 0x7) << 6
+                    | (inst.funct3 & 0x7) << 3 | inst.opcode)
+
+        if inst.type == INST_J:
+            # J-type: PC-relative jump. Format: f | imm[9:4] | rd | imm[3:1] | opcode.
+            if line.operands is None:
+                raise AssemblerError(line_no, "Missing operand for jump")
+            rd = 0
+            f = 1 if inst.mnemonic == "jal" else 0
+            if f:
+                if not tokens:
+                    raise AssemblerError(line_no, "Expected register operand for jump")
+                rd = self.parse_register(tokens.pop(0), line_no)
+            if not tokens:
+                raise AssemblerError(line_no, "Expected label for jump")
+            offset = self.resolve_label(tokens[0], line) - line.address
+            if offset < -128 or offset > 127:
+                raise AssemblerError(line_no, "Jump offset out of range")
+            return (f << 15 | ((offset >> 4) & 0x3F) << 9 | (rd & 0x7) << 6
+                    | ((offset >> 1) & 0x7) << 3 | inst.opcode)
+
+        if inst.type == INST_U:
+            # U-type: Format: f | imm[15:10] | rd | imm[9:7] | opcode.
+            if not tokens:
+                raise AssemblerError(line_no, "Expected register for U-type instruction")
+            rd = self.parse_register(tokens[0], line_no)
+            if len(tokens) < 2:
+                raise AssemblerError(line_no, "Expected immediate for U-type instruction")
+            imm = self.parse_immediate(tokens[1])
+            f = 1 if inst.mnemonic == "auipc" else 0
+            return (f << 15 | ((imm >> 3) & 0x3F) << 9 | (rd & 0x7) << 6
+                    | (imm & 0x7) << 3 | inst.opcode)
+
+        # System instructions.
+        if line.operands is None:
+            raise AssemblerError(line_no, "ecall missing operand")
+        return ((self.parse_immediate(line.operands) << 6) | 0x7) & 0xFFFF
+
+    # --- Memory Image ---
+
+    def build_image(self):
+        """Lay out every line's code at its computed address and return the image bytes"""
+        max_addr = 0
+        for line in self.lines:
+            if line.code:
+                max_addr = max(max_addr, line.address + line.size())
+        image = bytearray(max(max_addr, 1))  # write at least one byte
+        for line in self.lines:
+            if not line.code or line.section not in (SECTION_TEXT, SECTION_DATA):
+                continue
+            addr = line.address
+            if line.element_size == 1:
+                image[addr:addr + len(line.code)] = bytes(c & 0xFF for c in line.code)
+            else:
+                for c in line.code:
+                    image[addr] = c & 0xFF
+                    image[addr + 1] = (c >> 8) & 0xFF
+                    addr += 2
+        return bytes(image)
+
+    def assemble(self, source):
+        self.pass1(source)
+        self.pass2()
+        return Assembly(self.build_image(), self.symbols, self.lines, self.loc_text, self.loc_data)
+
+
+class _CachedLine:
+    """Incremental assembler cache entry: one parsed source line and its last encoding"""
+
+    __slots__ = ("key", "line", "references", "pc_relative", "encoded_at", "error")
+
+    def __init__(self, key, original):
+        self.key = key
+        self.line = SourceLine(0, original, SECTION_NONE)
+        line = self.line
+        line.label, line.mnemonic, line.operands = parse_fields(original)
+        self.references = symbol_references(line.operands)
+        # Branch and jump offsets are the only encodings that depend on the line's own address
+        inst = INSTRUCTION_SET.get(line.mnemonic)
+        self.pc_relative = inst is not None and inst.type in (INST_B, INST_J)
+        self.encoded_at = None  # address the cached code was encoded at; None if never encoded
+        self.error = None       # pass 2 error message for this line, if any
+
+
+class IncrementalAssembler(Z16Assembler):
+    """
+    Assembler that keeps every line's parse and encoding between runs.
+
+    update() takes the buffer as (revision, text) pairs, one per line, where
+    the revision changes whenever the line's text does (QTextBlock.revision()
+    in the IDE). Edited lines are re-parsed; a line is re-encoded only if it is
+    new, is a branch/jump that moved to another address, or references a label
+    whose definition changed, found through an index from label names to the
+    lines using them.
+    Pass 1 still walks every line, but only to add up cached sizes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._entries = []
+        self._references = {}       # lower-case name -> set of entries referencing it
+        self._encoded_symbols = {}  # symbol table the cached encodings were built against
+        self.reencoded = 0          # number of lines re-encoded by the last update()
+
+    def _index(self, entry):
+        for name in entry.references:
+            self._references.setdefault(name, set()).add(entry)
+
+    def _unindex(self, entry):
+        for name in entry.references:
+            users = self._references.get(name)
+            if users is not None:
+                users.discard(entry)
+                if not users:
+                    del self._references[name]
+
+    def _match_entries(self, blocks):
+        """Pair each (revision, text) block with its cached entry, creating entries for edited lines"""
+        blocks = list(blocks)
+        last = len(blocks)
+        # A trailing empty line is not a line as far as fgets() is concerned
+        if blocks and not blocks[-1][1]:
+            blocks.pop()
+        unused = {}
+        for entry in reversed(self._entries):
+            unused.setdefault(entry.key, []).append(entry)
+        entries = []
+        for line_no, (revision, text) in enumerate(blocks, 1):
+            original = text if line_no == last else text + "\n"
+            key = (revision, original)
+            candidates = unused.get(key)
+            if candidates:
+                entry = candidates.pop()
+            else:
+                entry = _CachedLine(key, original)
+                self._index(entry)
+            entry.line.line_no = line_no
+            entries.append(entry)
+        for candidates in unused.values():
+            for entry in candidates:
+                self._unindex(entry)
+        return entries
+
+    def update(self, blocks):
+        """Re-assemble the buffer given as (revision, text) pairs; raises AssemblerError on the first error"""
+        self._entries = entries = self._match_entries(blocks)
+        self.lines = [entry.line for entry in entries]
+
+        # Pass 1 over the cached parses
+        self.symbols = {}
+        self.loc_text = 0
+        self.loc_data = 0
+        self.current_section = SECTION_NONE
+        for line in self.lines:
+            self.define_label(line)
+            self.place_line(line)
+
+        # Lines referencing a label that was added, removed or moved must be re-encoded
+        old = self._encoded_symbols
+        dirty = set()
+        for name in old.keys() | self.symbols.keys():
+            if old.get(name) != self.symbols.get(name):
+                dirty.update(self._references.get(name, ()))
+
+        # Pass 2, reusing cached code wherever it is still valid
+        self.loc_text = 0
+        self.loc_data = 0
+        self.reencoded = 0
+        first_error = None
+        for entry in entries:
+            line = entry.line
+            if (entry.encoded_at is None or entry in dirty
+                    or (entry.pc_relative and entry.encoded_at != line.address)):
+                self._encode_entry(entry)
+            if entry.error is not None and first_error is None:
+                first_error = entry
+            self.count_line(line)
+        self._encoded_symbols = dict(self.symbols)
+
+        if first_error is not None:
+            raise AssemblerError(first_error.line.line_no, first_error.error)
+        return Assembly(self.build_image(), dict(self.symbols), list(self.lines),
+                        self.loc_text, self.loc_data)
+
+    def _encode_entry(self, entry):
+        line = entry.line
+        entry.error = None
+        try:
+            self.encode_line(line)
+        except AssemblerError as e:
+            line.code = []
+            entry.error = e.message
+        entry.encoded_at = line.address
+        self.reencoded += 1
+
+
+def _fgets_lines(source):
+    """Split on '\\n' only, keeping the terminator, like repeated fgets() calls"""
+    parts = source.split("\n")
+    lines = [p + "\n" for p in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def assemble(source):
+    """Assemble a Z16 source string; raises AssemblerError on the first error"""
+    return Z16Assembler().assemble(source)
+
+
+def main(argv):
+    verbose = False
+    debug = False
+    filename = None
+    bin_filename = None
+
+    if len(argv) < 2:
+        sys.stderr.write("Usage: %s [-v] [-d] [-o <binary_file>] <sourcefile>\n" % argv[0])
+        return 1
+    args = iter(argv[1:])
+    for arg in args:
+        if arg == "-v":
+            verbose = True
+        elif arg == "-d":
+            debug = True
+        elif arg == "-o":
+            bin_filename = next(args, None)
+            if bin_filename is None:
+                sys.stderr.write("Error: -o switch requires a binary file name\n")
+                return 1
+        else:
+            filename = arg
+    if filename is None:
+        sys.stderr.write("Error: No source file specified.\n")
+        return 1
+    # If no binary file name provided, derive it from the source file name.
+    stem = filename.rsplit(".", 1)[0] if "." in filename else filename
+    if bin_filename is None:
+        bin_filename = stem + ".bin"
+
+    try:
+        with open(filename, "r", newline="") as fp:
+            source = fp.read()
+    except OSError as e:
+        sys.stderr.write("Error opening source file: %s\n" % e.strerror)
+        return 1
+
+    assembler = Z16Assembler()
+    try:
+        if debug:
+            print("Debug: Starting Pass 1")
+        assembler.pass1(source)
+        if debug:
+            print("Debug: Pass 1 complete, %d lines processed" % len(assembler.lines))
+            print("Debug: Starting Pass 2")
+        assembler.pass2()
+        if debug:
+            print("Debug: Pass 2 complete")
+    except AssemblerError as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    result = Assembly(assembler.build_image(), assembler.symbols, assembler.lines,
+                      assembler.loc_text, assembler.loc_data)
+
+    listing_filename = stem + ".lst"
+    with open(listing_filename, "w", newline="") as lst:
+        lst.write(result.listing())
+    print("Listing file generated: %s" % listing_filename)
+    map_filename = stem + ".map"
+    result.source_map().save(map_filename)
+    print("Source map generated: %s" % map_filename)
+    with open(bin_filename, "wb") as fp:
+        fp.write(result.image)
+    print("Binary file generated: %s" % bin_filename)
+    if verbose:
+        sys.stdout.write(result.verbose())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,494 @@
+"""
+Z16 batch simulator - one program, many inputs, run in lockstep
+
+Grading and fuzzing run the same binary over and over with different
+registers (a0/a1) or data regions. BatchSimulator runs N copies of the
+machine ("lanes") together, with their state held in NumPy arrays:
+
+    regs    N x 8 uint16     x0..x7 of each lane
+    pc      N uint16
+    memory  N x 65536 uint8
+    count   N int64          instructions retired
+
+Each step fetches the word at every running lane's PC and executes it for
+all of them at once as vector operations. While the lanes agree on the
+instruction word (the usual case: same code, same PC) its decoded
+operands are plain numbers and registers are whole columns of 'regs'.
+Once branches send lanes different ways, the step groups the lanes by
+operation, looked up in tables built from z16sim's decode table, and
+runs one masked vector operation per group with per-lane operands, so a
+step costs one operation per kind of instruction in flight however far
+the PCs have spread. ecall output is written per lane in Python.
+
+    batch = BatchSimulator(1000)
+    batch.load(image)
+    batch.regs[:, 6] = range(1000)          # a0 of each lane
+    batch.memory[:, 0x8000:0x8004] = data   # a 1000 x 4 array of inputs
+    batch.run(100000)
+    batch.output(17), batch.stop_reason(17), batch.register_state(17)
+
+Semantics are those of Z16Simulator.run without a trace callback, per
+lane: the same stop reasons, instruction and output budgets and final
+state; stores into code are seen by the next fetch. Breakpoints and the
+profile stay with the single-machine simulator. Memory costs 64KB per
+lane. Needs NumPy.
+
+Usage:
+python z16batch.py [--max-instructions=N] [--timeout=SECONDS] [--max-output=BYTES]
+                   <machine_code_file_name> <inputs_file>
+
+Each line of the inputs file is one run of the program: space-separated
+register assignments (a0=5 a1=-3, ABI or x0..x7 names) and memory writes
+(0x8000=01020304, an address and hex bytes). Empty lines and lines
+starting with '#' are skipped. Every run prints its ecall output, how it
+stopped and its final registers, in the order of the inputs.
+"""
+
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # reported by BatchSimulator, so importing this module never fails
+    np = None
+
+from z16sim import (MEM_SIZE, MAX_INSTRUCTIONS, REG_NAMES, WATCHDOG_INTERVAL, STOP_ECALL,
+                    STOP_ZERO_INSTRUCTION, STOP_END_OF_MEMORY, STOP_TIME_LIMIT,
+                    STOP_OUTPUT_LIMIT, decode_table, describe_stop, describe_summary,
+                    parse_budget_option, register_state, to_signed, DEFAULT_BUDGET,
+                    _add, _sub, _jr, _jalr, _slt, _sltu, _sll, _srl, _sra, _or, _and, _xor,
+                    _mv, _addi, _slti, _sltui, _slli, _srli, _srai, _ori, _andi, _xori, _li,
+                    _beq, _bne, _bz, _bnz, _blt, _bge, _bltu, _bgeu, _sb, _sw, _lb, _lw,
+                    _lbu, _j, _jal, _lui, _auipc, _ecall)
+
+# Per-lane stop codes; 0 = still running (or only out of instruction budget)
+REASONS = (None, STOP_ECALL, STOP_ZERO_INSTRUCTION, STOP_END_OF_MEMORY, STOP_TIME_LIMIT,
+           STOP_OUTPUT_LIMIT)
+_ECALL, _ZERO, _END, _TIME, _OUTPUT = range(1, len(REASONS))
+
+
+def _signed(x):
+    return (x ^ 0x8000) - 0x8000
+
+
+# -----------------------
+# Vector Operations
+# -----------------------
+#
+# Register values are read as int64 arrays, results are masked back to 16
+# bits. 'x' is register a, 'y' register b (or the immediate).
+
+_REGISTER_OPS = {
+    _add: lambda x, y: x + y,
+    _sub: lambda x, y: x - y,
+    _slt: lambda x, y: _signed(x) < _signed(y),
+    _sltu: lambda x, y: x < y,
+    _sll: lambda x, y: x << (y & 0xF),
+    _srl: lambda x, y: x >> (y & 0xF),
+    _sra: lambda x, y: _signed(x) >> (y & 0xF),
+    _or: lambda x, y: x | y,
+    _and: lambda x, y: x & y,
+    _xor: lambda x, y: x ^ y,
+    _mv: lambda x, y: y,
+}
+
+_IMMEDIATE_OPS = {
+    _addi: lambda x, imm: x + imm,
+    _slti: lambda x, imm: _signed(x) < imm,
+    _sltui: lambda x, imm: x < (imm & 0xFFFF),
+    _slli: lambda x, imm: x << imm,
+    _srli: lambda x, imm: x >> imm,
+    _srai: lambda x, imm: _signed(x) >> imm,
+    _ori: lambda x, imm: x | (imm & 0xFFFF),
+    _andi: lambda x, imm: x & (imm & 0xFFFF),
+    _xori: lambda x, imm: x ^ (imm & 0xFFFF),
+    _li: lambda x, imm: imm & 0xFFFF,
+    _lui: lambda x, imm: imm,
+}
+
+_CONDITIONS = {
+    _beq: lambda x, y: x == y,
+    _bne: lambda x, y: x != y,
+    _bz: lambda x, y: x == 0,
+    _bnz: lambda x, y: x != 0,
+    _blt: lambda x, y: _signed(x) < _signed(y),
+    _bge: lambda x, y: _signed(x) >= _signed(y),
+    _bltu: lambda x, y: x < y,
+    _bgeu: lambda x, y: x >= y,
+}
+
+_tables = None
+
+
+def _decode_arrays():
+    """
+    The decode table as arrays indexed by instruction word: operation
+    number (an index into the returned handler tuple), a, b and imm
+    """
+    global _tables
+    if _tables is None:
+        table = decode_table()
+        handlers = tuple(dict.fromkeys(entry[0] for entry in table))
+        number = {handler: i for i, handler in enumerate(handlers)}
+        ops = np.array([number[entry[0]] for entry in table], dtype=np.int16)
+        a, b, imm = (np.array([entry[i] for entry in table], dtype=np.int64) for i in (1, 2, 3))
+        _tables = (handlers, ops, a, b, imm)
+    return _tables
+
+
+class BatchSimulator:
+    """'lanes' Z16 machines stepped together (see the module docstring)"""
+
+    def __init__(self, lanes, max_output=None):
+        if np is None:
+            raise ImportError("the batch simulator needs NumPy (pip install numpy)")
+        if lanes < 1:
+            raise ValueError("a batch needs at least one lane")
+        self.lanes = lanes
+        self.max_output = max_output
+        self.table = decode_table()
+        self.handlers, self.ops, self.a, self.b, self.imm = _decode_arrays()
+        self.memory = np.zeros((lanes, MEM_SIZE), dtype=np.uint8)
+        self.regs = np.zeros((lanes, 8), dtype=np.uint16)
+        self.pc = np.zeros(lanes, dtype=np.uint16)
+        self.count = np.zeros(lanes, dtype=np.int64)
+        self.stop = np.zeros(lanes, dtype=np.int8)
+        self.output_bytes = np.zeros(lanes, dtype=np.int64)
+        self.output_exceeded = np.zeros(lanes, dtype=bool)
+        self.outputs = [[] for _ in range(lanes)]
+
+    def reset(self):
+        """Clear registers, PCs, counters and output of every lane; memory is left untouched"""
+        self.regs[:] = 0
+        self.pc[:] = 0
+        self.count[:] = 0
+        self.stop[:] = 0
+        self.output_bytes[:] = 0
+        self.output_exceeded[:] = False
+        self.outputs = [[] for _ in range(self.lanes)]
+
+    def load(self, image):
+        """Copy a binary image into every lane's memory starting at 0x0000 and reset"""
+        n = min(len(image), MEM_SIZE)
+        self.memory[:] = 0
+        self.memory[:, :n] = np.frombuffer(bytes(image[:n]), dtype=np.uint8)
+        self.reset()
+        return n
+
+    def load_file(self, filename):
+        """Load a .bin file into every lane; returns the number of bytes loaded"""
+        with open(filename, "rb") as fp:
+            return self.load(fp.read(MEM_SIZE))
+
+    def restore(self, snapshot):
+        """Start every lane from a z16snapshot.Snapshot"""
+        self.load(snapshot.memory())
+        self.regs[:] = snapshot.regs
+        self.pc[:] = snapshot.pc
+        self.count[:] = snapshot.count
+
+    # --- Results of one lane ---
+
+    def stop_reason(self, lane):
+        """Why 'lane' stopped (a z16sim STOP_* value), or None if it ran out of instruction budget"""
+        return REASONS[self.stop[lane]]
+
+    def output(self, lane):
+        """Everything 'lane' printed"""
+        return "".join(self.outputs[lane])
+
+    def register_state(self, lane):
+        return register_state([int(value) for value in self.regs[lane]], int(self.pc[lane]))
+
+    # --- Running ---
+
+    def run(self, max_instructions=MAX_INSTRUCTIONS, deadline=None):
+        """
+        Run every lane that has not stopped until it stops or 'max_instructions'
+        more instructions have retired (None = no limit). 'deadline' is a
+        time.perf_counter() value checked every WATCHDOG_INTERVAL steps; once
+        it has passed the unfinished lanes stop with STOP_TIME_LIMIT. Returns
+        the number of lanes that ran out of instruction budget.
+        """
+        if max_instructions is None:
+            max_instructions = sys.maxsize
+        memory, table = self.memory, self.table
+        flat = memory.reshape(-1)
+        lanes = np.flatnonzero(self.stop == 0)
+        # One PC for all lanes while they agree, an array once branches split them
+        pc = _converged(self.pc[lanes].astype(np.int64))
+        steps = 0
+        while len(lanes) and steps < max_instructions:
+            if deadline is not None and steps and steps % WATCHDOG_INTERVAL == 0 \
+                    and time.perf_counter() >= deadline:
+                lanes, pc = self._retire(lanes, pc, np.full(len(lanes), _TIME), steps)
+                break
+            # Whole columns of 'regs' and 'memory' while every lane is running
+            rows = slice(None) if len(lanes) == self.lanes else lanes
+            if isinstance(pc, int):
+                ended = pc == 0xFFFF
+                inst = memory[rows, pc] | (memory[rows, (pc + 1) & 0xFFFF].astype(np.int64) << 8)
+            else:
+                ended = pc.max() == 0xFFFF
+                base = lanes * MEM_SIZE
+                inst = flat[base + pc] | (flat[base + ((pc + 1) & 0xFFFF)].astype(np.int64) << 8)
+            if ended or not inst.all():
+                # Checked before executing, like the interpreter
+                codes = np.where(pc == 0xFFFF, _END, np.where(inst == 0, _ZERO, 0))
+                lanes, pc = self._retire(lanes, pc, codes, steps)
+                continue
+
+            first = inst[0]
+            ecall = False
+            if (inst == first).all():
+                handler, a, b, imm = table[first]
+                next_pc = self._execute(handler, rows, lanes, pc, a, b, imm)
+                ecall = handler is _ecall
+            else:
+                # Lanes running different instructions: one vector operation per operation in flight
+                pc = np.broadcast_to(pc, lanes.shape)
+                ops = self.ops[inst]
+                order = np.argsort(ops, kind="stable")
+                ops = ops[order]
+                cuts = np.flatnonzero(ops[1:] != ops[:-1]) + 1
+                a, b, imm = self.a[inst], self.b[inst], self.imm[inst]
+                next_pc = np.empty(len(lanes), dtype=np.int64)
+                for op, group in zip(ops[np.r_[0, cuts]], np.split(order, cuts)):
+                    handler = self.handlers[op]
+                    group_lanes = lanes[group]
+                    next_pc[group] = self._execute(handler, group_lanes, group_lanes, pc[group],
+                                                   a[group], b[group], imm[group])
+                    ecall = ecall or handler is _ecall
+            if ecall and np.min(next_pc) < 0:
+                # Stopped on the ecall: not retired, the PC stays on it
+                codes = np.where(next_pc < 0,
+                                 np.where(self.output_exceeded[lanes], _OUTPUT, _ECALL), 0)
+                lanes, next_pc = self._retire(lanes, next_pc, codes, steps, pc)
+            pc = next_pc if isinstance(next_pc, int) else _converged(next_pc)
+            steps += 1
+        self.pc[lanes] = pc
+        self.count[lanes] += steps
+        return len(lanes)
+
+    def _retire(self, lanes, pc, codes, steps, stop_pc=None):
+        """Stop the lanes with a nonzero code; returns the lanes (and their PCs) still running"""
+        stopped = codes != 0
+        gone = lanes[stopped]
+        self.stop[gone] = codes[stopped]
+        self.pc[gone] = np.broadcast_to(pc if stop_pc is None else stop_pc, lanes.shape)[stopped]
+        self.count[gone] += steps
+        running = lanes[~stopped]
+        return running, _converged(np.broadcast_to(pc, lanes.shape)[~stopped])
+
+    def _execute(self, handler, rows, lanes, pc, a, b, imm):
+        """
+        Execute one operation for 'lanes' (their rows of 'regs' are 'rows')
+        at 'pc'; pc, a, b and imm are numbers or per-lane arrays. Returns
+        the next PC (a number if it is the same for all of them), -1 for a
+        lane stopped by an ecall.
+        """
+        regs = self.regs
+        after = (pc + 2) & 0xFFFF
+        operation = _REGISTER_OPS.get(handler)
+        if operation is not None:
+            x = regs[rows, a].astype(np.int64)
+            regs[rows, a] = operation(x, regs[rows, b].astype(np.int64)) & 0xFFFF
+            return after
+        operation = _IMMEDIATE_OPS.get(handler)
+        if operation is not None:
+            regs[rows, a] = operation(regs[rows, a].astype(np.int64), imm) & 0xFFFF
+            return after
+        condition = _CONDITIONS.get(handler)
+        if condition is not None:
+            taken = condition(regs[rows, a].astype(np.int64), regs[rows, b].astype(np.int64))
+            return np.where(taken, (pc + imm) & 0xFFFF, after)
+
+        memory = self.memory
+        if handler is _lw or handler is _lb or handler is _lbu:
+            addr = (regs[rows, b].astype(np.int64) + imm) & 0xFFFF
+            value = memory[lanes, addr].astype(np.int64)
+            if handler is _lw:
+                value |= memory[lanes, (addr + 1) & 0xFFFF].astype(np.int64) << 8
+            elif handler is _lb:
+                value = np.where(value & 0x80, value | 0xFF00, value)  # sign-extended
+            regs[rows, a] = value
+            return after
+        if handler is _sw or handler is _sb:
+            addr = (regs[rows, a].astype(np.int64) + imm) & 0xFFFF
+            value = regs[rows, b]
+            memory[lanes, addr] = value & 0xFF
+            if handler is _sw:
+                # Wraps past the end of memory like Z16Simulator
+                memory[lanes, (addr + 1) & 0xFFFF] = value >> 8
+            return after
+        if handler is _j:
+            return (pc + imm) & 0xFFFF
+        if handler is _jal:
+            regs[rows, a] = after
+            return (pc + imm) & 0xFFFF
+        if handler is _jr or handler is _jalr:
+            target = regs[rows, b].astype(np.int64)
+            if handler is _jalr:
+                regs[rows, a] = after
+            return target
+        if handler is _auipc:
+            regs[rows, a] = (pc + imm) & 0xFFFF
+            return after
+        if handler is _ecall:
+            return self._ecall(lanes, np.broadcast_to(after, lanes.shape), imm)
+        return after  # unused encodings execute as no-ops
+
+    def _ecall(self, lanes, after, service):
+        """ecall for 'lanes': printing goes lane by lane, ecall 3 (or a full output budget) stops"""
+        service = np.broadcast_to(service, lanes.shape)
+        next_pc = np.where(service == 3, -1, after)
+        for i in np.flatnonzero((service == 1) | (service == 5)):
+            lane = lanes[i]
+            a0 = int(self.regs[lane, 6])
+            if service[i] == 1:
+                text = "%d\n" % to_signed(a0)
+            else:
+                text = _read_string(self.memory[lane], a0) + "\n"
+            if not self._output(lane, text):
+                next_pc[i] = -1
+        return next_pc
+
+    def _output(self, lane, text):
+        """Z16Simulator.output for one lane"""
+        used = int(self.output_bytes[lane])
+        if self.max_output is not None and used + len(text) > self.max_output:
+            text = text[:self.max_output - used]
+            self.output_exceeded[lane] = True
+        self.output_bytes[lane] = used + len(text)
+        if text:
+            self.outputs[lane].append(text)
+        return not self.output_exceeded[lane]
+
+
+def _converged(pc):
+    """'pc' as a single number if all its lanes agree (or none is left)"""
+    if not len(pc):
+        return 0
+    first = int(pc[0])
+    return first if (pc == first).all() else pc
+
+
+def _read_string(row, addr):
+    """Z16Simulator.read_string over one lane's memory"""
+    mem = row.tobytes()
+    end = mem.find(0, addr)
+    if end < 0:
+        end = mem.find(0)
+        return (mem[addr:] + mem[:max(end, 0)]).decode("latin-1")
+    return mem[addr:end].decode("latin-1")
+
+
+# -----------------------
+# Inputs
+# -----------------------
+
+_REGISTERS = {name: i for i, name in enumerate(REG_NAMES)}
+_REGISTERS.update(("x%d" % i, i) for i in range(8))
+
+
+def parse_inputs(lines):
+    """
+    Parse inputs file lines into one (registers, writes) pair per run:
+    {register number: value} and [(address, bytes)]. Raises ValueError
+    naming the offending line.
+    """
+    runs = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        registers, writes = {}, []
+        for token in line.split():
+            name, sep, value = token.partition("=")
+            try:
+                if not sep:
+                    raise ValueError("expected name=value")
+                if name.lower() in _REGISTERS:
+                    registers[_REGISTERS[name.lower()]] = int(value, 0) & 0xFFFF
+                else:
+                    address = int(name, 0)
+                    data = bytes.fromhex(value)
+                    if not 0 <= address <= MEM_SIZE - len(data):
+                        raise ValueError("write outside memory")
+                    writes.append((address, data))
+            except ValueError as e:
+                raise ValueError("line %d: %s: %s" % (number, token, e)) from None
+        runs.append((registers, writes))
+    return runs
+
+
+def main(argv):
+    usage = ("Usage: %s [--max-instructions=N] [--timeout=SECONDS] [--max-output=BYTES] "
+             "<machine_code_file_name> <inputs_file>\n" % argv[0])
+    budget = DEFAULT_BUDGET
+    files = []
+    for arg in argv[1:]:
+        try:
+            new_budget = parse_budget_option(arg, budget)
+        except ValueError:
+            files = []
+            break
+        if new_budget is not None:
+            budget = new_budget
+        elif not arg.startswith("--"):
+            files.append(arg)
+        else:
+            files = []
+            break
+    if len(files) != 2:
+        sys.stderr.write(usage)
+        return 1
+    if np is None:
+        sys.stderr.write("z16batch needs NumPy (pip install numpy)\n")
+        return 1
+
+    try:
+        with open(files[0], "rb") as fp:
+            image = fp.read(MEM_SIZE)
+    except OSError as e:
+        sys.stderr.write("Error opening binary file: %s\n" % e.strerror)
+        return 1
+    try:
+        with open(files[1]) as fp:
+            runs = parse_inputs(fp)
+    except OSError as e:
+        sys.stderr.write("Error opening inputs file: %s\n" % e.strerror)
+        return 1
+    except ValueError as e:
+        sys.stderr.write("Error in inputs file: %s\n" % e)
+        return 1
+    if not runs:
+        sys.stderr.write("Error in inputs file: no runs\n")
+        return 1
+
+    batch = BatchSimulator(len(runs), max_output=budget.output)
+    batch.load(image)
+    for lane, (registers, writes) in enumerate(runs):
+        for register, value in registers.items():
+            batch.regs[lane, register] = value
+        for address, data in writes:
+            batch.memory[lane, address:address + len(data)] = np.frombuffer(data, dtype=np.uint8)
+
+    start = time.perf_counter()
+    deadline = start + budget.seconds if budget.seconds else None
+    batch.run(budget.instructions, deadline)
+    elapsed = time.perf_counter() - start
+
+    write = sys.stdout.write
+    for lane in range(len(runs)):
+        write("--- Run %d ---\n" % (lane + 1))
+        write(batch.output(lane))
+        write(describe_stop(batch.stop_reason(lane), int(batch.pc[lane]), int(batch.count[lane]),
+                            budget))
+        write(batch.register_state(lane))
+    write("%d runs: " % len(runs) + describe_summary(int(batch.count.sum()), elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
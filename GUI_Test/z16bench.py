@@ -0,0 +1,451 @@
+"""
+Z16 benchmark harness
+
+Times every stage of the F1 (assemble and run) pipeline on synthetic
+programs generated from a fixed seed, and appends the numbers to a JSON
+history file, so a regression between two versions shows up as a change
+in the same metric from one entry to the next.
+
+Stages:
+- asm:   z16asm.py on programs from 256 to 4096 lines, the IDE's
+         incremental re-assembly after a one-line edit, and optionally a
+         z16asm.c build (--c-assembler) on the same programs and on one
+         of C_ASM_LINES lines
+- sim:   simulated instructions per second for arithmetic, memory and
+         ecall-heavy loops, with the IDE's trace callback and without it
+- batch: lane-instructions per second of z16batch.py running BATCH_LANES
+         copies of each loop in lockstep (needs NumPy; skipped without it)
+- trace: binary and NDJSON trace records decoded per second
+- gui:   appending and painting a run in the trace view, filtering it,
+         updating the register table and repainting the editor's line
+         numbers (needs PyQt5; skipped with --no-gui)
+
+Metric names end in their unit; *_ms and *_us are better lower, *_per_s
+higher. Each run is compared with the last history entry made in the same
+(--quick or full) mode and changes worse than REGRESSION_THRESHOLD are
+flagged.
+
+Usage:
+python z16bench.py [--quick] [--no-gui] [--repeat <n>] [--label <name>]
+                   [--history <file.json>] [--c-assembler <path>]
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from z16asm import IncrementalAssembler, assemble
+from z16sim import Z16Simulator
+from z16trace import (BinaryTraceDecoder, BinaryTraceEncoder, NDJSONTraceDecoder,
+                      NDJSONTraceEncoder, StepRecorder)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY = os.path.join(HERE, "z16bench_history.json")
+
+# z16asm.c used to stop at 2048 lines (MAX_LINES); the sizes still straddle it
+# so results stay comparable with older history entries
+C_MAX_LINES = 2048
+ASM_SIZES = (256, 1024, C_MAX_LINES, 2 * C_MAX_LINES)
+QUICK_ASM_SIZES = (256, C_MAX_LINES)
+# Extra size for z16asm.c only; too slow to repeat with z16asm.py
+C_ASM_LINES = 100000
+
+SIM_INSTRUCTIONS = 1000000
+QUICK_SIM_INSTRUCTIONS = 100000
+
+# Machines run together by the batch benchmark
+BATCH_LANES = 1000
+
+# Relative change counted as a regression when comparing with the last run
+REGRESSION_THRESHOLD = 0.10
+
+SEED = 16
+
+# -----------------------
+# Workloads
+# -----------------------
+
+_REGS = ("t0", "ra", "sp", "s0", "s1", "t1", "a0", "a1")
+_TEMPLATES = (
+    "add {r}, {s}", "sub {r}, {s}", "and {r}, {s}", "or {r}, {s}", "xor {r}, {s}",
+    "slt {r}, {s}", "sltu {r}, {s}", "mv {r}, {s}", "sll {r}, {s}",
+    "addi {r}, {imm}", "li {r}, {imm}", "ori {r}, {imm}", "xori {r}, {imm}",
+    "slli {r}, {shift}", "srli {r}, {shift}", "srai {r}, {shift}",
+    "lw {r}, {offset}({s})", "lb {r}, {offset}({s})", "sw {r}, {offset}({s})",
+    "sb {r}, {offset}({s})",
+)
+
+
+def synthetic_program(lines, seed=SEED):
+    """
+    A valid Z16 source of exactly 'lines' lines: labelled groups of random
+    instructions, each ending in a short backward branch, plus a data section
+    """
+    rng = random.Random(seed)
+    data = [".data", "    .org 0x%04X" % ((lines * 2 + 0x100) & ~0xFF),
+            "table:  .word 1, 2, 3, 4", 'msg:    .asciiz "benchmark"']
+    out = [".text", "    .org 0", "main:"]
+    group = 0
+    while len(out) < lines - len(data):
+        room = lines - len(data) - len(out)
+        if room < 3:
+            out.append("    add a0, a1")
+            continue
+        out.append("L%d:" % group)
+        for _ in range(min(6, room - 2)):
+            out.append("    " + rng.choice(_TEMPLATES).format(
+                r=rng.choice(_REGS), s=rng.choice(_REGS), imm=rng.randint(-64, 63),
+                shift=rng.randint(0, 15), offset=rng.randrange(0, 16, 2)))
+        out.append("    bnz t1, L%d" % group)
+        group += 1
+    return "\n".join(out + data) + "\n"
+
+
+# Loops that never end on their own: the instruction budget stops them
+LOOPS = {
+    "arith": """
+.text
+    li a0, 1
+    li a1, 3
+loop:
+    add a0, a1
+    addi a1, 5
+    xor s0, a0
+    slli s0, 1
+    sub s0, a1
+    srai s1, 2
+    or s1, s0
+    beq t0, t0, loop
+""",
+    "memory": """
+.text
+    lui s1, %hi(buffer)
+    addi s1, %lo(buffer)
+loop:
+    lw a0, 0(s1)
+    addi a0, 1
+    sw a0, 0(s1)
+    lb a1, 2(s1)
+    sb a1, 4(s1)
+    lbu s0, 6(s1)
+    sw s0, 8(s1)
+    beq t0, t0, loop
+
+.data
+    .org 0x400
+buffer: .word 0, 0, 0, 0, 0, 0, 0, 0
+""",
+    "ecall": """
+.text
+    li a0, 0
+loop:
+    addi a0, 1
+    ecall 1
+    beq t0, t0, loop
+""",
+}
+
+
+# -----------------------
+# Measurements
+# -----------------------
+
+def best_of(repeat, function):
+    """Shortest wall time of 'repeat' calls of function(), in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_assembler(results, sizes, repeat, c_assembler=None):
+    for lines in sizes:
+        source = synthetic_program(lines)
+        results["asm.python.%d_lines_ms" % lines] = best_of(repeat, lambda: assemble(source)) * 1000
+
+        # The IDE path: a warm incremental assembler after a one-line edit
+        blocks = [(0, text) for text in source.split("\n")]
+        assembler = IncrementalAssembler()
+        assembler.update(blocks)
+        middle = len(blocks) // 2
+        edits = iter(range(1, repeat + 1))
+
+        def edit():
+            revision = next(edits)
+            blocks[middle] = (revision, "    addi a0, %d" % (revision % 64))
+            assembler.update(blocks)
+        results["asm.incremental.%d_lines_ms" % lines] = best_of(repeat, edit) * 1000
+
+        if c_assembler:
+            results.update(_bench_c_assembler(c_assembler, source, lines, repeat))
+    if c_assembler:
+        results.update(_bench_c_assembler(c_assembler, synthetic_program(C_ASM_LINES),
+                                          C_ASM_LINES, repeat))
+
+
+def _bench_c_assembler(path, source, lines, repeat):
+    work_dir = tempfile.mkdtemp(prefix="z16bench")
+    try:
+        with open(os.path.join(work_dir, "bench.asm"), "w") as fp:
+            fp.write(source)
+        status = []
+
+        def run():
+            process = subprocess.run([os.path.abspath(path), "bench.asm", "-o", "bench.bin"],
+                                     cwd=work_dir, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL)
+            status.append(process.returncode)
+        elapsed = best_of(repeat, run)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if any(status):
+        # A crash is a result too
+        print("z16asm.c failed on %d lines (exit status %d)" % (lines, status[-1]))
+        return {}
+    return {"asm.c.%d_lines_ms" % lines: elapsed * 1000}
+
+
+def bench_simulator(results, instructions, repeat):
+    for name, source in LOOPS.items():
+        image = assemble(source).image
+        for mode in ("fast", "traced"):
+            simulator = Z16Simulator(write=lambda text: None)
+
+            def run():
+                simulator.load(image)
+                if mode == "fast":
+                    simulator.run(instructions)
+                else:
+                    # Same per-instruction work as the IDE's trace callback
+                    pcs, insts = [], []
+
+                    def trace(pc, inst):
+                        pcs.append(pc)
+                        insts.append(inst)
+                    simulator.run(instructions, trace)
+            seconds = best_of(repeat, run)
+            results["sim.%s.%s_minst_per_s" % (name, mode)] = \
+                simulator.instruction_count / seconds / 1e6
+
+
+def bench_batch(results, instructions, repeat):
+    from z16batch import BatchSimulator
+
+    batch = BatchSimulator(BATCH_LANES)
+    for name, source in LOOPS.items():
+        image = assemble(source).image
+
+        def run():
+            batch.load(image)
+            batch.run(instructions // BATCH_LANES)
+            # The ecall loop's output is not what is measured
+            batch.outputs = [[] for _ in range(BATCH_LANES)]
+        seconds = best_of(repeat, run)
+        results["batch.%s.mlane_inst_per_s" % name] = int(batch.count.sum()) / seconds / 1e6
+
+
+def trace_stream(encoder_class, instructions):
+    """The structured trace of 'instructions' steps of the arithmetic loop"""
+    parts = []
+    encoder = encoder_class(parts.append)
+    simulator = Z16Simulator(write=encoder.output)
+    encoder.load(simulator.load(assemble(LOOPS["arith"]).image))
+    recorder = StepRecorder(simulator, encoder)
+    simulator.run(instructions, recorder.trace)
+    recorder.flush()
+    encoder.final(simulator.stop_reason, simulator.pc, simulator.instruction_count, simulator.regs)
+    return b"".join(parts), simulator.instruction_count + 2
+
+
+def bench_trace(results, instructions, repeat):
+    for name, encoder_class, decoder_class in (("binary", BinaryTraceEncoder, BinaryTraceDecoder),
+                                               ("ndjson", NDJSONTraceEncoder, NDJSONTraceDecoder)):
+        stream, records = trace_stream(encoder_class, instructions)
+
+        def decode():
+            decoder = decoder_class()
+            # Pipe-sized reads, as read_records() does
+            for start in range(0, len(stream), 65536):
+                decoder.feed(stream[start:start + 65536])
+            decoder.close()
+        results["trace.%s_decode_mrec_per_s" % name] = records / best_of(repeat, decode) / 1e6
+
+
+def bench_gui(results, instructions, repeat):
+    # Without a display, render offscreen rather than fail to start
+    if sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or
+                                                 os.environ.get("WAYLAND_DISPLAY")):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+    from GUI2 import Z16IDE, RUN_SLICE
+    from trace_view import TraceChunk
+
+    window = Z16IDE()
+    window.show()
+    app.processEvents()
+    view = window.disassembler_output
+
+    # One chunk per run slice, delivered four slices per poll
+    simulator = Z16Simulator()
+    simulator.load(assemble(LOOPS["arith"]).image)
+    chunks = []
+    while simulator.instruction_count < instructions:
+        chunk = TraceChunk()
+        simulator.run(min(RUN_SLICE, instructions - simulator.instruction_count), chunk.trace)
+        chunks.append(chunk)
+
+    def append():
+        view.clear()
+        for start in range(0, len(chunks), 4):
+            view.append_chunks(chunks[start:start + 4])
+            app.processEvents()
+        view.table_view.viewport().repaint()
+    results["gui.trace_view_append_ms"] = best_of(repeat, append) * 1000
+
+    def apply_filter():
+        view.model.set_filter((0x0000, 0x0010), "add")
+        view.model.set_filter()
+    results["gui.trace_view_filter_ms"] = best_of(repeat, apply_filter) * 1000
+
+    calls = 100
+    results["gui.register_update_us"] = best_of(
+        repeat, lambda: [window.registers.set_registers(simulator.regs, simulator.pc)
+                         for _ in range(calls)]) / calls * 1e6
+
+    editor = window.assembly_input
+    editor.setPlainText(synthetic_program(C_MAX_LINES))
+    editor.verticalScrollBar().setValue(editor.verticalScrollBar().maximum() // 2)
+    app.processEvents()
+    repaints = 20
+    results["gui.line_numbers_repaint_ms"] = best_of(
+        repeat, lambda: [editor.lineNumberArea.repaint() for _ in range(repaints)]) / repaints * 1000
+
+    window.scheduler.cancel()
+    window.close()
+
+
+# -----------------------
+# History
+# -----------------------
+
+def _higher_is_better(metric):
+    return metric.endswith("_per_s")
+
+
+def compare(previous, results):
+    """Lines comparing 'results' with the previous run's results"""
+    lines = []
+    for metric in sorted(results):
+        value = results[metric]
+        line = "%-40s %12.3f" % (metric, value)
+        old = previous.get(metric)
+        if old:
+            change = (value - old) / old
+            worse = -change if _higher_is_better(metric) else change
+            line += "  %+7.1f%%" % (change * 100)
+            if worse > REGRESSION_THRESHOLD:
+                line += "  REGRESSION"
+        lines.append(line)
+    return lines
+
+
+def load_history(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return []
+
+
+def _git_revision():
+    try:
+        process = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                 capture_output=True, text=True)
+    except OSError:
+        return None
+    return process.stdout.strip() if process.returncode == 0 else None
+
+
+def main(argv):
+    usage = ("Usage: %s [--quick] [--no-gui] [--repeat <n>] [--label <name>] "
+             "[--history <file.json>] [--c-assembler <path>]\n" % argv[0])
+    quick = False
+    gui = True
+    repeat = 3
+    label = None
+    history_path = DEFAULT_HISTORY
+    c_assembler = None
+    args = iter(argv[1:])
+    for arg in args:
+        if arg == "--quick":
+            quick = True
+        elif arg == "--no-gui":
+            gui = False
+        elif arg in ("--repeat", "--label", "--history", "--c-assembler"):
+            value = next(args, None)
+            if value is None:
+                sys.stderr.write(usage)
+                return 1
+            if arg == "--repeat":
+                try:
+                    repeat = max(1, int(value))
+                except ValueError:
+                    sys.stderr.write(usage)
+                    return 1
+            elif arg == "--label":
+                label = value
+            elif arg == "--history":
+                history_path = value
+            else:
+                c_assembler = value
+        else:
+            sys.stderr.write(usage)
+            return 1
+
+    instructions = QUICK_SIM_INSTRUCTIONS if quick else SIM_INSTRUCTIONS
+    results = {}
+    bench_assembler(results, QUICK_ASM_SIZES if quick else ASM_SIZES, repeat, c_assembler)
+    bench_simulator(results, instructions, repeat)
+    try:
+        bench_batch(results, instructions * 10, repeat)
+    except ImportError as e:
+        print("Skipping batch benchmarks: %s" % e)
+    bench_trace(results, instructions // 10, repeat)
+    if gui:
+        try:
+            bench_gui(results, instructions // 10, repeat)
+        except ImportError as e:
+            print("Skipping GUI benchmarks: %s" % e)
+
+    history = load_history(history_path)
+    # Quick runs use smaller workloads; only compare like with like
+    previous = next((entry["results"] for entry in reversed(history)
+                     if entry.get("quick") == quick), {})
+    print("\n".join(compare(previous, results)))
+    history.append({
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "label": label,
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "results": results,
+    })
+    with open(history_path, "w") as fp:
+        json.dump(history, fp, indent=1)
+    print("Results appended to %s" % history_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
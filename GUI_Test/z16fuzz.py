@@ -0,0 +1,582 @@
+"""
+Z16 differential fuzzer
+
+Generates programs, runs each on z16sim.c and on the Python engines, and
+reports every program on which they disagree. z16sim.c is the reference;
+the Python engines must match executeInstruction bit for bit, oddities
+included (the U-type immediate is decoded one way by disassemble() and
+another by executeInstruction, for instance, and the text trace shows
+both).
+
+Engines checked against z16sim.c:
+- step:   Z16Simulator one instruction at a time. Both simulators run the
+          same command line with --trace=binary: a step record carries
+          everything an instruction changed (the register written and its
+          value, the memory written), so equal streams mean equal register
+          and memory state after every step. The full 64KB at the end is
+          compared through --save-snapshot, and a --trace=text run checks
+          the disassembly, output and register dump.
+- blocks: Z16Simulator's translated blocks (--fast): output, stop reason,
+          final registers, PC, count and memory.
+- batch:  z16batch's lockstep lanes, one lane per program of a shard: the
+          same final state (needs NumPy).
+
+Programs come from two generators:
+- random:  uniformly random instruction words
+- grammar: well-formed instructions of every format: registers first set
+           to edge values (0, 1, 0x7FFF, 0x8000, 0xFFFF, the end of memory,
+           code and data addresses), then arithmetic, short branches and
+           jumps, loads and stores (into the code too), jr/jalr, lui/auipc
+           with all their bits, and ecalls 1, 5 and 3
+Both add a data block with strings for ecall 5. Each case is built from
+(seed, number) alone, so "--seed 7 case 1234" is all it takes to rebuild
+one.
+
+Cases are split into shards run by a process pool. A failing case is
+minimized: stretches of words are deleted, then single words replaced by
+no-ops, as long as the engine still disagrees. The result is saved as
+tests/fuzz/<engine>-<crc32>.bin, and every run first replays the saved
+cases on all engines.
+
+Usage:
+python z16fuzz.py [-j <jobs>] [--cases <n>] [--seed <n>] [--engines <step,blocks,batch>]
+                  [--max-instructions=N] [--max-output=BYTES] [--no-save] [--replay-only]
+                  <z16sim executable>
+
+The exit status is 1 if any engine disagreed with z16sim.c.
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import z16sim
+from z16sim import MEM_SIZE, Budget, disassemble, parse_budget_option
+from z16snapshot import Snapshot, SnapshotError
+from z16trace import BinaryTraceDecoder, Final, Output, Step, TraceFormatError
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests")
+FUZZ_DIR = os.path.join(TESTS_DIR, "fuzz")
+
+ENGINES = ("step", "blocks", "batch")
+# Budget of every run: long enough for the generated programs, short enough to fuzz fast
+FUZZ_BUDGET = Budget(2000, None, 256)
+# Cases per shard; a batch engine shard runs them as lanes of one BatchSimulator
+SHARD_SIZE = 64
+# Seconds before a z16sim.c run is reported as hung
+C_TIMEOUT = 10
+
+# addi t0, 0: what minimization puts in place of an instruction
+NOP = 0x0001
+
+
+# -----------------------
+# Programs
+# -----------------------
+
+DATA_ADDRESS = 0x0400
+DATA_SIZE = 0x80
+_EDGE_VALUES = (0, 1, 2, 0x7FFF, 0x8000, 0x8001, 0xFFFF, 0xFFFE, MEM_SIZE - 16)
+
+
+def random_program(rng):
+    """Uniformly random words (now and then a zero, which stops the run)"""
+    return [rng.randrange(1, 0x10000) if rng.random() > 0.01 else 0
+            for _ in range(rng.randint(4, 256))]
+
+
+def _r(funct4, rs2, rd, funct3):
+    return (funct4 << 12) | (rs2 << 9) | (rd << 6) | (funct3 << 3)
+
+
+def _i(imm7, rd, funct3):
+    return ((imm7 & 0x7F) << 9) | (rd << 6) | (funct3 << 3) | 0x1
+
+
+def _set_register(rd, value):
+    """Words that set register 'rd' to 'value': li the top 6 bits, then shift in 5 at a time"""
+    return [_i(value >> 10, rd, 0x7),                                  # li
+            _i((1 << 4) | 5, rd, 0x3), _i((value >> 5) & 0x1F, rd, 0x4),  # slli 5, ori
+            _i((1 << 4) | 5, rd, 0x3), _i(value & 0x1F, rd, 0x4)]
+
+
+def _grammar_instruction(rng, pc, length):
+    """One well-formed (or deliberately unused) encoding at word index 'pc' of 'length'"""
+    reg = lambda: rng.randrange(8)
+    kind = rng.choices(("r", "i", "shift", "branch", "store", "load", "jump", "jr", "u",
+                        "ecall", "unused"),
+                       (14, 14, 6, 10, 8, 8, 3, 1, 5, 2, 1))[0]
+    if kind == "r":
+        funct3 = rng.choice((0, 1, 2, 4, 5, 6, 7))
+        return _r(rng.choice((0, 1)) if funct3 == 0 else rng.randrange(16), reg(), reg(), funct3)
+    if kind == "i":
+        imm = rng.choice((0, 1, -1, 63, -64)) if rng.random() < 0.3 else rng.randrange(-64, 64)
+        return _i(imm, reg(), rng.choice((0, 1, 2, 4, 5, 6, 7)))
+    if kind == "shift":
+        if rng.random() < 0.5:
+            return _i((rng.choice((1, 2, 4)) << 4) | rng.randrange(16), reg(), 0x3)
+        return _r(rng.choice((2, 4, 8)), reg(), reg(), 0x3)
+    if kind == "branch":
+        # Mostly forward, so programs run on rather than spin in one loop
+        offset = rng.randrange(1, 8) if rng.random() < 0.75 else rng.randrange(-8, 1)
+        return ((offset & 0xF) << 12) | (reg() << 9) | (reg() << 6) | (rng.randrange(8) << 3) | 0x2
+    if kind == "store":
+        return (rng.randrange(16) << 12) | (reg() << 9) | (reg() << 6) | (rng.choice((0, 1)) << 3) | 0x3
+    if kind == "load":
+        return (rng.randrange(16) << 12) | (reg() << 9) | (reg() << 6) | (rng.choice((0, 1, 4)) << 3) | 0x4
+    if kind == "jump":
+        offset = rng.randrange(1, max(2, min(length - pc, 64)))  # words, forward
+        return ((rng.random() < 0.5) << 15) | (((offset >> 3) & 0x3F) << 9) | (reg() << 6) \
+            | ((offset & 0x7) << 3) | 0x5
+    if kind == "jr":
+        return _r(rng.choice((4, 8)), reg(), reg(), 0x0)
+    if kind == "u":
+        # All of bits 15..3 random: bit 9 only shows in the disassembly
+        return (rng.randrange(0x2000) << 3) | 0x6
+    if kind == "ecall":
+        service = rng.choice((1, 1, 5, 5, 3)) if rng.random() < 0.9 else rng.randrange(0x400)
+        return (service << 6) | (rng.randrange(8) << 3) | 0x7
+    # Encodings no instruction uses: both simulators must ignore them alike
+    return rng.choice((_r(rng.choice((2, 3, 5, 6, 7, 9)), reg(), reg(), 0x0),
+                       _r(rng.choice((0, 1, 3, 5)), reg(), reg(), 0x3),
+                       _i((rng.choice((0, 3, 5, 6, 7)) << 4) | rng.randrange(16), reg(), 0x3),
+                       (reg() << 6) | (rng.randrange(2, 8) << 3) | 0x3,
+                       (reg() << 6) | (rng.choice((2, 3, 5, 6, 7)) << 3) | 0x4))
+
+
+def grammar_program(rng):
+    """Registers set to edge values, then well-formed instructions"""
+    words = []
+    for rd in range(8):
+        choice = rng.random()
+        if choice < 0.4:
+            value = rng.choice(_EDGE_VALUES)
+        elif choice < 0.6:
+            value = DATA_ADDRESS + rng.randrange(DATA_SIZE)
+        elif choice < 0.7:
+            value = rng.randrange(0, 0x200, 2)  # into the code
+        else:
+            value = rng.randrange(0x10000)
+        words += _set_register(rd, value)
+    length = rng.randint(8, 200)
+    start = len(words)
+    words += [_grammar_instruction(rng, start + i, start + length) for i in range(length)]
+    if rng.random() < 0.5:
+        words.append((3 << 6) | 0x7)  # ecall 3
+    return words
+
+
+def _data_block(rng):
+    """Data for loads and ecall 5: random bytes and NUL-terminated strings"""
+    data = bytearray(rng.randrange(256) for _ in range(DATA_SIZE))
+    for _ in range(4):
+        at = rng.randrange(DATA_SIZE)
+        data[at] = 0
+    return bytes(data)
+
+
+def build_case(seed, number):
+    """Binary image of case 'number' of 'seed'"""
+    rng = random.Random("%d:%d" % (seed, number))
+    words = (random_program if rng.random() < 0.3 else grammar_program)(rng)
+    return _image(words[:DATA_ADDRESS // 2]) + _data_block(rng)
+
+
+def _image(words):
+    code = b"".join(word.to_bytes(2, "little") for word in words)
+    return code + bytes(DATA_ADDRESS - len(code))
+
+
+# -----------------------
+# Running the engines
+# -----------------------
+
+def _budget_options(budget):
+    return ["--max-instructions=%d" % (budget.instructions or 0),
+            "--max-output=%d" % (budget.output or 0)]
+
+
+def _run_c(simulator, args):
+    """(exit status, stdout, stderr) of z16sim.c; a hang or crash becomes a message in stderr"""
+    try:
+        process = subprocess.run([simulator] + args, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, timeout=C_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return None, b"", b"z16sim.c did not finish within %d s" % C_TIMEOUT
+    return process.returncode, process.stdout, process.stderr
+
+
+def _run_python(args):
+    """(exit status, stdout, stderr) of z16sim.main with the same arguments, in this process"""
+    # latin-1 writes ecall 5 bytes unchanged, as z16sim.c does
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding="latin-1", newline="\n")
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        status = z16sim.main(["z16sim.py"] + args)
+        stdout.flush()
+    return status, stdout.buffer.getvalue(), stderr.getvalue().encode("latin-1")
+
+
+def _read_file(path):
+    try:
+        with open(path, "rb") as fp:
+            return fp.read()
+    except OSError:
+        return None
+
+
+def _decode_trace(data):
+    decoder = BinaryTraceDecoder()
+    records = decoder.feed(data)
+    decoder.close()
+    return records
+
+
+def _describe_record(record):
+    if isinstance(record, Step):
+        changes = []
+        if record.rd >= 0:
+            changes.append("x%d=0x%04X" % (record.rd, record.value))
+        if record.mem_size:
+            changes.append("[0x%04X]=0x%0*X" % (record.mem_addr, 2 * record.mem_size,
+                                                 record.mem_value))
+        return "0x%04X %s" % (record.pc, ", ".join(changes) or "no change")
+    if isinstance(record, Output):
+        return "output %r" % record.text
+    if isinstance(record, Final):
+        return "stop (%s) at 0x%04X after %d, regs %s" % (
+            record.reason or "instruction limit", record.pc, record.count,
+            " ".join("%04X" % value for value in record.regs))
+    return repr(record)
+
+
+def _trace_difference(c_trace, py_trace):
+    """Where two --trace=binary streams first differ"""
+    try:
+        c_records, py_records = _decode_trace(c_trace), _decode_trace(py_trace)
+    except TraceFormatError as e:
+        return "unreadable trace: %s" % e
+    steps = 0
+    for c_record, py_record in zip(c_records, py_records):
+        if c_record != py_record:
+            where = "record %d" % steps
+            if isinstance(c_record, Step):
+                where = "step %d, 0x%04X %s" % (steps, c_record.pc,
+                                                 disassemble(c_record.inst, c_record.pc))
+            return "%s: z16sim.c %s, Python %s" % (where, _describe_record(c_record),
+                                                   _describe_record(py_record))
+        steps += isinstance(c_record, Step)
+    return "z16sim.c wrote %d records, Python %d" % (len(c_records), len(py_records))
+
+
+def _state_difference(c_snapshot, regs, pc, count, memory):
+    """How a final state differs from a z16sim.c snapshot (None if it does not)"""
+    try:
+        c = Snapshot.from_bytes(c_snapshot)
+    except SnapshotError as e:
+        return "z16sim.c snapshot: %s" % e
+    if tuple(c.regs) != tuple(regs):
+        return "registers: z16sim.c %s, Python %s" % (
+            " ".join("%04X" % v for v in c.regs), " ".join("%04X" % v for v in regs))
+    if (c.pc, c.count) != (pc, count):
+        return "stopped at 0x%04X after %d in z16sim.c, 0x%04X after %d in Python" % (
+            c.pc, c.count, pc, count)
+    c_memory = c.memory()
+    if c_memory != memory:
+        addr = next(i for i in range(MEM_SIZE) if c_memory[i] != memory[i])
+        return "memory at 0x%04X: z16sim.c 0x%02X, Python 0x%02X" % (addr, c_memory[addr],
+                                                                     memory[addr])
+    return None
+
+
+def _compare_runs(simulator, args, work_dir, snapshots=True):
+    """Run one command line on both simulators; returns where they differ, or None"""
+    c_snapshot = os.path.join(work_dir, "c.z16s")
+    py_snapshot = os.path.join(work_dir, "py.z16s")
+    for path in (c_snapshot, py_snapshot):
+        if os.path.exists(path):
+            os.remove(path)
+    c = _run_c(simulator, args + (["--save-snapshot=" + c_snapshot] if snapshots else []))
+    py = _run_python(args + (["--save-snapshot=" + py_snapshot] if snapshots else []))
+    if c[2] != py[2]:
+        return "stderr: z16sim.c %r, Python %r" % (c[2][-200:], py[2][-200:])
+    if c[0] != py[0]:
+        return "exit status: z16sim.c %s, Python %s" % (c[0], py[0])
+    if "--trace=binary" in args:
+        if c[1] != py[1]:
+            return _trace_difference(c[1], py[1])
+    elif c[1] != py[1]:
+        c_lines, py_lines = c[1].split(b"\n"), py[1].split(b"\n")
+        line = next((i for i, (a, b) in enumerate(zip(c_lines, py_lines)) if a != b),
+                    min(len(c_lines), len(py_lines)))
+        return "text output line %d: z16sim.c %r, Python %r" % (
+            line + 1, b"\n".join(c_lines[line:line + 1]), b"\n".join(py_lines[line:line + 1]))
+    if snapshots:
+        c_state, py_state = _read_file(c_snapshot), _read_file(py_snapshot)
+        if c_state != py_state:
+            if c_state is None or py_state is None:
+                return "snapshot written only by %s" % ("Python" if c_state is None else "z16sim.c")
+            py = Snapshot.from_bytes(py_state)
+            return _state_difference(c_state, py.regs, py.pc, py.count, py.memory())
+    return None
+
+
+def check_step(simulator, path, budget, work_dir):
+    options = _budget_options(budget)
+    return (_compare_runs(simulator, ["--trace=binary"] + options + [path], work_dir)
+            or _compare_runs(simulator, options + [path], work_dir, snapshots=False))
+
+
+def check_blocks(simulator, path, budget, work_dir):
+    return _compare_runs(simulator, ["--trace=binary", "--fast"] + _budget_options(budget) + [path],
+                         work_dir)
+
+
+def check_batch(simulator, paths, budget, work_dir):
+    """Run 'paths' as the lanes of one BatchSimulator; returns a difference (or None) per path"""
+    from z16batch import BatchSimulator
+
+    batch = BatchSimulator(len(paths), max_output=budget.output)
+    for lane, path in enumerate(paths):
+        image = _read_file(path)
+        batch.memory[lane, :len(image)] = bytearray(image)
+    batch.run(budget.instructions)
+
+    differences = []
+    snapshot = os.path.join(work_dir, "c.z16s")
+    for lane, path in enumerate(paths):
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+        status, stdout, stderr = _run_c(simulator, ["--trace=binary", "--fast", "--save-snapshot="
+                                                    + snapshot] + _budget_options(budget) + [path])
+        state = _read_file(snapshot)
+        if status != 0 or state is None:
+            differences.append("z16sim.c failed: %r" % stderr[-200:])
+            continue
+        try:
+            records = _decode_trace(stdout)
+        except TraceFormatError as e:
+            differences.append("unreadable trace: %s" % e)
+            continue
+        output = "".join(record.text for record in records if isinstance(record, Output))
+        final = records[-1]
+        if output != batch.output(lane):
+            differences.append("output: z16sim.c %r, batch %r" % (output[-200:],
+                                                                  batch.output(lane)[-200:]))
+        elif final.reason != batch.stop_reason(lane):
+            differences.append("stop reason: z16sim.c %s, batch %s" % (final.reason,
+                                                                       batch.stop_reason(lane)))
+        else:
+            differences.append(_state_difference(
+                state, [int(value) for value in batch.regs[lane]], int(batch.pc[lane]),
+                int(batch.count[lane]), bytearray(batch.memory[lane].tobytes())))
+    return differences
+
+
+def _check(simulator, engine, path, budget, work_dir):
+    if engine == "step":
+        return check_step(simulator, path, budget, work_dir)
+    if engine == "blocks":
+        return check_blocks(simulator, path, budget, work_dir)
+    return check_batch(simulator, [path], budget, work_dir)[0]
+
+
+# -----------------------
+# Minimizing
+# -----------------------
+
+def minimize(image, still_fails):
+    """
+    Shrink a failing image while 'still_fails(image)' holds: delete
+    stretches of words (halving their length down to one word), then
+    replace single words by NOP, then drop trailing zero words
+    """
+    words = [int.from_bytes(image[i:i + 2], "little") for i in range(0, len(image) - 1, 2)]
+    build = lambda words: b"".join(word.to_bytes(2, "little") for word in words)
+
+    chunk = len(words) // 2
+    while chunk >= 1:
+        i = 0
+        while i < len(words):
+            trial = words[:i] + words[i + chunk:]
+            if trial and still_fails(build(trial)):
+                words = trial
+            else:
+                i += chunk
+        chunk //= 2
+    for i, word in enumerate(words):
+        if word not in (NOP, 0) and still_fails(build(words[:i] + [NOP] + words[i + 1:])):
+            words[i] = NOP
+    while len(words) > 1 and words[-1] == 0 and still_fails(build(words[:-1])):
+        words.pop()
+    return build(words)
+
+
+def _minimize_case(simulator, engine, image, budget, work_dir):
+    path = os.path.join(work_dir, "minimize.bin")
+
+    def still_fails(trial):
+        with open(path, "wb") as fp:
+            fp.write(trial)
+        return _check(simulator, engine, path, budget, work_dir) is not None
+
+    return minimize(image, still_fails)
+
+
+# -----------------------
+# Shards
+# -----------------------
+
+def run_shard(simulator, seed, numbers, engines, budget, minimize_failures=True):
+    """
+    Check cases 'numbers' of 'seed' (or, for a list of file paths, those
+    files) on 'engines'. Returns [(case, engine, message, minimized image)]
+    """
+    work_dir = tempfile.mkdtemp(prefix="z16fuzz")
+    try:
+        paths, images = [], []
+        for i, number in enumerate(numbers):
+            if isinstance(number, str):
+                image = _read_file(number)
+            else:
+                image = build_case(seed, number)
+            path = os.path.join(work_dir, "case%d.bin" % i)
+            with open(path, "wb") as fp:
+                fp.write(image)
+            paths.append(path)
+            images.append(image)
+
+        failures = []
+        for engine in engines:
+            if engine == "batch":
+                differences = check_batch(simulator, paths, budget, work_dir)
+            else:
+                check = check_step if engine == "step" else check_blocks
+                differences = [check(simulator, path, budget, work_dir) for path in paths]
+            for number, image, message in zip(numbers, images, differences):
+                if message is None:
+                    continue
+                minimized = image
+                if minimize_failures:
+                    minimized = _minimize_case(simulator, engine, image, budget, work_dir)
+                failures.append((number, engine, message, minimized))
+        return failures
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def save_failure(engine, image):
+    """
+    Save a minimized failing case under tests/fuzz; returns its path, or
+    None if it is saved already (found by another engine, say)
+    """
+    name = "-%08x.bin" % zlib.crc32(image)
+    if any(path.endswith(name) for path in saved_cases()):
+        return None
+    os.makedirs(FUZZ_DIR, exist_ok=True)
+    path = os.path.join(FUZZ_DIR, engine + name)
+    with open(path, "wb") as fp:
+        fp.write(image)
+    return path
+
+
+def saved_cases():
+    if not os.path.isdir(FUZZ_DIR):
+        return []
+    return [os.path.join(FUZZ_DIR, name) for name in sorted(os.listdir(FUZZ_DIR))
+            if name.endswith(".bin")]
+
+
+def main(argv):
+    usage = ("Usage: %s [-j <jobs>] [--cases <n>] [--seed <n>] [--engines <step,blocks,batch>] "
+             "[--max-instructions=N] [--max-output=BYTES] [--no-save] [--replay-only] "
+             "<z16sim executable>\n" % argv[0])
+    jobs = None
+    cases = 1000
+    seed = int(time.time())
+    engines = list(ENGINES)
+    budget = FUZZ_BUDGET
+    save = True
+    replay_only = False
+    simulator = None
+    args = iter(argv[1:])
+    for arg in args:
+        try:
+            new_budget = parse_budget_option(arg, budget)
+            if new_budget is not None:
+                if new_budget.seconds:
+                    raise ValueError("timeouts make runs depend on the machine")
+                budget = new_budget
+            elif arg in ("-j", "--cases", "--seed"):
+                value = int(next(args, ""))
+                if arg == "-j":
+                    if value < 1:
+                        raise ValueError("jobs")
+                    jobs = value
+                elif arg == "--cases":
+                    cases = value
+                else:
+                    seed = value
+            elif arg == "--engines":
+                engines = next(args, "").split(",")
+                if not engines or any(engine not in ENGINES for engine in engines):
+                    raise ValueError("engines")
+            elif arg == "--no-save":
+                save = False
+            elif arg == "--replay-only":
+                replay_only = True
+            elif arg.startswith("-") or simulator is not None:
+                raise ValueError(arg)
+            else:
+                simulator = os.path.abspath(arg)
+        except ValueError:
+            sys.stderr.write(usage)
+            return 1
+    if simulator is None:
+        sys.stderr.write(usage)
+        return 1
+    if "batch" in engines:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            print("Skipping the batch engine: NumPy is not installed")
+            engines.remove("batch")
+
+    start = time.perf_counter()
+    failed = 0
+    saved = saved_cases()
+    if saved:
+        for path, engine, message, _ in run_shard(simulator, seed, saved, engines, budget,
+                                                  minimize_failures=False):
+            print("FAILED  %s on %s: %s" % (os.path.relpath(path), engine, message))
+            failed += 1
+        print("Replayed %d saved cases" % len(saved))
+    if replay_only:
+        return 1 if failed else 0
+
+    print("Fuzzing %d cases with seed %d on %s" % (cases, seed, ", ".join(engines)))
+    shards = [range(first, min(first + SHARD_SIZE, cases)) for first in range(0, cases, SHARD_SIZE)]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_shard, simulator, seed, shard, engines, budget)
+                   for shard in shards]
+        for future in futures:
+            for number, engine, message, image in future.result():
+                failed += 1
+                print("FAILED  case %d on %s: %s" % (number, engine, message))
+                path = save_failure(engine, image) if save else None
+                if path is not None:
+                    print("        minimized to %d bytes: %s" % (len(image), os.path.relpath(path)))
+    print("\n%d cases, %d failures in %.1f s" % (cases, failed, time.perf_counter() - start))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
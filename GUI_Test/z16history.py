@@ -0,0 +1,268 @@
+"""
+Reverse execution for the Z16 simulator
+
+History records a simulator's run as checkpoints: every 'interval'
+instructions it saves the registers, the PC and the 256-byte memory pages
+written since the previous checkpoint. Execution is deterministic, so any
+earlier point of the run can be rebuilt by restoring the nearest
+checkpoint at or before it and replaying forward:
+
+    history = History(sim)
+    history.run(1000000)
+    history.step_back()          # restore + replay at most 'interval' instructions
+    history.reverse_continue()   # back to the last breakpoint hit before here
+
+Memory stays bounded: beyond 'max_checkpoints' checkpoints (or 'max_bytes'
+of saved pages) the checkpoint whose neighbours are closest together is
+merged into the next one, so older parts of a long run keep fewer, wider
+spaced checkpoints and the whole run stays reachable.
+
+Replays run with ecall output muted and outside the profile counters.
+Going back drops the checkpoints after the new position; running forward
+again records them anew. Changing registers or memory by hand (edited())
+saves a checkpoint that is never merged away, so replays include the
+change.
+"""
+
+from bisect import bisect_right
+
+from z16sim import MEM_SIZE, STOP_BREAKPOINT
+
+PAGE_SIZE = 256
+PAGES = MEM_SIZE // PAGE_SIZE
+SPAN_SIZE = 16 * PAGE_SIZE
+
+# Instructions between checkpoints; the most a step back replays
+CHECKPOINT_INTERVAL = 10000
+# Bounds of the checkpoints kept: their number and their saved page bytes
+MAX_CHECKPOINTS = 256
+HISTORY_BYTES = 4 << 20
+
+
+class Checkpoint:
+    """Machine state after 'count' instructions; 'pages' holds the pages changed since the previous checkpoint"""
+
+    __slots__ = ("count", "regs", "pc", "output_bytes", "output_exceeded", "pages", "pinned")
+
+    def __init__(self, sim, pages, pinned=False):
+        self.count = sim.instruction_count
+        self.regs = tuple(sim.regs)
+        self.pc = sim.pc
+        self.output_bytes = sim.output_bytes
+        self.output_exceeded = sim.output_exceeded
+        self.pages = pages  # page address -> bytes
+        self.pinned = pinned
+
+
+class History:
+    """Checkpointed forward execution of 'sim', and stepping back through it"""
+
+    def __init__(self, sim, interval=CHECKPOINT_INTERVAL, max_checkpoints=MAX_CHECKPOINTS,
+                 max_bytes=HISTORY_BYTES):
+        if interval < 1 or max_checkpoints < 2:
+            raise ValueError("history needs an interval of at least 1 and at least 2 checkpoints")
+        self.sim = sim
+        self.interval = interval
+        self.max_checkpoints = max_checkpoints
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        """Forget the run so far; the current state becomes the first checkpoint"""
+        memory = self.sim.memory
+        self.shadow = bytearray(memory)  # memory as of the last checkpoint
+        pages = {page: bytes(memory[page:page + PAGE_SIZE]) for page in range(0, MEM_SIZE, PAGE_SIZE)}
+        self.checkpoints = [Checkpoint(self.sim, pages, pinned=True)]
+        self.counts = [self.sim.instruction_count]
+        self.bytes = MEM_SIZE
+        self._next = self.counts[-1] + self.interval
+
+    # --- Recording ---
+
+    def run(self, max_instructions=None, trace=None, deadline=None):
+        """Like Z16Simulator.run, taking checkpoints on the way"""
+        sim = self.sim
+        remaining = max_instructions
+        while True:
+            chunk = self._next - sim.instruction_count
+            if remaining is not None:
+                chunk = min(chunk, remaining)
+            start = sim.instruction_count
+            reason = sim.run(chunk, trace, deadline)
+            if sim.instruction_count >= self._next:
+                self.capture()
+            if remaining is not None:
+                remaining -= sim.instruction_count - start
+                if remaining <= 0:
+                    return reason
+            if reason is not None:
+                return reason
+
+    def step(self):
+        """Like Z16Simulator.step, taking a checkpoint when one is due"""
+        executed = self.sim.step()
+        if self.sim.instruction_count >= self._next:
+            self.capture()
+        return executed
+
+    def capture(self, pinned=False):
+        """Save a checkpoint of the current state (merged into the last one if at the same count)"""
+        sim = self.sim
+        memory, shadow = sim.memory, self.shadow
+        pages = {}
+        if memory != shadow:
+            # Pages are only compared inside the 4KB spans that changed
+            for span in range(0, MEM_SIZE, SPAN_SIZE):
+                if memory[span:span + SPAN_SIZE] == shadow[span:span + SPAN_SIZE]:
+                    continue
+                for page in range(span, span + SPAN_SIZE, PAGE_SIZE):
+                    end = page + PAGE_SIZE
+                    if memory[page:end] != shadow[page:end]:
+                        pages[page] = data = bytes(memory[page:end])
+                        shadow[page:end] = data
+        last = self.checkpoints[-1]
+        checkpoint = Checkpoint(sim, pages, pinned)
+        if last.count == checkpoint.count:
+            # Same point of the run, e.g. a second edit: fold into it
+            pages = {**last.pages, **pages}
+            checkpoint.pages = pages
+            checkpoint.pinned = pinned or last.pinned
+            self.bytes += PAGE_SIZE * (len(pages) - len(last.pages))
+            self.checkpoints[-1] = checkpoint
+        else:
+            self.bytes += PAGE_SIZE * len(pages)
+            self.checkpoints.append(checkpoint)
+            self.counts.append(checkpoint.count)
+            self._evict()
+        self._next = checkpoint.count + self.interval
+
+    def edited(self):
+        """Registers or memory were changed by hand: record the change so replays include it"""
+        self.capture(pinned=True)
+
+    def _evict(self):
+        """Merge checkpoints away until both bounds hold (the first, the last and pinned ones stay)"""
+        checkpoints = self.checkpoints
+        while len(checkpoints) > self.max_checkpoints or self.bytes > self.max_bytes:
+            best, best_gap = None, None
+            for i in range(1, len(checkpoints) - 1):
+                if checkpoints[i].pinned:
+                    continue
+                gap = checkpoints[i + 1].count - checkpoints[i - 1].count
+                if best is None or gap < best_gap:
+                    best, best_gap = i, gap
+            if best is None:
+                return
+            evicted, following = checkpoints[best], checkpoints[best + 1]
+            merged = {**evicted.pages, **following.pages}
+            self.bytes -= PAGE_SIZE * (len(evicted.pages) + len(following.pages) - len(merged))
+            following.pages = merged
+            del checkpoints[best]
+            del self.counts[best]
+
+    # --- Going back ---
+
+    @property
+    def start(self):
+        """Instruction count of the earliest reachable point"""
+        return self.counts[0]
+
+    def seek(self, count):
+        """
+        Put the machine in its state after 'count' instructions (at most the
+        current count, at least 'start'); returns the count reached
+        """
+        sim = self.sim
+        count = max(self.start, min(count, sim.instruction_count))
+        if count == sim.instruction_count:
+            return count
+        saved = self._mute()
+        try:
+            self._restore(bisect_right(self.counts, count) - 1)
+            self._replay(count)
+        finally:
+            self._unmute(saved)
+        return count
+
+    def step_back(self, count=1):
+        """Undo the last 'count' instructions; returns the number undone"""
+        before = self.sim.instruction_count
+        return before - self.seek(before - count)
+
+    def reverse_continue(self):
+        """
+        Go back to the latest breakpoint hit before the current point and
+        return STOP_BREAKPOINT, or to 'start' and return None if there is none
+        """
+        end = self.sim.instruction_count
+        hits = []
+        saved = self._mute()
+        try:
+            # Scan back one checkpoint interval at a time
+            while end > self.start and not hits:
+                self._restore(bisect_right(self.counts, end - 1) - 1)
+                start = self.sim.instruction_count
+                self._replay(end, hits)
+                end = start
+        finally:
+            self._unmute(saved)
+        self.seek(hits[-1] if hits else self.start)
+        return STOP_BREAKPOINT if hits else None
+
+    def _replay(self, count, hits=None):
+        """Run forward to 'count' instructions, passing breakpoints and noting where they hit"""
+        sim = self.sim
+        while sim.instruction_count < count:
+            reason = self.run(count - sim.instruction_count)
+            # A run that used up its budget still reports a breakpoint at the PC it ends on
+            if reason != STOP_BREAKPOINT or sim.instruction_count >= count:
+                if reason is not None and reason != STOP_BREAKPOINT:
+                    return  # the run went this far before; only a changed machine can stop
+                continue
+            if hits is not None:
+                hits.append(sim.instruction_count)
+            self.step()
+
+    def _restore(self, index):
+        """Load checkpoint 'index' into the machine and drop the ones after it"""
+        sim = self.sim
+        checkpoints = self.checkpoints
+        # The latest copy of each page at or before the checkpoint; the first has them all
+        image = {}
+        for checkpoint in reversed(checkpoints[:index + 1]):
+            for page, data in checkpoint.pages.items():
+                image.setdefault(page, data)
+            if len(image) == PAGES:
+                break
+        memory = sim.memory
+        for page, data in image.items():
+            end = page + PAGE_SIZE
+            if memory[page:end] != data:
+                memory[page:end] = data
+                sim.invalidate(page, end)  # code may have changed
+        self.shadow[:] = memory
+
+        checkpoint = checkpoints[index]
+        sim.regs[:] = checkpoint.regs
+        sim.pc = checkpoint.pc
+        sim.instruction_count = checkpoint.count
+        sim.output_bytes = checkpoint.output_bytes
+        sim.output_exceeded = checkpoint.output_exceeded
+        sim.stop_reason = None
+
+        for dropped in checkpoints[index + 1:]:
+            self.bytes -= PAGE_SIZE * len(dropped.pages)
+        del checkpoints[index + 1:]
+        del self.counts[index + 1:]
+        self._next = checkpoint.count + self.interval
+
+    def _mute(self):
+        # Replayed instructions neither print nor count in the profile
+        sim = self.sim
+        saved = sim.write, sim.swap_counters()
+        sim.write = lambda text: None
+        return saved
+
+    def _unmute(self, saved):
+        self.sim.write, counters = saved
+        self.sim.swap_counters(counters)
@@ -0,0 +1,367 @@
+"""
+Z16 live diagnostics
+
+Checks assembly source as it is typed: unknown mnemonics and directives,
+operand counts, register names, immediate ranges, undefined labels and
+branch/jump reach. Errors are what z16asm would reject; warnings are
+accepted by the assembler but almost certainly not what was meant (an
+immediate that is silently truncated, an operand that is ignored, a
+register name used where a number belongs).
+
+Results are cached in two layers so re-linting after an edit costs little
+more than a walk over the lines:
+- the checks that depend only on a line's text are cached by that text,
+  so only edited lines are parsed and checked again;
+- the checks that depend on labels (existence, value range, branch reach)
+  are cached by the line's text and what its labels resolved to (for
+  branches and jumps, the distance to the target), so they are redone only
+  for lines referencing a label that was added, removed or moved.
+
+Usage:
+python z16lint.py <sourcefile>
+"""
+
+import re
+import sys
+import threading
+from collections import namedtuple
+
+from z16asm import (AssemblerError, Z16Assembler, SourceLine, INSTRUCTION_SET, DIRECTIVES,
+                    SECTION_NONE, SECTION_TEXT, SECTION_DATA, INST_R, INST_I, INST_B, INST_L,
+                    INST_J, INST_U, INST_S, REGISTERS, WHITESPACE, parse_fields, split_operands,
+                    split_values, strtol)
+
+ERROR, WARNING = "error", "warning"
+
+Diagnostic = namedtuple("Diagnostic", "line severity message")
+
+# Operand kinds of each instruction, in source order
+_TYPE_OPERANDS = {
+    INST_R: ("rd", "rs"),
+    INST_I: ("rd", "imm"),
+    INST_B: ("rs1", "rs2", "label"),
+    INST_L: ("reg", "offset(base)"),
+    INST_J: ("label",),
+    INST_U: ("rd", "imm"),
+    INST_S: ("service",),
+}
+_SPECIAL_OPERANDS = {
+    "jr": ("rs",),
+    "slli": ("rd", "shamt"), "srli": ("rd", "shamt"), "srai": ("rd", "shamt"),
+    "bz": ("rs", "label"), "bnz": ("rs", "label"),
+    "lb": ("rd", "offset(base)"), "lw": ("rd", "offset(base)"), "lbu": ("rd", "offset(base)"),
+    "sb": ("rs", "offset(base)"), "sw": ("rs", "offset(base)"),
+    "jal": ("rd", "label"),
+}
+SIGNATURES = {m: _SPECIAL_OPERANDS.get(m, _TYPE_OPERANDS[d.type]) for m, d in INSTRUCTION_SET.items()}
+
+# Values each field can hold without being truncated, as (low, high)
+IMMEDIATE_RANGE = (-64, 63)   # I-type imm7 (sign-extended by the simulator)
+SHIFT_RANGE = (0, 15)
+OFFSET_RANGE = (0, 15)        # load/store imm4 (zero-extended)
+UPPER_RANGE = (0, 511)        # lui/auipc imm9, shifted left by 7
+SERVICE_RANGE = (0, 1023)
+BYTE_RANGE = (-128, 255)
+WORD_RANGE = (-32768, 65535)
+ORG_RANGE = (0, 0xFFFF)
+BRANCH_RANGE = (-8, 7)        # in instructions
+JUMP_RANGE = (-128, 127)      # in bytes
+ECALL_SERVICES = (1, 3, 5)
+
+_FIELD_RANGES = {"imm": IMMEDIATE_RANGE, "shamt": SHIFT_RANGE, "offset": OFFSET_RANGE,
+                 "upper": UPPER_RANGE, "byte": BYTE_RANGE, "word": WORD_RANGE}
+
+_REGISTER_NAMES = frozenset(REGISTERS) | {"x%d" % i for i in range(8)}
+# Register parsing only, so its error messages match the assembler's
+_PARSER = Z16Assembler()
+
+_NUMBER = re.compile(r"[-+]?(?:0[xX][0-9A-Fa-f]+|0[bB][01]+|\d+)$")
+_IDENTIFIER = re.compile(r"[A-Za-z_.][\w.]*$")
+_RELOCATION = re.compile(r"%(hi|lo)\((.*)\)$")
+
+
+def _number(token):
+    """Value of a numeric token the way parse_immediate() reads it"""
+    if token[:2] in ("0b", "0B"):
+        return strtol(token[2:], 2)
+    return strtol(token)
+
+
+class _LintLine:
+    """Everything about one line of text that does not depend on the rest of the buffer"""
+
+    __slots__ = ("line", "problems", "symbolic", "references", "pc_relative", "kind")
+
+    def __init__(self, text):
+        self.line = SourceLine(0, text, SECTION_NONE)
+        line = self.line
+        line.label, line.mnemonic, line.operands = parse_fields(text)
+        self.problems = []     # (severity, message) found from the text alone
+        self.symbolic = []     # (name, field) label operands, checked against the symbol table
+        self.pc_relative = False
+        self.kind = None       # "instruction", "data" or None
+        mnemonic = line.mnemonic
+        if mnemonic is None:
+            pass
+        elif mnemonic[0] == ".":
+            self._check_directive(mnemonic, line.operands)
+        else:
+            self._check_instruction(mnemonic, line.operands)
+        self.references = tuple(sorted({name for name, _ in self.symbolic}))
+
+    def _problem(self, severity, message):
+        self.problems.append((severity, message))
+
+    # --- Operand fields ---
+
+    def _register(self, token):
+        try:
+            _PARSER.parse_register(token, 0)
+        except AssemblerError as e:
+            self._problem(ERROR, e.message)
+
+    def _value(self, token, field, mnemonic):
+        """Check an immediate operand: a number in range, a label or %hi/%lo of one"""
+        if _NUMBER.match(token):
+            low, high = _FIELD_RANGES[field]
+            value = _number(token)
+            if not low <= value <= high:
+                self._problem(WARNING, f"Immediate {token} is out of range for '{mnemonic}' "
+                                       f"({low}..{high}) and will be truncated")
+            return
+        relocation = _RELOCATION.match(token)
+        if relocation:
+            inner = relocation.group(2).strip(WHITESPACE)
+            if _IDENTIFIER.match(inner):
+                self.symbolic.append((inner.lower(), None))
+            elif not _NUMBER.match(inner):
+                self._problem(WARNING, f"Malformed operand '{token}'")
+        elif token.lower() in _REGISTER_NAMES:
+            self._problem(WARNING, f"Register '{token}' used as an immediate; it assembles as 0")
+        elif _IDENTIFIER.match(token):
+            self.symbolic.append((token.lower(), field))
+        else:
+            self._problem(WARNING, f"Malformed immediate '{token}' assembles as {_number(token)}")
+
+    def _label(self, token):
+        if token.lower() in _REGISTER_NAMES:
+            self._problem(ERROR, f"Expected a label, got register '{token}'")
+        else:
+            self.symbolic.append((token.lower(), "target"))
+
+    # --- Lines ---
+
+    def _check_instruction(self, mnemonic, operands):
+        inst = INSTRUCTION_SET.get(mnemonic)
+        if inst is None:
+            self._problem(ERROR, f"Unknown mnemonic '{mnemonic}'")
+            return
+        self.kind = "instruction"
+        self.pc_relative = inst.type in (INST_B, INST_J)
+        signature = SIGNATURES[mnemonic]
+        if inst.type == INST_S:
+            # ecall takes its whole operand string as the service number
+            tokens = [operands.strip(WHITESPACE)] if operands and operands.strip(WHITESPACE) else []
+        else:
+            tokens = [t for t in split_operands(operands) if t]
+        if len(tokens) < len(signature):
+            self._problem(ERROR, f"'{mnemonic}' expects {len(signature)} operand"
+                                 f"{'s' if len(signature) > 1 else ''} ({', '.join(signature)}), "
+                                 f"got {len(tokens)}")
+        elif mnemonic == "jr" and len(tokens) > 1:
+            # jr is the only instruction the assembler refuses extra operands for
+            self._problem(ERROR, "Unexpected second operand for 'jr'")
+        elif len(tokens) > len(signature):
+            extra = " ".join(tokens[len(signature):])
+            self._problem(WARNING, f"'{mnemonic}' takes {len(signature)} operand"
+                          f"{'s' if len(signature) > 1 else ''} ({', '.join(signature)}); "
+                          f"'{extra}' is ignored")
+
+        for token, kind in zip(tokens, signature):
+            if kind in ("rd", "rs", "rs1", "rs2", "reg"):
+                self._register(token)
+            elif kind == "label":
+                self._label(token)
+            elif kind == "imm":
+                self._value(token, "upper" if inst.type == INST_U else "imm", mnemonic)
+            elif kind == "shamt":
+                self._value(token, "shamt", mnemonic)
+            elif kind == "offset(base)":
+                open_paren, close_paren = token.find("("), token.find(")")
+                if open_paren < 0 or close_paren < 0:
+                    self._problem(ERROR, "Memory operand format error, expected offset(register)")
+                    continue
+                self._value(token[:open_paren] or "0", "offset", mnemonic)
+                self._register(token[open_paren + 1:close_paren])
+            elif kind == "service":
+                if not _NUMBER.match(token):
+                    self._problem(WARNING, f"ecall service '{token}' is not a number")
+                    continue
+                value = _number(token)
+                if not SERVICE_RANGE[0] <= value <= SERVICE_RANGE[1]:
+                    self._problem(WARNING, f"ecall service {token} is out of range and will be truncated")
+                elif value not in ECALL_SERVICES:
+                    self._problem(WARNING, f"ecall {value} is not a simulator service "
+                                           f"({', '.join(map(str, ECALL_SERVICES))})")
+
+    def _check_directive(self, mnemonic, operands):
+        if mnemonic not in DIRECTIVES:
+            self._problem(WARNING, f"Unknown directive '{mnemonic}' is ignored")
+            return
+        if mnemonic in (".text", ".data"):
+            return
+        self.kind = None if mnemonic == ".org" else "data"
+        if operands is None:
+            missing = "string operand" if mnemonic == ".asciiz" else "operand"
+            self._problem(ERROR, f"{mnemonic} missing {missing}")
+        elif mnemonic == ".org":
+            value = strtol(operands)
+            if not ORG_RANGE[0] <= value <= ORG_RANGE[1]:
+                self._problem(WARNING, f".org address {operands.strip(WHITESPACE)} is outside memory")
+        elif mnemonic in (".byte", ".word"):
+            field = mnemonic[1:]
+            for value in split_values(operands):
+                self._value(value.strip(WHITESPACE), field, mnemonic)
+
+
+class Linter(Z16Assembler):
+    """
+    Incremental diagnostics for a buffer of source lines. lint() may be
+    called from a worker thread; calls are serialized.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lines = {}      # text -> _LintLine
+        self._contexts = {}   # (text, what its labels resolved to) -> label problems
+        self._lock = threading.Lock()
+        self.checked = 0      # lines checked from scratch by the last lint()
+        self.rechecked = 0    # lines whose label checks were redone by the last lint()
+
+    def lint(self, texts):
+        """Diagnostics for the buffer given as a list of line texts, in line order"""
+        with self._lock:
+            return self._lint(texts)
+
+    def _lint(self, texts):
+        texts = list(texts)
+        # A trailing empty line is not a line as far as fgets() is concerned
+        if texts and not texts[-1]:
+            texts.pop()
+        cache = self._lines
+        lines = {}
+        entries = []
+        self.checked = 0
+        for text in texts:
+            entry = lines.get(text)
+            if entry is None:
+                entry = cache.get(text)
+                if entry is None:
+                    entry = _LintLine(text)
+                    self.checked += 1
+                lines[text] = entry
+            entries.append(entry)
+        self._lines = lines
+
+        # Pass 1: labels, addresses and sections, as the assembler lays them out
+        diagnostics = []
+        placed = []
+        self.symbols = {}
+        self.loc_text = 0
+        self.loc_data = 0
+        self.current_section = SECTION_NONE
+        for line_no, entry in enumerate(entries, 1):
+            line = entry.line
+            line.line_no = line_no
+            try:
+                self.define_label(line)
+            except AssemblerError as e:
+                diagnostics.append(Diagnostic(line_no, ERROR, e.message))
+            try:
+                self.place_line(line)
+            except AssemblerError:
+                pass  # reported by the line's own checks
+            placed.append((line.address, line.section))
+
+        # Pass 2: text checks from the cache, label checks redone where their labels changed
+        contexts = {}
+        self.rechecked = 0
+        for line_no, (entry, (address, section)) in enumerate(zip(entries, placed), 1):
+            for severity, message in entry.problems:
+                diagnostics.append(Diagnostic(line_no, severity, message))
+            if entry.kind == "instruction" and section != SECTION_TEXT:
+                diagnostics.append(Diagnostic(line_no, WARNING, "Instruction outside the .text section"))
+            elif entry.kind == "data" and section != SECTION_DATA:
+                diagnostics.append(Diagnostic(line_no, WARNING,
+                                              f"'{entry.line.mnemonic}' outside the .data section"))
+            if not entry.symbolic:
+                continue
+            if entry.pc_relative:
+                # Branch and jump checks only depend on how far away the target is
+                used = tuple(sym.address - address if sym else None
+                             for sym in map(self.symbols.get, entry.references))
+            else:
+                used = tuple(map(self.symbols.get, entry.references))
+            key = (entry.line.original, used)
+            problems = contexts.get(key)
+            if problems is None:
+                problems = self._contexts.get(key)
+                if problems is None:
+                    problems = self._check_labels(entry, used)
+                    self.rechecked += 1
+                contexts[key] = problems
+            for severity, message in problems:
+                diagnostics.append(Diagnostic(line_no, severity, message))
+        self._contexts = contexts
+
+        diagnostics.sort(key=lambda d: d.line)
+        return diagnostics
+
+    def _check_labels(self, entry, used):
+        """Problems with the label operands of a line, given what entry.references resolved to"""
+        problems = []
+        mnemonic = entry.line.mnemonic
+        resolved = dict(zip(entry.references, used))
+        for name, field in entry.symbolic:
+            value = resolved[name]
+            if value is None:
+                problems.append((ERROR, f"Undefined label '{name}'"))
+            elif field == "target":
+                if INSTRUCTION_SET[mnemonic].type == INST_B:
+                    offset = value >> 1
+                    low, high = BRANCH_RANGE
+                    if not low <= offset <= high:
+                        problems.append((ERROR, f"Branch offset out of range: '{name}' is {offset} "
+                                                f"instructions away ({low}..{high})"))
+                else:
+                    low, high = JUMP_RANGE
+                    if not low <= value <= high:
+                        problems.append((ERROR, f"Jump offset out of range: '{name}' is {value} "
+                                                f"bytes away ({low}..{high})"))
+            elif field is not None:
+                low, high = _FIELD_RANGES[field]
+                if not low <= value.address <= high:
+                    problems.append((WARNING, f"Label '{name}' (0x{value.address:04X}) is out of range "
+                                              f"for '{mnemonic}' ({low}..{high}) and will be truncated; "
+                                              f"use %hi/%lo"))
+        return problems
+
+
+def main(argv):
+    if len(argv) != 2:
+        sys.stderr.write("Usage: %s <sourcefile>\n" % argv[0])
+        return 1
+    try:
+        with open(argv[1], "r", newline="") as fp:
+            texts = fp.read().split("\n")
+    except OSError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    diagnostics = Linter().lint(texts)
+    for d in diagnostics:
+        print("%s:%d: %s: %s" % (argv[1], d.line, d.severity, d.message))
+    return 1 if any(d.severity == ERROR for d in diagnostics) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,450 @@
+"""
+Persistent Z16 debug session
+
+DebugSession keeps one simulator warm between runs: load an image once,
+then reset, step, continue to a breakpoint and read or write registers
+and memory as often as needed, without starting a new process per run.
+
+The same session can live in a child process. 'python z16session.py
+--serve' answers one JSON request per line on stdin with one JSON
+response per line on stdout:
+
+    {"cmd": "load", "image": "<hex>"}            -> {"ok": true, "bytes": 14}
+    {"cmd": "break", "set": [16, 18]}            -> {"ok": true, "breakpoints": [16, 18]}
+    {"cmd": "continue", "max": 100000}           -> {"ok": true, "reason": "breakpoint", "pc": 16, ...}
+    {"cmd": "step", "count": 1}
+    {"cmd": "back", "count": 1}                  (step back; see z16history.py)
+    {"cmd": "reverse-continue"}                  -> {"ok": true, "reason": "breakpoint", ...}
+    {"cmd": "reset"}
+    {"cmd": "save-snapshot", "file": "warm.z16s"}
+    {"cmd": "resume", "file": "warm.z16s"}       (see z16snapshot.py)
+    {"cmd": "regs"}                              -> {"ok": true, "regs": [...], "pc": 16, ...}
+    {"cmd": "set-reg", "reg": "a0", "value": 5}  ("pc" sets the PC)
+    {"cmd": "read", "addr": 256, "length": 16}   -> {"ok": true, "data": "<hex>"}
+    {"cmd": "write", "addr": 256, "data": "<hex>"}
+    {"cmd": "quit"}
+
+Every response carries the machine state ("reason", "pc", "count",
+"stopped") and any ecall output the command produced ("output").
+Failures answer {"ok": false, "error": "..."}. SessionClient spawns the
+server and offers the same methods as DebugSession.
+
+Usage:
+python z16session.py --serve
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from z16sim import Z16Simulator, MAX_INSTRUCTIONS, MEM_SIZE, REG_NAMES, STOP_TIME_LIMIT
+from z16history import History, CHECKPOINT_INTERVAL
+from z16snapshot import Snapshot, SnapshotError
+
+
+class SessionError(Exception):
+    """A session command failed (bad arguments, or the server went away)"""
+
+
+def _register_index(reg):
+    """Register number of "a0", "x6" or 6; raises SessionError"""
+    if isinstance(reg, int):
+        index = reg
+    elif reg.lower() in REG_NAMES:
+        index = REG_NAMES.index(reg.lower())
+    elif reg[:1] in ("x", "X") and reg[1:].isdigit():
+        index = int(reg[1:])
+    else:
+        raise SessionError(f"unknown register '{reg}'")
+    if not 0 <= index < len(REG_NAMES):
+        raise SessionError(f"unknown register '{reg}'")
+    return index
+
+
+class DebugSession:
+    """
+    In-process session over one Z16Simulator; ecall output goes to 'write'.
+    Methods may be called from several threads (e.g. a UI setting
+    breakpoints while a worker continues); each runs under one lock.
+    Execution is recorded every 'checkpoint_interval' instructions so the
+    session can step back (see z16history.History).
+    """
+
+    def __init__(self, write=None, max_output=None, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.simulator = Z16Simulator(write=write, max_output=max_output)
+        self.history = History(self.simulator, checkpoint_interval)
+        self.image = b""
+        self.snapshot = None  # the Snapshot reset() goes back to, if resumed from one
+        self.reason = None  # why the last step/continue stopped (None = still runnable)
+        # A continue that ran out of instructions resumes without skipping a breakpoint
+        self._mid_continue = False
+        self.lock = threading.Lock()
+
+    # --- Program ---
+
+    def load(self, image):
+        """Load a new program image; breakpoints are kept"""
+        with self.lock:
+            self.image = bytes(image[:MEM_SIZE])
+            self.snapshot = None
+            self.reason = None
+            self._mid_continue = False
+            loaded = self.simulator.load(self.image)
+            self.history.clear()
+            return loaded
+
+    def reset(self):
+        """Restart the loaded program: memory, registers and counters as after load() or resume()"""
+        with self.lock:
+            self.reason = None
+            self._mid_continue = False
+            if self.snapshot is not None:
+                self.snapshot.restore(self.simulator)
+                loaded = MEM_SIZE
+            else:
+                loaded = self.simulator.load(self.image)
+            self.history.clear()
+            return loaded
+
+    def resume(self, filename):
+        """Continue a machine saved with save_snapshot(); breakpoints are kept"""
+        try:
+            snapshot = Snapshot.load(filename)
+        except (OSError, SnapshotError) as e:
+            raise SessionError(f"cannot resume {filename}: {e}")
+        with self.lock:
+            self.snapshot = snapshot
+            self.image = b""
+            self.reason = None
+            self._mid_continue = False
+            snapshot.restore(self.simulator)
+            self.history.clear()
+
+    def save_snapshot(self, filename):
+        """Save the paused machine to a snapshot file (see z16snapshot.py)"""
+        with self.lock:
+            snapshot = Snapshot.capture(self.simulator)
+        try:
+            snapshot.save(filename)
+        except OSError as e:
+            raise SessionError(f"cannot save {filename}: {e.strerror}")
+
+    # --- Execution ---
+
+    def step(self, count=1):
+        """
+        Execute up to 'count' instructions. The first one runs even if it has
+        a breakpoint; later ones pause at breakpoints. Returns the stop reason
+        (None if all 'count' ran).
+        """
+        sim = self.simulator
+        with self.lock:
+            if count <= 0 or sim.stop_reason is not None:
+                return sim.stop_reason
+            self._mid_continue = False
+            if not self.history.step():
+                self.reason = sim.stop_reason
+            elif count > 1:
+                self.reason = self.history.run(count - 1)
+            else:
+                self.reason = None
+            return self.reason
+
+    def cont(self, max_instructions=MAX_INSTRUCTIONS, deadline=None):
+        """
+        Run until a breakpoint, a stop condition, 'deadline' (a perf_counter
+        value) or 'max_instructions' more instructions (None = no limit);
+        returns the reason (None if the instruction budget ran out). Like
+        breakpoints, STOP_TIME_LIMIT only pauses the session. A long continue
+        can be done in slices: calling cont() again after it returned None
+        carries on as if it had never stopped.
+        """
+        sim = self.simulator
+        with self.lock:
+            if sim.stop_reason is not None:
+                return sim.stop_reason
+            done = 0
+            if sim.breakpoints[sim.pc] and not self._mid_continue:
+                # Resuming from a breakpoint: get past it first
+                if not self.history.step():
+                    self.reason = sim.stop_reason
+                    return self.reason
+                done = 1
+            remaining = None if max_instructions is None else max_instructions - done
+            self.reason = self.history.run(remaining, None, deadline) if remaining != 0 else None
+            if self.reason == STOP_TIME_LIMIT:
+                # Out of time only pauses a debug session; 'continue' resumes it
+                sim.stop_reason = None
+            self._mid_continue = self.reason in (None, STOP_TIME_LIMIT)
+            return self.reason
+
+    def step_back(self, count=1):
+        """Undo the last 'count' instructions (fewer at the start of the run); returns how many were undone"""
+        with self.lock:
+            self._mid_continue = False
+            self.reason = None
+            return self.history.step_back(count)
+
+    def reverse_cont(self):
+        """
+        Go back to the last breakpoint hit before the current point; returns
+        STOP_BREAKPOINT, or None when there was none and the session is back
+        at the start of the run
+        """
+        with self.lock:
+            self._mid_continue = False
+            self.reason = self.history.reverse_continue()
+            return self.reason
+
+    @property
+    def stopped(self):
+        """True once the program has stopped for good (ecall, zero instruction, limits)"""
+        return self.simulator.stop_reason is not None
+
+    # --- Breakpoints ---
+
+    @property
+    def breakpoints(self):
+        return [addr for addr, flag in enumerate(self.simulator.breakpoints) if flag]
+
+    def set_breakpoints(self, addresses):
+        """Replace all breakpoints with 'addresses'"""
+        wanted = {addr & 0xFFFF for addr in addresses}
+        with self.lock:
+            for addr in set(self.breakpoints) ^ wanted:
+                self.simulator.set_breakpoint(addr, addr in wanted)
+        return sorted(wanted)
+
+    # --- State ---
+
+    def registers(self):
+        """(registers x0..x7, pc)"""
+        with self.lock:
+            return tuple(self.simulator.regs), self.simulator.pc
+
+    def write_register(self, reg, value):
+        """Set a register ("a0", "x6", 6) or the PC ("pc")"""
+        if isinstance(reg, str) and reg.lower() == "pc":
+            with self.lock:
+                self.simulator.pc = value & 0xFFFF
+                self.history.edited()
+        else:
+            index = _register_index(reg)
+            with self.lock:
+                self.simulator.regs[index] = value & 0xFFFF
+                self.history.edited()
+
+    def read_memory(self, addr, length):
+        if not (0 <= addr and length >= 0 and addr + length <= MEM_SIZE):
+            raise SessionError(f"read of {length} bytes at 0x{addr:X} is outside memory")
+        with self.lock:
+            return bytes(self.simulator.memory[addr:addr + length])
+
+    def write_memory(self, addr, data):
+        if not (0 <= addr and addr + len(data) <= MEM_SIZE):
+            raise SessionError(f"write of {len(data)} bytes at 0x{addr:X} is outside memory")
+        with self.lock:
+            self.simulator.memory[addr:addr + len(data)] = data
+            # Code may have been overwritten
+            self.simulator.invalidate(addr, addr + len(data))
+            self.history.edited()
+
+    def profile(self):
+        """Per-PC execution counts since the last load or reset (a z16sim.Profile)"""
+        with self.lock:
+            return self.simulator.profile()
+
+    def state(self):
+        """Machine state as reported after every server command"""
+        sim = self.simulator
+        return {"reason": self.reason, "pc": sim.pc, "count": sim.instruction_count,
+                "stopped": self.stopped}
+
+
+# -----------------------
+# Server
+# -----------------------
+
+def _handle(session, request):
+    cmd = request.get("cmd")
+    if cmd == "load":
+        return {"bytes": session.load(bytes.fromhex(request["image"]))}
+    if cmd == "reset":
+        session.reset()
+        return {}
+    if cmd == "save-snapshot":
+        session.save_snapshot(request["file"])
+        return {}
+    if cmd == "resume":
+        session.resume(request["file"])
+        return {}
+    if cmd == "step":
+        session.step(int(request.get("count", 1)))
+        return {}
+    if cmd == "back":
+        session.step_back(int(request.get("count", 1)))
+        return {}
+    if cmd == "reverse-continue":
+        session.reverse_cont()
+        return {}
+    if cmd == "continue":
+        seconds = request.get("seconds")
+        deadline = time.perf_counter() + seconds if seconds else None
+        session.cont(request.get("max", MAX_INSTRUCTIONS), deadline)
+        return {}
+    if cmd == "break":
+        if "set" in request:
+            session.set_breakpoints(request["set"])
+        return {"breakpoints": session.breakpoints}
+    if cmd == "regs":
+        regs, pc = session.registers()
+        return {"regs": list(regs)}
+    if cmd == "set-reg":
+        session.write_register(request["reg"], int(request["value"]))
+        return {}
+    if cmd == "read":
+        return {"data": session.read_memory(int(request["addr"]), int(request["length"])).hex()}
+    if cmd == "write":
+        session.write_memory(int(request["addr"]), bytes.fromhex(request["data"]))
+        return {}
+    raise SessionError(f"unknown command {cmd!r}")
+
+
+def serve(infile, outfile):
+    """Answer JSON-lines requests from 'infile' until EOF or "quit"""
+    output = []
+    session = DebugSession(write=output.append)
+    for line in infile:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if request.get("cmd") == "quit":
+                outfile.write('{"ok":true}\n')
+                outfile.flush()
+                break
+            response = {"ok": True}
+            response.update(_handle(session, request))
+            response.update(session.state())
+        except (SessionError, ValueError, KeyError, TypeError) as e:
+            response = {"ok": False, "error": str(e)}
+        if output:
+            response["output"] = "".join(output)
+            output.clear()
+        outfile.write(json.dumps(response, separators=(",", ":")) + "\n")
+        outfile.flush()
+
+
+# -----------------------
+# Client
+# -----------------------
+
+class SessionClient:
+    """
+    A DebugSession in a child process ('python z16session.py --serve').
+    Methods mirror DebugSession; ecall output is passed to 'write'.
+    """
+
+    def __init__(self, write=None, command=None):
+        self.write = write if write is not None else sys.stdout.write
+        if command is None:
+            command = [sys.executable, os.path.abspath(__file__), "--serve"]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        text=True, bufsize=1)
+        self.reason = None
+        self.pc = 0
+        self.count = 0
+        self.stopped = False
+
+    def request(self, cmd, **args):
+        """Send one command and return its response; raises SessionError on failure"""
+        args["cmd"] = cmd
+        try:
+            self.process.stdin.write(json.dumps(args, separators=(",", ":")) + "\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (OSError, ValueError) as e:
+            raise SessionError(f"session server is gone: {e}")
+        if not line:
+            raise SessionError("session server closed the connection")
+        response = json.loads(line)
+        if response.get("output"):
+            self.write(response["output"])
+        if not response.get("ok"):
+            raise SessionError(response.get("error", "request failed"))
+        if "pc" in response:
+            self.reason = response["reason"]
+            self.pc = response["pc"]
+            self.count = response["count"]
+            self.stopped = response["stopped"]
+        return response
+
+    def load(self, image):
+        return self.request("load", image=bytes(image).hex())["bytes"]
+
+    def reset(self):
+        self.request("reset")
+
+    def resume(self, filename):
+        self.request("resume", file=filename)
+
+    def save_snapshot(self, filename):
+        self.request("save-snapshot", file=filename)
+
+    def step(self, count=1):
+        return self.request("step", count=count)["reason"]
+
+    def cont(self, max_instructions=MAX_INSTRUCTIONS, seconds=None):
+        return self.request("continue", max=max_instructions, seconds=seconds)["reason"]
+
+    def step_back(self, count=1):
+        before = self.count
+        self.request("back", count=count)
+        return before - self.count
+
+    def reverse_cont(self):
+        return self.request("reverse-continue")["reason"]
+
+    @property
+    def breakpoints(self):
+        return self.request("break")["breakpoints"]
+
+    def set_breakpoints(self, addresses):
+        return self.request("break", set=list(addresses))["breakpoints"]
+
+    def registers(self):
+        response = self.request("regs")
+        return tuple(response["regs"]), response["pc"]
+
+    def write_register(self, reg, value):
+        self.request("set-reg", reg=reg, value=value)
+
+    def read_memory(self, addr, length):
+        return bytes.fromhex(self.request("read", addr=addr, length=length)["data"])
+
+    def write_memory(self, addr, data):
+        self.request("write", addr=addr, data=bytes(data).hex())
+
+    def close(self):
+        """Stop the server process"""
+        if self.process.poll() is None:
+            try:
+                self.request("quit")
+            except SessionError:
+                pass
+            self.process.wait()
+
+
+def main(argv):
+    if len(argv) != 2 or argv[1] != "--serve":
+        sys.stderr.write("Usage: %s --serve\n" % argv[0])
+        return 1
+    serve(sys.stdin, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
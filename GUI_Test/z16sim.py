@@ -0,0 +1,1294 @@
+"""
+Z16 Instruction Set Simulator (ISS) - in-process engine
+
+Python port of z16sim.c with the same execution semantics. Instead of
+re-parsing every fetched word through nested opcode/funct checks, all 65,536
+possible instruction words are decoded once into a table of
+(handler, a, b, imm) entries; the run loop only indexes that table. Runs
+without a trace callback go further and execute translated basic blocks
+(see Block Translation below).
+
+Supported ecall services:
+- ecall 1: Print an integer (value in register a0).
+- ecall 5: Print a NULL-terminated string (address in register a0).
+- ecall 3: Terminate the simulation.
+
+Usage:
+python z16sim.py [--trace=text|binary|ndjson] [--fast] [--profile] [--max-instructions=N]
+                 [--timeout=SECONDS] [--max-output=BYTES] [--save-snapshot=FILE]
+                 <machine_code_file_name | --resume=SNAPSHOT>
+
+--trace=binary and --trace=ndjson replace the text trace with structured
+records; the formats are described in z16trace.py. --fast runs without
+the per-instruction trace (or step records) and ends the text output
+with an instruction count and elapsed-time summary.
+
+The budget options bound a run by retired instructions (default 100000),
+wall-clock time and bytes of ecall output; 0 means unlimited. When a
+budget runs out the run stops cleanly, reports the PC and instruction
+count, and keeps the trace printed so far.
+
+--profile ends the run with execution counts: totals of instructions,
+loads, stores and taken/not-taken branches, and the most executed PCs
+(e.g. the loop that used up the instruction budget). The counters are
+always kept; the flag only prints them (on stderr with --trace=binary or
+--trace=ndjson, whose stdout is records).
+
+--save-snapshot=FILE saves the machine as the run left it (see
+z16snapshot.py); --resume=FILE continues such a snapshot instead of
+loading a program. Budgets apply to the resumed run alone, while the
+reported instruction counts include the instructions before the snapshot.
+"""
+
+import sys
+import time
+from collections import namedtuple
+from itertools import compress
+
+MEM_SIZE = 65536  # 64KB memory
+MAX_INSTRUCTIONS = 100000  # Same instruction cap as z16sim.c
+
+# Register ABI names for display (x0 = t0, x1 = ra, x2 = sp, x3 = s0, x4 = s1, x5 = t1, x6 = a0, x7 = a1)
+REG_NAMES = ("t0", "ra", "sp", "s0", "s1", "t1", "a0", "a1")
+
+# Reasons a run can stop
+STOP_ECALL = "ecall"
+STOP_ZERO_INSTRUCTION = "zero instruction"
+STOP_END_OF_MEMORY = "end of memory"
+STOP_TIME_LIMIT = "time limit"
+STOP_OUTPUT_LIMIT = "output limit"
+# A pause rather than a stop: the run can be resumed
+STOP_BREAKPOINT = "breakpoint"
+
+# Per-run budgets: instruction count, wall-clock seconds and ecall output
+# bytes. None means unlimited; the defaults match z16sim.c.
+Budget = namedtuple("Budget", "instructions seconds output")
+DEFAULT_BUDGET = Budget(MAX_INSTRUCTIONS, None, None)
+
+# Instructions executed between two watchdog clock reads
+WATCHDOG_INTERVAL = 4096
+
+# Breakpoint flags for runs that ignore breakpoints
+_NO_BREAKPOINTS = bytes(MEM_SIZE)
+
+
+def to_signed(value):
+    """Interpret a 16-bit register value as a signed integer"""
+    return (value ^ 0x8000) - 0x8000
+
+
+# -----------------------
+# Instruction Handlers
+# -----------------------
+#
+# Each handler receives the simulator, the PC of the instruction and the
+# operand fields stored in its decode table entry. It returns the next PC,
+# or None when the simulation should terminate (ecall 3).
+
+def _nop(m, pc, a, b, imm):
+    return (pc + 2) & 0xFFFF
+
+
+def _add(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = (r[a] + r[b]) & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _sub(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = (r[a] - r[b]) & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _jr(m, pc, a, b, imm):
+    return m.regs[b]
+
+
+def _jalr(m, pc, a, b, imm):
+    r = m.regs
+    target = r[b]
+    r[a] = (pc + 2) & 0xFFFF
+    return target
+
+
+def _slt(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = 1 if to_signed(r[a]) < to_signed(r[b]) else 0
+    return (pc + 2) & 0xFFFF
+
+
+def _sltu(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = 1 if r[a] < r[b] else 0
+    return (pc + 2) & 0xFFFF
+
+
+def _sll(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = (r[a] << (r[b] & 0xF)) & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _srl(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[a] >> (r[b] & 0xF)
+    return (pc + 2) & 0xFFFF
+
+
+def _sra(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = (to_signed(r[a]) >> (r[b] & 0xF)) & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _or(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[a] | r[b]
+    return (pc + 2) & 0xFFFF
+
+
+def _and(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[a] & r[b]
+    return (pc + 2) & 0xFFFF
+
+
+def _xor(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[a] ^ r[b]
+    return (pc + 2) & 0xFFFF
+
+
+def _mv(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[b]
+    return (pc + 2) & 0xFFFF
+
+
+def _addi(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = (r[a] + imm) & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _slti(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = 1 if to_signed(r[a]) < imm else 0
+    return (pc + 2) & 0xFFFF
+
+
+def _sltui(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = 1 if r[a] < (imm & 0xFFFF) else 0
+    return (pc + 2) & 0xFFFF
+
+
+def _slli(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = (r[a] << imm) & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _srli(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[a] >> imm
+    return (pc + 2) & 0xFFFF
+
+
+def _srai(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = (to_signed(r[a]) >> imm) & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _ori(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[a] | (imm & 0xFFFF)
+    return (pc + 2) & 0xFFFF
+
+
+def _andi(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[a] & (imm & 0xFFFF)
+    return (pc + 2) & 0xFFFF
+
+
+def _xori(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = r[a] ^ (imm & 0xFFFF)
+    return (pc + 2) & 0xFFFF
+
+
+def _li(m, pc, a, b, imm):
+    m.regs[a] = imm & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _beq(m, pc, a, b, imm):
+    r = m.regs
+    return (pc + imm) & 0xFFFF if r[a] == r[b] else (pc + 2) & 0xFFFF
+
+
+def _bne(m, pc, a, b, imm):
+    r = m.regs
+    return (pc + imm) & 0xFFFF if r[a] != r[b] else (pc + 2) & 0xFFFF
+
+
+def _bz(m, pc, a, b, imm):
+    return (pc + imm) & 0xFFFF if m.regs[a] == 0 else (pc + 2) & 0xFFFF
+
+
+def _bnz(m, pc, a, b, imm):
+    return (pc + imm) & 0xFFFF if m.regs[a] != 0 else (pc + 2) & 0xFFFF
+
+
+def _blt(m, pc, a, b, imm):
+    r = m.regs
+    taken = to_signed(r[a]) < to_signed(r[b])
+    return (pc + imm) & 0xFFFF if taken else (pc + 2) & 0xFFFF
+
+
+def _bge(m, pc, a, b, imm):
+    r = m.regs
+    taken = to_signed(r[a]) >= to_signed(r[b])
+    return (pc + imm) & 0xFFFF if taken else (pc + 2) & 0xFFFF
+
+
+def _bltu(m, pc, a, b, imm):
+    r = m.regs
+    return (pc + imm) & 0xFFFF if r[a] < r[b] else (pc + 2) & 0xFFFF
+
+
+def _bgeu(m, pc, a, b, imm):
+    r = m.regs
+    return (pc + imm) & 0xFFFF if r[a] >= r[b] else (pc + 2) & 0xFFFF
+
+
+def _sb(m, pc, a, b, imm):
+    r = m.regs
+    addr = (r[a] + imm) & 0xFFFF
+    m.memory[addr] = r[b] & 0xFF
+    if m.code[addr]:
+        m.invalidate(addr, addr + 1)  # self-modifying code
+    return (pc + 2) & 0xFFFF
+
+
+def _sw(m, pc, a, b, imm):
+    r = m.regs
+    addr = (r[a] + imm) & 0xFFFF
+    m.memory[addr] = r[b] & 0xFF
+    # The high byte of a word at 0xFFFF wraps to 0x0000, as in z16sim.c
+    addr2 = (addr + 1) & 0xFFFF
+    m.memory[addr2] = r[b] >> 8
+    if m.code[addr] or m.code[addr2]:
+        m.invalidate(addr, addr + 1)  # self-modifying code
+        m.invalidate(addr2, addr2 + 1)
+    return (pc + 2) & 0xFFFF
+
+
+def _lb(m, pc, a, b, imm):
+    r = m.regs
+    val = m.memory[(r[b] + imm) & 0xFFFF]
+    r[a] = val | 0xFF00 if val & 0x80 else val  # Sign-extended byte load
+    return (pc + 2) & 0xFFFF
+
+
+def _lw(m, pc, a, b, imm):
+    r = m.regs
+    addr = (r[b] + imm) & 0xFFFF
+    r[a] = m.memory[addr] | (m.memory[(addr + 1) & 0xFFFF] << 8)
+    return (pc + 2) & 0xFFFF
+
+
+def _lbu(m, pc, a, b, imm):
+    r = m.regs
+    r[a] = m.memory[(r[b] + imm) & 0xFFFF]  # Zero-extended byte load
+    return (pc + 2) & 0xFFFF
+
+
+def _j(m, pc, a, b, imm):
+    return (pc + imm) & 0xFFFF
+
+
+def _jal(m, pc, a, b, imm):
+    m.regs[a] = (pc + 2) & 0xFFFF
+    return (pc + imm) & 0xFFFF
+
+
+def _lui(m, pc, a, b, imm):
+    m.regs[a] = imm
+    return (pc + 2) & 0xFFFF
+
+
+def _auipc(m, pc, a, b, imm):
+    m.regs[a] = (pc + imm) & 0xFFFF
+    return (pc + 2) & 0xFFFF
+
+
+def _ecall(m, pc, a, b, imm):
+    if imm == 1:  # Print integer
+        text = "%d\n" % to_signed(m.regs[6])  # a0 is register 6
+    elif imm == 5:  # Print string
+        text = m.read_string(m.regs[6]) + "\n"
+    elif imm == 3:  # Terminate
+        return None
+    else:
+        return (pc + 2) & 0xFFFF
+    # Stops on this ecall, like ecall 3, once the output budget is used up
+    return (pc + 2) & 0xFFFF if m.output(text) else None
+
+
+# -----------------------
+# Decode Table
+# -----------------------
+
+_R_FUNCT3 = {0x1: _slt, 0x2: _sltu, 0x4: _or, 0x5: _and, 0x6: _xor, 0x7: _mv}
+_R_FUNCT4_ARITH = {0x0: _add, 0x1: _sub, 0x4: _jr, 0x8: _jalr}
+_R_FUNCT4_SHIFT = {0x2: _sll, 0x4: _srl, 0x8: _sra}
+_I_FUNCT3 = {0x0: _addi, 0x1: _slti, 0x2: _sltui, 0x4: _ori, 0x5: _andi, 0x6: _xori, 0x7: _li}
+_I_SHIFT = {0x1: _slli, 0x2: _srli, 0x4: _srai}
+_B_FUNCT3 = (_beq, _bne, _bz, _bnz, _blt, _bge, _bltu, _bgeu)
+_S_FUNCT3 = {0x0: _sb, 0x1: _sw}
+_L_FUNCT3 = {0x0: _lb, 0x1: _lw, 0x4: _lbu}
+
+
+def decode(inst):
+    """Decode a 16-bit instruction word into a (handler, a, b, imm) entry"""
+    opcode = inst & 0x7
+    funct3 = (inst >> 3) & 0x7
+    field_6 = (inst >> 6) & 0x7
+    field_9 = (inst >> 9) & 0x7
+
+    if opcode == 0x0:  # R-type: a = rd/rs1, b = rs2
+        funct4 = (inst >> 12) & 0xF
+        if funct3 == 0x0:
+            handler = _R_FUNCT4_ARITH.get(funct4, _nop)
+        elif funct3 == 0x3:
+            handler = _R_FUNCT4_SHIFT.get(funct4, _nop)
+        else:
+            handler = _R_FUNCT3[funct3]
+        return (handler, field_6, field_9, 0)
+
+    if opcode == 0x1:  # I-type: a = rd/rs1, imm = sign-extended imm7 or shamt
+        imm7 = (inst >> 9) & 0x7F
+        if funct3 == 0x3:
+            return (_I_SHIFT.get((imm7 >> 4) & 0x7, _nop), field_6, 0, imm7 & 0xF)
+        simm = imm7 - 0x80 if imm7 & 0x40 else imm7
+        return (_I_FUNCT3[funct3], field_6, 0, simm)
+
+    if opcode == 0x2:  # B-type: a = rs1, b = rs2, imm = signed byte offset
+        offset = ((inst >> 12) & 0xF) << 1
+        if offset & 0x10:
+            offset -= 0x20
+        return (_B_FUNCT3[funct3], field_6, field_9, offset)
+
+    if opcode == 0x3:  # S-type: a = rs1 (base), b = rs2 (source)
+        return (_S_FUNCT3.get(funct3, _nop), field_6, field_9, (inst >> 12) & 0xF)
+
+    if opcode == 0x4:  # L-type: a = rd, b = rs2 (base)
+        return (_L_FUNCT3.get(funct3, _nop), field_6, field_9, (inst >> 12) & 0xF)
+
+    if opcode == 0x5:  # J-type: a = rd, imm = signed byte offset
+        offset = ((((inst >> 9) & 0x3F) << 3) | funct3) << 1
+        if offset & 0x400:
+            offset -= 0x800
+        return (_jal if inst & 0x8000 else _j, field_6, 0, offset)
+
+    if opcode == 0x6:  # U-type: a = rd, imm = bits [15:7] as executed by z16sim.c
+        imm = ((((inst >> 10) & 0x1F) << 3) | funct3) << 7
+        return (_auipc if inst & 0x8000 else _lui, field_6, 0, imm & 0xFFFF)
+
+    # System instruction (ecall): imm = service number
+    return (_ecall, 0, 0, (inst >> 6) & 0x3FF)
+
+
+# Handlers that write register 'a', and store handlers with their width;
+# structured traces use these to report what an instruction changed
+_WRITES_REGISTER = frozenset((
+    _add, _sub, _jalr, _slt, _sltu, _sll, _srl, _sra, _or, _and, _xor, _mv,
+    _addi, _slti, _sltui, _slli, _srli, _srai, _ori, _andi, _xori, _li,
+    _lb, _lw, _lbu, _jal, _lui, _auipc))
+_STORE_SIZES = {_sb: 1, _sw: 2}
+# Instruction classes counted by the profiler
+_BRANCHES = frozenset(_B_FUNCT3)
+_LOADS = frozenset((_lb, _lw, _lbu))
+
+_decode_table = None
+
+
+def decode_table():
+    """Return the decode table for all 65,536 instruction words, building it on first use"""
+    global _decode_table
+    if _decode_table is None:
+        _decode_table = tuple(decode(inst) for inst in range(0x10000))
+    return _decode_table
+
+
+# -----------------------
+# Block Translation
+# -----------------------
+#
+# Runs without a trace callback execute translated basic blocks instead of
+# dispatching one instruction at a time. A block is the straight-line code
+# from a start PC up to and including the first branch, jump, jr/jalr or
+# ecall (or MAX_BLOCK_LENGTH instructions, or the word before a zero
+# instruction / the end of memory). It is compiled into a Python function
+# that keeps registers in locals:
+#
+#     block(regs, memory, code, simulator, budget) -> (next_pc, executed)
+#
+# next_pc is None when an ecall stopped the run; the ecall itself is not
+# counted, as in the interpreter. A block whose branch or jump targets its
+# own start loops inside the function while 'budget' instructions remain,
+# so tight loops never return to the dispatcher. Stores check the code
+# map (one flag per byte covered by a translated block): a store into
+# translated code drops the blocks it overlaps and leaves the block
+# right after the store, so self-modifying code sees its own writes.
+
+# Longest block translated into one function
+MAX_BLOCK_LENGTH = 64
+
+_BLOCK_ENDS = frozenset(_B_FUNCT3 + (_j, _jal, _jr, _jalr, _ecall))
+
+# Straight-line instructions as Python statements on the locals r0..r7;
+# {uimm} is the immediate as an unsigned 16-bit value, {target} is pc + imm
+_STATEMENTS = {
+    _nop: "pass",
+    _add: "r{a} = (r{a} + r{b}) & 0xFFFF",
+    _sub: "r{a} = (r{a} - r{b}) & 0xFFFF",
+    _slt: "r{a} = 1 if (r{a} ^ 0x8000) < (r{b} ^ 0x8000) else 0",
+    _sltu: "r{a} = 1 if r{a} < r{b} else 0",
+    _sll: "r{a} = (r{a} << (r{b} & 0xF)) & 0xFFFF",
+    _srl: "r{a} = r{a} >> (r{b} & 0xF)",
+    _sra: "r{a} = (((r{a} ^ 0x8000) - 0x8000) >> (r{b} & 0xF)) & 0xFFFF",
+    _or: "r{a} = r{a} | r{b}",
+    _and: "r{a} = r{a} & r{b}",
+    _xor: "r{a} = r{a} ^ r{b}",
+    _mv: "r{a} = r{b}",
+    _addi: "r{a} = (r{a} + {imm}) & 0xFFFF",
+    _slti: "r{a} = 1 if (r{a} ^ 0x8000) - 0x8000 < {imm} else 0",
+    _sltui: "r{a} = 1 if r{a} < {uimm} else 0",
+    _slli: "r{a} = (r{a} << {imm}) & 0xFFFF",
+    _srli: "r{a} = r{a} >> {imm}",
+    _srai: "r{a} = (((r{a} ^ 0x8000) - 0x8000) >> {imm}) & 0xFFFF",
+    _ori: "r{a} = r{a} | {uimm}",
+    _andi: "r{a} = r{a} & {uimm}",
+    _xori: "r{a} = r{a} ^ {uimm}",
+    _li: "r{a} = {uimm}",
+    _lb: "v = mem[(r{b} + {imm}) & 0xFFFF]\nr{a} = v | 0xFF00 if v & 0x80 else v",
+    _lw: "v = (r{b} + {imm}) & 0xFFFF\nr{a} = mem[v] | (mem[(v + 1) & 0xFFFF] << 8)",
+    _lbu: "r{a} = mem[(r{b} + {imm}) & 0xFFFF]",
+    _lui: "r{a} = {imm}",
+    _auipc: "r{a} = {target}",
+}
+
+# Stores; {exit} leaves the block when the store hit translated code
+_STORES = {
+    _sb: "v = (r{a} + {imm}) & 0xFFFF\nmem[v] = r{b} & 0xFF\n"
+         "if code[v]:\n    m.invalidate(v, v + 1)\n{exit}",
+    _sw: "v = (r{a} + {imm}) & 0xFFFF\nmem[v] = r{b} & 0xFF\n"
+         "w = (v + 1) & 0xFFFF\nmem[w] = r{b} >> 8\n"
+         "if code[v] or code[w]:\n    m.invalidate(v, v + 1)\n    m.invalidate(w, w + 1)\n{exit}",
+}
+
+# Branch conditions
+_CONDITIONS = {
+    _beq: "r{a} == r{b}",
+    _bne: "r{a} != r{b}",
+    _bz: "r{a} == 0",
+    _bnz: "r{a} != 0",
+    _blt: "(r{a} ^ 0x8000) < (r{b} ^ 0x8000)",
+    _bge: "(r{a} ^ 0x8000) >= (r{b} ^ 0x8000)",
+    _bltu: "r{a} < r{b}",
+    _bgeu: "r{a} >= r{b}",
+}
+
+# Compiled blocks shared by all simulators, keyed by (start PC, code bytes)
+_block_cache = {}
+_BLOCK_CACHE_SIZE = 4096
+
+
+def translate_block(start, words):
+    """Compile the instruction words of the block at 'start'; returns the block function"""
+    key = (start, tuple(words))
+    block = _block_cache.get(key)
+    if block is not None:
+        return block
+
+    table = decode_table()
+    length = len(words)
+    end = (start + 2 * length) & 0xFFFF
+    handler, a, b, imm = table[words[-1]]
+    if handler not in _BLOCK_ENDS:
+        handler = None  # the block falls through to 'end'
+    last_pc = (start + 2 * length - 2) & 0xFFFF
+    # Jumps back to the block's own start loop inside the function
+    loops = (handler in _CONDITIONS or handler in (_j, _jal)) and (last_pc + imm) & 0xFFFF == start
+
+    written = set()
+    for inst in words:
+        entry = table[inst]
+        if entry[0] in _WRITES_REGISTER:
+            written.add(entry[1])
+    writeback = ["r[%d] = r%d" % (i, i) for i in sorted(written)]
+
+    def executed(k):
+        return "n + %d" % k if loops else "%d" % k
+
+    body = []
+    for k, inst in enumerate(words[:length - 1] if handler else words, 1):
+        h, a, b, imm = table[inst]
+        pc = (start + 2 * k - 2) & 0xFFFF
+        if h in _STORES:
+            exit_lines = writeback + ["return 0x%04X, %s" % ((pc + 2) & 0xFFFF, executed(k))]
+            text = _STORES[h].format(a=a, b=b, imm=imm, exit="\n".join("    " + line for line in exit_lines))
+        else:
+            text = _STATEMENTS[h].format(a=a, b=b, imm=imm, uimm=imm & 0xFFFF, target=(pc + imm) & 0xFFFF)
+        body.extend(text.split("\n"))
+
+    # Terminator
+    h, a, b, imm = table[words[-1]]
+    target = (last_pc + imm) & 0xFFFF
+    link = (last_pc + 2) & 0xFFFF
+    if handler is None:
+        body += writeback + ["return 0x%04X, %s" % (end, executed(length))]
+    elif handler in _CONDITIONS:
+        condition = _CONDITIONS[h].format(a=a, b=b)
+        if loops:
+            body += ["if %s:" % condition, "    n += %d" % length,
+                     "    if n + %d <= budget:" % length, "        continue"]
+            body += ["    " + line for line in writeback] + ["    return 0x%04X, n" % start]
+            body += writeback + ["return 0x%04X, n + %d" % (link, length)]
+        else:
+            body += writeback + ["if %s:" % condition,
+                                 "    return 0x%04X, %d" % (target, length),
+                                 "return 0x%04X, %d" % (link, length)]
+    elif handler in (_j, _jal):
+        if handler is _jal:
+            body.append("r%d = 0x%04X" % (a, link))
+        if loops:
+            body += ["n += %d" % length, "if n + %d <= budget:" % length, "    continue"]
+            body += writeback + ["return 0x%04X, n" % start]
+        else:
+            body += writeback + ["return 0x%04X, %d" % (target, length)]
+    elif handler is _jr:
+        body += writeback + ["return r%d, %d" % (b, length)]
+    elif handler is _jalr:
+        body += ["v = r%d" % b, "r%d = 0x%04X" % (a, link)]
+        body += writeback + ["return v, %d" % length]
+    else:  # ecall: registers must be in memory for the service routines
+        body += writeback + ["v = ecall(m, 0x%04X, 0, 0, %d)" % (last_pc, imm),
+                             "if v is None:", "    return None, %d" % (length - 1),
+                             "return v, %d" % length]
+
+    lines = ["def block(r, mem, code, m, budget):",
+             "    r0, r1, r2, r3, r4, r5, r6, r7 = r"]
+    if loops:
+        lines += ["    n = 0", "    while True:"]
+        lines += ["        " + line for line in body]
+    else:
+        lines += ["    " + line for line in body]
+    namespace = {"ecall": _ecall}
+    exec("\n".join(lines), namespace)
+    block = namespace["block"]
+
+    if len(_block_cache) >= _BLOCK_CACHE_SIZE:
+        _block_cache.clear()
+    _block_cache[key] = block
+    return block
+
+
+# -----------------------
+# Disassembly
+# -----------------------
+
+_disasm_cache = [None] * 0x10000
+
+
+def _disassembly_template(inst):
+    """Build the disassembly text for 'inst'; PC-relative targets are left as a '{}' field"""
+    opcode = inst & 0x7
+    funct3 = (inst >> 3) & 0x7
+    rd_rs1 = REG_NAMES[(inst >> 6) & 0x7]
+    rs2 = REG_NAMES[(inst >> 9) & 0x7]
+
+    if opcode == 0x0:
+        funct4 = (inst >> 12) & 0xF
+        if funct3 == 0x0:
+            if funct4 == 0x0:
+                return "add %s, %s" % (rd_rs1, rs2)
+            if funct4 == 0x1:
+                return "sub %s, %s" % (rd_rs1, rs2)
+            if funct4 == 0x4:
+                return "jr %s" % rs2
+            if funct4 == 0x8:
+                return "jalr %s" % rs2
+            return "Unknown R-type"
+        if funct3 == 0x3:
+            names = {0x2: "sll", 0x4: "srl", 0x8: "sra"}
+            if funct4 not in names:
+                return "Unknown shift"
+            return "%s %s, %s" % (names[funct4], rd_rs1, rs2)
+        names = {0x1: "slt", 0x2: "sltu", 0x4: "or", 0x5: "and", 0x6: "xor", 0x7: "mv"}
+        return "%s %s, %s" % (names[funct3], rd_rs1, rs2)
+
+    if opcode == 0x1:
+        imm7 = (inst >> 9) & 0x7F
+        if funct3 == 0x3:
+            names = {0x1: "slli", 0x2: "srli", 0x4: "srai"}
+            shift_type = (imm7 >> 4) & 0x7
+            if shift_type not in names:
+                return "Unknown shift immediate"
+            return "%s %s, %d" % (names[shift_type], rd_rs1, imm7 & 0xF)
+        names = ("addi", "slti", "sltui", None, "ori", "andi", "xori", "li")
+        simm = imm7 - 0x80 if imm7 & 0x40 else imm7
+        return "%s %s, %d" % (names[funct3], rd_rs1, simm)
+
+    if opcode == 0x2:
+        names = ("beq", "bne", "bz", "bnz", "blt", "bge", "bltu", "bgeu")
+        if funct3 in (0x2, 0x3):
+            return "%s %s, 0x{:04X}" % (names[funct3], rd_rs1)
+        return "%s %s, %s, 0x{:04X}" % (names[funct3], rd_rs1, rs2)
+
+    if opcode == 0x3:
+        names = {0x0: "sb", 0x1: "sw"}
+        if funct3 not in names:
+            return "Unknown S-type"
+        return "%s %s, %d(%s)" % (names[funct3], rs2, (inst >> 12) & 0xF, rd_rs1)
+
+    if opcode == 0x4:
+        names = {0x0: "lb", 0x1: "lw", 0x4: "lbu"}
+        if funct3 not in names:
+            return "Unknown L-type"
+        return "%s %s, %d(%s)" % (names[funct3], rd_rs1, (inst >> 12) & 0xF, rs2)
+
+    if opcode == 0x5:
+        if inst & 0x8000:
+            return "jal %s, 0x{:04X}" % rd_rs1
+        return "j 0x{:04X}"
+
+    if opcode == 0x6:
+        # z16sim.c decodes the U-type immediate differently when disassembling
+        # (6-bit imm_hi, shifted by 4) than when executing; keep both as-is.
+        imm = (((((inst >> 10) & 0x3F) << 6) | funct3) << 4) & 0xFFFF
+        name = "auipc" if inst & 0x8000 else "lui"
+        return "%s %s, 0x%04X" % (name, rd_rs1, imm)
+
+    return "ecall %d" % ((inst >> 6) & 0x3FF)
+
+
+def disassemble(inst, pc):
+    """Return the human-readable text of 'inst' fetched at address 'pc'"""
+    template = _disasm_cache[inst]
+    if template is None:
+        template = _disasm_cache[inst] = _disassembly_template(inst)
+    opcode = inst & 0x7
+    if opcode == 0x2 or opcode == 0x5:
+        return template.format((pc + decode_table()[inst][3]) & 0xFFFF)
+    return template
+
+
+# -----------------------
+# Profile
+# -----------------------
+
+# Hot spots listed by the --profile report
+PROFILE_HOT_SPOTS = 10
+
+
+class Profile:
+    """
+    Execution counts of a run: 'hits' (instructions retired) and 'taken'
+    (taken conditional branches) indexed by PC, and totals that classify
+    each executed PC by the instruction now in memory there
+    """
+
+    def __init__(self, hits, taken, memory, table):
+        self.hits = list(hits)
+        self.taken = list(taken)
+        self.insts = {}  # executed PC -> instruction word
+        self.instructions = self.loads = self.stores = 0
+        self.branches = self.branches_taken = 0
+        for pc in compress(range(MEM_SIZE), self.hits):
+            n = self.hits[pc]
+            inst = memory[pc] | (memory[(pc + 1) & 0xFFFF] << 8)
+            self.insts[pc] = inst
+            self.instructions += n
+            handler = table[inst][0]
+            if handler in _LOADS:
+                self.loads += n
+            elif handler in _STORE_SIZES:
+                self.stores += n
+            elif handler in _BRANCHES:
+                self.branches += n
+                self.branches_taken += self.taken[pc]
+
+    def is_branch(self, pc):
+        return pc in self.insts and decode_table()[self.insts[pc]][0] in _BRANCHES
+
+    def hot_spots(self, count=None):
+        """(pc, hits) of the most executed PCs, most first, ties by address"""
+        hits = self.hits
+        return [(pc, hits[pc]) for pc in sorted(self.insts, key=lambda pc: (-hits[pc], pc))[:count]]
+
+    def report(self, count=PROFILE_HOT_SPOTS):
+        """The text printed by --profile (the same as z16sim.c --profile)"""
+        lines = ["", "--- Profile ---",
+                 "Instructions: %d, loads: %d, stores: %d, branches: %d (%d taken, %d not taken)"
+                 % (self.instructions, self.loads, self.stores, self.branches,
+                    self.branches_taken, self.branches - self.branches_taken),
+                 "Hot spots:"]
+        for pc, n in self.hot_spots(count):
+            inst = self.insts[pc]
+            line = "  0x%04X %10d %5.1f%%  %s" % (pc, n, 100.0 * n / self.instructions, disassemble(inst, pc))
+            if self.is_branch(pc):
+                line += "  (taken %d, not taken %d)" % (self.taken[pc], n - self.taken[pc])
+            lines.append(line)
+        lines.append("---------------------------")
+        return "\n".join(lines) + "\n"
+
+
+# -----------------------
+# Simulator
+# -----------------------
+
+class Z16Simulator:
+    """Z16 machine state (registers, PC, 64KB memory) plus the run loop"""
+
+    def __init__(self, write=None, max_output=None):
+        self.memory = bytearray(MEM_SIZE)
+        self.regs = [0] * 8
+        self.pc = 0
+        self.instruction_count = 0
+        self.stop_reason = None
+        # Destination for ecall output; defaults to stdout
+        self.write = write if write is not None else sys.stdout.write
+        # Output budget in bytes (None = unlimited)
+        self.max_output = max_output
+        self.output_bytes = 0
+        self.output_exceeded = False
+        self.table = decode_table()
+        # Translated blocks by start PC, and one flag per memory byte they cover
+        self.blocks = [None] * MEM_SIZE
+        self.code = bytearray(MEM_SIZE)
+        self._block_ends = {}
+        # One flag per address with a breakpoint; blocks never run across one
+        self.breakpoints = bytearray(MEM_SIZE)
+        self.clear_profile()
+
+    def reset(self):
+        """Clear registers, PC, counters and the profile; memory is left untouched"""
+        self.regs[:] = [0] * 8
+        self.pc = 0
+        self.instruction_count = 0
+        self.stop_reason = None
+        self.output_bytes = 0
+        self.output_exceeded = False
+        self.clear_profile()
+
+    def clear_profile(self):
+        """
+        Zero the profile counters: instructions retired at each PC ('hits')
+        and taken conditional branches at each branch PC ('taken'). Flat
+        lists indexed by PC, so counting stays on for every run. Translated
+        blocks count whole passes by their start PC instead; those are added
+        to 'hits' when the block is dropped or the profile is read.
+        """
+        self.hits = [0] * MEM_SIZE
+        self.taken = [0] * MEM_SIZE
+        self._passes = [0] * MEM_SIZE
+        # (start, end) of dropped blocks whose passes are not in 'hits' yet
+        self._retired = []
+
+    def profile(self):
+        """Profile of the run so far (see Profile)"""
+        self._flush_profile()
+        return Profile(self.hits, self.taken, self.memory, self.table)
+
+    def swap_counters(self, counters=None):
+        """
+        Install other profile counters (as returned by an earlier call; None
+        = fresh ones) and return the current ones, so that instructions run
+        in between (e.g. a replay) do not show up in the profile
+        """
+        self._flush_profile()
+        current = (self.hits, self.taken, self._passes)
+        if counters is None:
+            counters = ([0] * MEM_SIZE, [0] * MEM_SIZE, [0] * MEM_SIZE)
+        self.hits, self.taken, self._passes = counters
+        return current
+
+    def _flush_profile(self):
+        self._flush_retired()
+        for pc, end in self._block_ends.items():
+            self._flush_passes(pc, end)
+
+    def _flush_passes(self, pc, end):
+        passes = self._passes[pc]
+        if passes:
+            hits = self.hits
+            for addr in range(pc, end, 2):
+                hits[addr] += passes
+            self._passes[pc] = 0
+
+    def _flush_retired(self):
+        # A store can drop the block it runs in; that pass is counted after
+        # the drop, so dropped blocks are flushed before the next translation
+        for pc, end in self._retired:
+            self._flush_passes(pc, end)
+        self._retired.clear()
+
+    def output(self, text):
+        """
+        Write ecall output, truncated to the output budget; returns False
+        once the budget is exceeded and the run has to stop
+        """
+        if self.max_output is not None and self.output_bytes + len(text) > self.max_output:
+            text = text[:self.max_output - self.output_bytes]
+            self.output_exceeded = True
+        self.output_bytes += len(text)
+        if text:
+            self.write(text)
+        return not self.output_exceeded
+
+    def load(self, image):
+        """Copy a binary image into memory starting at 0x0000 and reset the CPU"""
+        n = min(len(image), MEM_SIZE)
+        self.memory[:] = bytes(MEM_SIZE)
+        self.memory[:n] = image[:n]
+        self.invalidate(0, MEM_SIZE)
+        self.reset()
+        return n
+
+    def load_file(self, filename):
+        """Load a .bin file into memory; returns the number of bytes loaded"""
+        with open(filename, "rb") as fp:
+            return self.load(fp.read(MEM_SIZE))
+
+    def invalidate(self, start, end):
+        """
+        Drop translated blocks overlapping memory[start:end]. Stores do this
+        themselves; call it after writing self.memory directly.
+        """
+        code = self.code
+        if not any(code[start:end]):
+            return
+        lo, hi = start, end
+        for pc, block_end in list(self._block_ends.items()):
+            if pc < end and block_end > start:
+                self._retired.append((pc, block_end))
+                del self._block_ends[pc]
+                self.blocks[pc] = None
+                lo, hi = min(lo, pc), max(hi, block_end)
+        # Re-flag what the surviving blocks still cover in the cleared range
+        code[lo:hi] = bytes(hi - lo)
+        for pc, block_end in self._block_ends.items():
+            if pc < hi and block_end > lo:
+                code[pc:block_end] = b"\x01" * (block_end - pc)
+
+    def set_breakpoint(self, addr, enabled=True):
+        """
+        Set or clear a breakpoint: a run pauses with STOP_BREAKPOINT before
+        executing the instruction at 'addr' (even the first one it would
+        run; step() first to resume past it)
+        """
+        addr &= 0xFFFF
+        self.breakpoints[addr] = 1 if enabled else 0
+        # Blocks end before a breakpoint, so the ones spanning it are re-split
+        self.invalidate(addr, addr + 1)
+
+    def read_string(self, addr):
+        """Read a NULL-terminated string starting at 'addr'"""
+        mem = self.memory
+        end = mem.find(0, addr)
+        if end < 0:
+            # Wraps past the end of memory like the 16-bit address in z16sim.c
+            end = mem.find(0)
+            return (mem[addr:] + mem[:max(end, 0)]).decode("latin-1")
+        return mem[addr:end].decode("latin-1")
+
+    def fetch(self, pc=None):
+        """Fetch the 16-bit little-endian word at 'pc' (defaults to the current PC)"""
+        if pc is None:
+            pc = self.pc
+        return self.memory[pc] | (self.memory[(pc + 1) & 0xFFFF] << 8)
+
+    def step(self):
+        """Execute one instruction, breakpoint or not; returns False once the simulation has stopped"""
+        if self.stop_reason is not None:
+            return False
+        # Not worth translating a block for a single instruction
+        return self._interpret(1, None, False) is None
+
+    def run(self, max_instructions=MAX_INSTRUCTIONS, trace=None, deadline=None):
+        """
+        Run until a stop condition or until 'max_instructions' more instructions
+        have retired (None = no limit). 'trace' is called as trace(pc, inst)
+        before each instruction executes; without it the run executes
+        translated blocks (see translate_block). 'deadline' is a time.perf_counter()
+        value checked every WATCHDOG_INTERVAL instructions; once it has passed
+        the run stops with STOP_TIME_LIMIT. Returns the stop reason, or None
+        if the instruction budget ran out before the program stopped.
+        STOP_BREAKPOINT only pauses the run: it is not kept as stop_reason.
+        """
+        if self.stop_reason is not None:
+            return self.stop_reason
+        if max_instructions is None:
+            max_instructions = sys.maxsize
+        if deadline is None:
+            return self._run(max_instructions, trace)
+
+        # Watchdog: run in short slices and read the clock between them
+        remaining = max_instructions
+        while True:
+            n = min(remaining, WATCHDOG_INTERVAL)
+            reason = self._run(n, trace)
+            remaining -= n
+            if reason is not None or remaining <= 0:
+                return reason
+            if time.perf_counter() >= deadline:
+                self.stop_reason = STOP_TIME_LIMIT
+                return STOP_TIME_LIMIT
+
+    def _run(self, max_instructions, trace):
+        if trace is not None:
+            return self._interpret(max_instructions, trace)
+        return self._run_blocks(max_instructions)
+
+    def _run_blocks(self, max_instructions):
+        """Run translated blocks; the interpreter finishes what no block can run"""
+        blocks = self.blocks
+        regs = self.regs
+        mem = self.memory
+        code = self.code
+        breakpoints = self.breakpoints
+        passes = self._passes
+        taken = self.taken
+        pc = self.pc
+        count = 0
+        reason = None
+        while True:
+            if breakpoints[pc]:
+                reason = STOP_BREAKPOINT
+                break
+            block = blocks[pc]
+            if block is None:
+                block = self._translate(pc)
+                if block is None:
+                    break  # zero instruction or end of memory: the interpreter stops
+            function, length, target, branch_pc = block
+            if max_instructions - count < length:
+                break
+            next_pc, executed = function(regs, mem, code, self, max_instructions - count)
+            count += executed
+            if executed == length:
+                # One whole pass: the common case costs one counter
+                passes[pc] += 1
+                if next_pc == target:
+                    taken[branch_pc] += 1
+            else:
+                self._profile_passes(block, pc, next_pc, executed)
+            if next_pc is None:
+                pc = (pc + 2 * executed) & 0xFFFF  # the ecall that stopped the run
+                reason = STOP_OUTPUT_LIMIT if self.output_exceeded else STOP_ECALL
+                break
+            pc = next_pc
+        self.pc = pc
+        self.instruction_count += count
+        if reason is not None:
+            if reason != STOP_BREAKPOINT:
+                self.stop_reason = reason
+            return reason
+        return self._interpret(max_instructions - count, None)
+
+    def _profile_passes(self, block, pc, next_pc, executed):
+        """Profile a block call that was not one whole pass: loops, early exits, a stopping ecall"""
+        _, length, target, branch_pc = block
+        full, partial = divmod(executed, length)
+        self._passes[pc] += full
+        if full and target == pc:
+            # A loop block: every pass but a last not-taken one branched back
+            self.taken[branch_pc] += full - (next_pc != target and not partial)
+        hits = self.hits
+        for k in range(partial):
+            hits[pc + 2 * k] += 1
+
+    def _translate(self, pc):
+        """Translate the block starting at 'pc'; returns (function, length, target, branch_pc) or None"""
+        if self._retired:
+            self._flush_retired()
+        mem = self.memory
+        table = self.table
+        breakpoints = self.breakpoints
+        words = []
+        end = pc
+        while len(words) < MAX_BLOCK_LENGTH and end + 1 < MEM_SIZE:
+            if words and breakpoints[end]:
+                break
+            inst = mem[end] | (mem[end + 1] << 8)
+            if inst == 0:
+                break
+            words.append(inst)
+            end += 2
+            if table[inst][0] in _BLOCK_ENDS:
+                break
+        if not words:
+            return None
+        # Where the last instruction goes when it is a taken conditional branch
+        # (-1 if it is not one); a branch to the next word counts as not taken
+        branch_pc = end - 2
+        handler, _, _, imm = table[words[-1]]
+        target = (branch_pc + imm) & 0xFFFF if handler in _BRANCHES and imm != 2 else -1
+        block = (translate_block(pc, words), len(words), target, branch_pc)
+        self.blocks[pc] = block
+        self._block_ends[pc] = end
+        self.code[pc:end] = b"\x01" * (end - pc)
+        return block
+
+    def _interpret(self, max_instructions, trace, breaks=True):
+        """Execute one decoded instruction at a time, calling 'trace' before each"""
+        table = self.table
+        mem = self.memory
+        breakpoints = self.breakpoints if breaks else _NO_BREAKPOINTS
+        hits = self.hits
+        taken = self.taken
+        pc = self.pc
+        count = 0
+        reason = None
+        while count < max_instructions:
+            if breakpoints[pc]:
+                reason = STOP_BREAKPOINT
+                break
+            # Check if we're about to read past memory bounds
+            if pc + 1 >= MEM_SIZE:
+                reason = STOP_END_OF_MEMORY
+                break
+            inst = mem[pc] | (mem[pc + 1] << 8)
+            # Zero instruction is treated as a halt condition
+            if inst == 0:
+                reason = STOP_ZERO_INSTRUCTION
+                break
+            if trace is not None:
+                trace(pc, inst)
+            handler, a, b, imm = table[inst]
+            next_pc = handler(self, pc, a, b, imm)
+            if next_pc is None:
+                reason = STOP_OUTPUT_LIMIT if self.output_exceeded else STOP_ECALL
+                break
+            hits[pc] += 1
+            if next_pc != (pc + 2) & 0xFFFF and handler in _BRANCHES:
+                taken[pc] += 1
+            pc = next_pc
+            count += 1
+        self.pc = pc
+        self.instruction_count += count
+        if reason != STOP_BREAKPOINT:
+            self.stop_reason = reason
+        return reason
+
+    def effects(self, inst):
+        """
+        Describe what 'inst' wrote when it was the last instruction executed:
+        (rd, value, mem_addr, mem_value, mem_size), with rd -1 if no register
+        was written and mem_size 0 if nothing was stored
+        """
+        handler, a, b, imm = self.table[inst]
+        regs = self.regs
+        rd, value = (a, regs[a]) if handler in _WRITES_REGISTER else (-1, 0)
+        size = _STORE_SIZES.get(handler, 0)
+        if size:
+            # Stores never change registers, so the address can be recomputed afterwards
+            mask = 0xFF if size == 1 else 0xFFFF
+            return rd, value, (regs[a] + imm) & 0xFFFF, regs[b] & mask, size
+        return rd, value, 0, 0, 0
+
+    def register_state(self):
+        """Return the final register dump in the same format as printRegisterState()"""
+        return register_state(self.regs, self.pc)
+
+
+def register_state(regs, pc):
+    """Format registers and PC the way printRegisterState() in z16sim.c does"""
+    lines = ["", "--- Final Register State ---"]
+    for i, name in enumerate(REG_NAMES):
+        lines.append("%s (x%d): 0x%04X (%d)" % (name, i, regs[i], to_signed(regs[i])))
+    lines.append("PC: 0x%04X" % pc)
+    lines.append("---------------------------")
+    return "\n".join(lines) + "\n"
+
+
+def describe_stop(reason, pc, count=0, budget=DEFAULT_BUDGET):
+    """Return the message z16sim.c prints when a run stops for 'reason'"""
+    if reason == STOP_ECALL:
+        return "Simulation terminated by ecall\n"
+    if reason == STOP_ZERO_INSTRUCTION:
+        return "Encountered zero instruction at 0x%04X\n" % pc
+    if reason == STOP_END_OF_MEMORY:
+        return "Reached end of memory at 0x%04X\n" % pc
+    if reason == STOP_TIME_LIMIT:
+        return ("Simulation terminated: Exceeded time limit (%g s) at 0x%04X after %d instructions\n"
+                % (budget.seconds, pc, count))
+    if reason == STOP_OUTPUT_LIMIT:
+        return ("Simulation terminated: Exceeded output limit (%d bytes) at 0x%04X after %d instructions\n"
+                % (budget.output, pc, count))
+    if reason == STOP_BREAKPOINT:
+        return "Breakpoint at 0x%04X after %d instructions\n" % (pc, count)
+    return "Simulation terminated: Exceeded maximum instruction count (%d)\n" % budget.instructions
+
+
+def describe_summary(count, seconds):
+    """Summary printed after a --fast run"""
+    return "Executed %d instructions in %.3f ms\n" % (count, seconds * 1000)
+
+
+def parse_budget_option(arg, budget):
+    """
+    Apply a --max-instructions=N, --timeout=SECONDS or --max-output=BYTES
+    option to 'budget' (0 = unlimited). Returns the new Budget, or None if
+    'arg' is not a budget option; raises ValueError for a bad value.
+    """
+    name, _, value = arg.partition("=")
+    if name == "--max-instructions":
+        limit = int(value)
+        field = "instructions"
+    elif name == "--timeout":
+        limit = float(value)
+        field = "seconds"
+    elif name == "--max-output":
+        limit = int(value)
+        field = "output"
+    else:
+        return None
+    if limit < 0:
+        raise ValueError("negative budget")
+    return budget._replace(**{field: limit or None})
+
+
+def main(argv):
+    usage = ("Usage: %s [--trace=text|binary|ndjson] [--fast] [--profile] [--max-instructions=N] "
+             "[--timeout=SECONDS] [--max-output=BYTES] [--save-snapshot=FILE] "
+             "<machine_code_file_name | --resume=SNAPSHOT>\n" % argv[0])
+    trace_format = "text"
+    fast = False
+    profile = False
+    budget = DEFAULT_BUDGET
+    filename = None
+    resume = None
+    save = None
+    for arg in argv[1:]:
+        try:
+            new_budget = parse_budget_option(arg, budget)
+        except ValueError:
+            filename = None
+            break
+        if new_budget is not None:
+            budget = new_budget
+        elif arg.startswith("--trace=") and arg[len("--trace="):] in ("text", "binary", "ndjson"):
+            trace_format = arg[len("--trace="):]
+        elif arg == "--fast":
+            fast = True
+        elif arg == "--profile":
+            profile = True
+        elif arg.startswith("--resume=") and resume is None and filename is None:
+            resume = arg[len("--resume="):]
+        elif arg.startswith("--save-snapshot="):
+            save = arg[len("--save-snapshot="):]
+        elif filename is None and resume is None and not arg.startswith("--"):
+            filename = arg
+        else:
+            filename = resume = None
+            break
+    if not (filename or resume):
+        sys.stderr.write(usage)
+        return 1
+
+    sim = Z16Simulator(max_output=budget.output)
+    if resume:
+        from z16snapshot import Snapshot, SnapshotError
+        try:
+            Snapshot.load(resume).restore(sim)
+        except OSError as e:
+            sys.stderr.write("Error opening snapshot file: %s\n" % e.strerror)
+            return 1
+        except SnapshotError as e:
+            sys.stderr.write("Error reading snapshot file: %s\n" % e)
+            return 1
+        n = MEM_SIZE
+    else:
+        try:
+            n = sim.load_file(filename)
+        except OSError as e:
+            sys.stderr.write("Error opening binary file: %s\n" % e.strerror)
+            return 1
+    if trace_format != "text":
+        status = _run_structured(sim, n, trace_format, fast, budget)
+        if profile:
+            sys.stderr.write(sim.profile().report())
+        return _save_snapshot(sim, save) if save else status
+    if resume:
+        print("Resumed from snapshot at 0x%04X after %d instructions" % (sim.pc, sim.instruction_count))
+    else:
+        print("Loaded %d bytes into memory" % n)
+    start_count = sim.instruction_count
+
+    def trace(pc, inst):
+        sys.stdout.write("0x%04X: %04X %s\n" % (pc, inst, disassemble(inst, pc)))
+
+    # --fast skips the per-instruction trace: only ecall output and the final state are printed
+    reason, elapsed = _run_budgeted(sim, budget, None if fast else trace)
+    # Only the ecall message goes to stdout, the other stop conditions are reported on stderr
+    sys.stdout.flush()
+    (sys.stdout if reason == STOP_ECALL else sys.stderr).write(
+        describe_stop(reason, sim.pc, sim.instruction_count, budget))
+    sys.stdout.write(sim.register_state())
+    if fast:
+        sys.stdout.write(describe_summary(sim.instruction_count - start_count, elapsed))
+    if profile:
+        sys.stdout.write(sim.profile().report())
+    return _save_snapshot(sim, save) if save else 0
+
+
+def _save_snapshot(sim, filename):
+    from z16snapshot import Snapshot
+
+    sys.stdout.flush()
+    try:
+        Snapshot.capture(sim).save(filename)
+    except OSError as e:
+        sys.stderr.write("Error writing snapshot file: %s\n" % e.strerror)
+        return 1
+    return 0
+
+
+def _run_budgeted(sim, budget, trace):
+    """Run under 'budget'; returns (stop reason, elapsed seconds)"""
+    start = time.perf_counter()
+    deadline = start + budget.seconds if budget.seconds else None
+    reason = sim.run(budget.instructions, trace, deadline)
+    return reason, time.perf_counter() - start
+
+
+def _run_structured(sim, loaded, trace_format, fast, budget):
+    """Run with binary/NDJSON trace records on stdout (see z16trace); --fast omits step records"""
+    from z16trace import encoder_for, StepRecorder
+
+    sys.stdout.flush()
+    encoder = encoder_for(trace_format, sys.stdout.buffer.write)
+    sim.write = encoder.output
+    encoder.load(loaded)
+    if fast:
+        reason, _ = _run_budgeted(sim, budget, None)
+    else:
+        recorder = StepRecorder(sim, encoder)
+        reason, _ = _run_budgeted(sim, budget, recorder.trace)
+        recorder.flush()
+    if reason != STOP_ECALL:
+        sys.stderr.write(describe_stop(reason, sim.pc, sim.instruction_count, budget))
+    encoder.final(reason, sim.pc, sim.instruction_count, sim.regs)
+    sys.stdout.buffer.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,141 @@
+"""
+Z16 machine snapshots
+
+A snapshot is a paused machine: registers, PC, the number of instructions
+it has retired and its 64KB of memory. Resuming one continues the program
+where it stopped, so a long setup phase can be run once and every later
+run (or any number of forks) started from the warmed-up state.
+
+Memory is stored as 256-byte pages. Identical pages are stored once and
+all-zero pages not at all, so a snapshot of a small program is a few KB:
+
+    offset 0     "Z16S"              magic
+           4     uint16 version      1
+           6     uint16 pool         number of stored pages
+           8     uint64 count        instructions retired
+           16    uint16 pc
+           18    uint16 regs[8]      x0..x7
+           64    uint16 dir[256]     memory page i is pool page dir[i]-1 (0 = all zeros)
+           1024  pool pages          256 bytes each
+
+all little-endian, unused bytes zero. The pool starts on a page boundary,
+so it can be used in place: load() maps the file read-only with mmap and
+the snapshot's pages are views into the mapping. Restoring copies a page
+only into the simulator that resumes, and forks restored from one
+snapshot share its mapped pages.
+
+z16sim.c reads and writes the same format (--resume, --save-snapshot).
+"""
+
+import mmap
+import struct
+
+from z16sim import MEM_SIZE
+
+MAGIC = b"Z16S"
+VERSION = 1
+PAGE_SIZE = 256
+PAGES = MEM_SIZE // PAGE_SIZE
+
+_HEADER = struct.Struct("<4sHHQH8H")
+_DIRECTORY = struct.Struct("<%dH" % PAGES)
+DIRECTORY_OFFSET = 64
+POOL_OFFSET = 1024
+
+
+class SnapshotError(Exception):
+    """A snapshot file is malformed"""
+
+
+class Snapshot:
+    """
+    Machine state with deduplicated memory pages: page i of memory is
+    pool[directory[i] - 1], or zeros when directory[i] is 0
+    """
+
+    def __init__(self, regs, pc, count, directory, pool):
+        self.regs = tuple(regs)
+        self.pc = pc
+        self.count = count
+        self.directory = tuple(directory)
+        self.pool = pool  # bytes-like pages, each PAGE_SIZE long
+
+    @classmethod
+    def capture(cls, sim):
+        """Snapshot of a simulator's current state"""
+        memory = sim.memory
+        index = {}
+        pool = []
+        directory = []
+        for page in range(0, MEM_SIZE, PAGE_SIZE):
+            data = bytes(memory[page:page + PAGE_SIZE])
+            if not any(data):
+                directory.append(0)
+                continue
+            if data not in index:
+                pool.append(data)
+                index[data] = len(pool)
+            directory.append(index[data])
+        return cls(sim.regs, sim.pc, sim.instruction_count, directory, pool)
+
+    def page(self, number):
+        """Contents of memory page 'number' (None for an all-zero page)"""
+        entry = self.directory[number]
+        return self.pool[entry - 1] if entry else None
+
+    def memory(self):
+        """The full 64KB memory image"""
+        image = bytearray(MEM_SIZE)
+        for number in range(PAGES):
+            data = self.page(number)
+            if data is not None:
+                image[number * PAGE_SIZE:(number + 1) * PAGE_SIZE] = data
+        return image
+
+    def restore(self, sim):
+        """Put 'sim' in the snapshot's state, ready to resume (its profile starts empty)"""
+        sim.load(self.memory())
+        sim.regs[:] = self.regs
+        sim.pc = self.pc
+        sim.instruction_count = self.count
+
+    # --- Snapshot files ---
+
+    def to_bytes(self):
+        header = _HEADER.pack(MAGIC, VERSION, len(self.pool), self.count, self.pc, *self.regs)
+        directory = _DIRECTORY.pack(*self.directory)
+        return b"".join([header, bytes(DIRECTORY_OFFSET - len(header)), directory,
+                         bytes(POOL_OFFSET - DIRECTORY_OFFSET - len(directory))] + list(self.pool))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Snapshot over 'data' (bytes, or an mmap whose pages it keeps views of)"""
+        if len(data) < POOL_OFFSET or data[:4] != MAGIC:
+            raise SnapshotError("not a Z16 snapshot")
+        _, version, pool_size, count, pc, *regs = _HEADER.unpack_from(data, 0)
+        if version != VERSION:
+            raise SnapshotError(f"unsupported snapshot version {version}")
+        if pool_size > PAGES or len(data) < POOL_OFFSET + pool_size * PAGE_SIZE:
+            raise SnapshotError("truncated snapshot")
+        directory = _DIRECTORY.unpack_from(data, DIRECTORY_OFFSET)
+        if max(directory) > pool_size:
+            raise SnapshotError("snapshot page directory is out of range")
+        view = memoryview(data)
+        pool = [view[offset:offset + PAGE_SIZE]
+                for offset in range(POOL_OFFSET, POOL_OFFSET + pool_size * PAGE_SIZE, PAGE_SIZE)]
+        return cls(regs, pc, count, directory, pool)
+
+    def save(self, filename):
+        with open(filename, "wb") as fp:
+            fp.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, filename):
+        """Map a snapshot file; raises OSError or SnapshotError"""
+        with open(filename, "rb") as fp:
+            fp.seek(0, 2)
+            if fp.tell() < POOL_OFFSET:
+                raise SnapshotError("not a Z16 snapshot")
+            # The mapping stays alive as long as the snapshot's page views do
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls.from_bytes(data)
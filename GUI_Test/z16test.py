@@ -0,0 +1,313 @@
+"""
+Z16 regression runner
+
+Assembles and simulates every test program in a process pool, without the
+GUI, and checks the result against the expectations the program declares
+in its header comments:
+
+    # Expected output: 10, 30, 50
+    # Expected registers: a0 = 42, sp = 0x1000, pc = 0x0012
+
+The output may also be given as a list, one value per comment line:
+
+    # Expected output:
+    # 1
+    # 16
+
+Output is compared as a sequence of tokens (whitespace and commas only
+separate values), so "10, 30" matches the two ecall 1 lines "10" and "30".
+Register values are compared as 16-bit numbers. A test without
+expectations (every .bin file, for instance) passes when it assembles and
+halts on its own, by ecall or a zero instruction, within the budget.
+
+Usage:
+python z16test.py [-j <jobs>] [-x] [-v] [--junit <report.xml>] [--max-instructions=N]
+                  [--timeout=SECONDS] [--max-output=BYTES] [test files or directories...]
+
+-j runs that many worker processes (default: one per CPU), -x stops at the
+first failure, -v prints each failing test's output. Without paths the
+tests/ directory of the repository is run. The exit status is 1 if any
+test failed.
+"""
+
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from xml.etree import ElementTree
+
+from z16asm import AssemblerError, assemble
+from z16sim import (Z16Simulator, DEFAULT_BUDGET, REG_NAMES, STOP_ECALL, STOP_ZERO_INSTRUCTION,
+                    describe_stop, parse_budget_option)
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests")
+TEST_EXTENSIONS = (".asm", ".s", ".bin")
+
+PASSED, FAILED, ERROR, SKIPPED = "passed", "failed", "error", "skipped"
+
+_EXPECTED = re.compile(r"#\s*Expected\s+(output|registers)\s*:(.*)", re.IGNORECASE)
+_REGISTER = re.compile(r"([A-Za-z]\w*)\s*=\s*(-?\w+)")
+
+Expectation = namedtuple("Expectation", "output registers")
+TestResult = namedtuple("TestResult", "path status message output regs pc count seconds")
+
+
+# -----------------------
+# Expectations
+# -----------------------
+
+def output_tokens(text):
+    """Split program output (or an expected-output declaration) into values"""
+    return text.replace(",", " ").split()
+
+
+def parse_expectations(source):
+    """
+    Read the 'Expected output' / 'Expected registers' declarations from the
+    comment block at the top of a source file. Returns an Expectation whose
+    fields are None when not declared; raises ValueError for a bad register.
+    """
+    output = None
+    registers = None
+    listing = None  # collecting a one-value-per-line output list
+    for line in source.splitlines():
+        line = line.strip()
+        if not line.startswith("#"):
+            if line:
+                break  # end of the header
+            listing = None
+            continue
+        match = _EXPECTED.match(line)
+        if match:
+            kind, rest = match.group(1).lower(), match.group(2).strip()
+            if kind == "output":
+                output = output_tokens(rest)
+                listing = None if rest else output
+            else:
+                registers = _parse_registers(rest)
+                listing = None
+        elif listing is not None:
+            value = line.lstrip("#").strip()
+            if not value:
+                listing = None
+            else:
+                listing.extend(output_tokens(value))
+    return Expectation(output, registers)
+
+
+def _parse_registers(text):
+    registers = {}
+    for name, value in _REGISTER.findall(text):
+        name = name.lower()
+        if name not in REG_NAMES and name != "pc":
+            raise ValueError("unknown register '%s' in expectations" % name)
+        registers[name] = int(value, 0) & 0xFFFF
+    return registers
+
+
+# -----------------------
+# Running One Test
+# -----------------------
+
+def run_test(path, budget=DEFAULT_BUDGET):
+    """Assemble (for sources) and simulate one test file; runs in a worker process"""
+    start = time.perf_counter()
+    output = []
+
+    def result(status, message, simulator=None):
+        regs = tuple(simulator.regs) if simulator else ()
+        pc = simulator.pc if simulator else 0
+        count = simulator.instruction_count if simulator else 0
+        return TestResult(path, status, message, "".join(output), regs, pc, count,
+                          time.perf_counter() - start)
+
+    try:
+        if path.endswith(".bin"):
+            with open(path, "rb") as fp:
+                image = fp.read()
+            expectation = Expectation(None, None)
+        else:
+            with open(path, "r", newline="") as fp:
+                source = fp.read()
+            expectation = parse_expectations(source)
+            image = assemble(source).image
+    except (OSError, ValueError, AssemblerError) as e:
+        return result(ERROR, str(e))
+
+    simulator = Z16Simulator(write=output.append, max_output=budget.output)
+    simulator.load(image)
+    deadline = start + budget.seconds if budget.seconds else None
+    reason = simulator.run(budget.instructions, None, deadline)
+    if reason not in (STOP_ECALL, STOP_ZERO_INSTRUCTION):
+        return result(FAILED, describe_stop(reason, simulator.pc, simulator.instruction_count,
+                                            budget).strip(), simulator)
+
+    problems = []
+    if expectation.output is not None:
+        actual = output_tokens("".join(output))
+        if actual != expectation.output:
+            problems.append("output: expected %s, got %s"
+                            % (" ".join(expectation.output), " ".join(actual) or "nothing"))
+    for name, value in (expectation.registers or {}).items():
+        actual = simulator.pc if name == "pc" else simulator.regs[REG_NAMES.index(name)]
+        if actual != value:
+            problems.append("%s: expected 0x%04X, got 0x%04X" % (name, value, actual))
+    if problems:
+        return result(FAILED, "; ".join(problems), simulator)
+    return result(PASSED, "", simulator)
+
+
+# -----------------------
+# Test Session
+# -----------------------
+
+def discover(paths):
+    """Test files named by 'paths' (files, or directories searched non-recursively), sorted"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(TEST_EXTENSIONS))
+        else:
+            found.append(path)
+    return found
+
+
+def run_tests(paths, jobs=None, budget=DEFAULT_BUDGET, fail_fast=False, on_result=None):
+    """
+    Run the test files in 'paths' on 'jobs' worker processes (None = one per
+    CPU, 1 = in this process) and return their TestResults in input order.
+    'on_result' is called with each result as it completes. With 'fail_fast'
+    no new test starts after the first failure; the ones that never ran are
+    reported as skipped.
+    """
+    results = {}
+
+    def finished(result):
+        results[result.path] = result
+        if on_result is not None:
+            on_result(result)
+        return fail_fast and result.status in (FAILED, ERROR)
+
+    if jobs == 1:
+        for path in paths:
+            if finished(run_test(path, budget)):
+                break
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            pending = {pool.submit(run_test, path, budget) for path in paths}
+            stop = False
+            while pending and not stop:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stop = finished(future.result()) or stop
+            for future in pending:
+                if not future.cancel():
+                    finished(future.result())  # already running: let it report
+
+    return [results.get(path) or TestResult(path, SKIPPED, "not run (fail-fast)", "", (), 0, 0, 0.0)
+            for path in paths]
+
+
+def junit_report(results, seconds):
+    """Build a JUnit-style XML report (one testsuite) as bytes"""
+    suite = ElementTree.Element("testsuite", {
+        "name": "z16",
+        "tests": str(len(results)),
+        "failures": str(sum(r.status == FAILED for r in results)),
+        "errors": str(sum(r.status == ERROR for r in results)),
+        "skipped": str(sum(r.status == SKIPPED for r in results)),
+        "time": "%.3f" % seconds,
+    })
+    for r in results:
+        case = ElementTree.SubElement(suite, "testcase", {
+            "classname": os.path.basename(os.path.dirname(os.path.abspath(r.path))),
+            "name": os.path.basename(r.path),
+            "time": "%.3f" % r.seconds,
+        })
+        if r.status == FAILED:
+            ElementTree.SubElement(case, "failure", {"message": r.message}).text = r.message
+        elif r.status == ERROR:
+            ElementTree.SubElement(case, "error", {"message": r.message}).text = r.message
+        elif r.status == SKIPPED:
+            ElementTree.SubElement(case, "skipped", {"message": r.message})
+        if r.output:
+            ElementTree.SubElement(case, "system-out").text = r.output
+        if r.regs:
+            registers = " ".join("%s=0x%04X" % (name, value) for name, value in zip(REG_NAMES, r.regs))
+            ElementTree.SubElement(case, "properties").extend([
+                ElementTree.Element("property", {"name": "registers", "value": registers}),
+                ElementTree.Element("property", {"name": "pc", "value": "0x%04X" % r.pc}),
+                ElementTree.Element("property", {"name": "instructions", "value": str(r.count)}),
+            ])
+    return ElementTree.tostring(suite, encoding="utf-8", xml_declaration=True)
+
+
+def main(argv):
+    usage = ("Usage: %s [-j <jobs>] [-x] [-v] [--junit <report.xml>] [--max-instructions=N] "
+             "[--timeout=SECONDS] [--max-output=BYTES] [test files or directories...]\n" % argv[0])
+    jobs = None
+    fail_fast = False
+    verbose = False
+    junit = None
+    budget = DEFAULT_BUDGET
+    paths = []
+    args = iter(argv[1:])
+    for arg in args:
+        try:
+            new_budget = parse_budget_option(arg, budget)
+            if new_budget is not None:
+                budget = new_budget
+            elif arg == "-j":
+                jobs = int(next(args, ""))
+                if jobs < 1:
+                    raise ValueError("jobs")
+            elif arg in ("-x", "--fail-fast"):
+                fail_fast = True
+            elif arg == "-v":
+                verbose = True
+            elif arg == "--junit":
+                junit = next(args, None)
+                if junit is None:
+                    raise ValueError("report")
+            elif arg.startswith("-"):
+                raise ValueError(arg)
+            else:
+                paths.append(arg)
+        except ValueError:
+            sys.stderr.write(usage)
+            return 1
+
+    files = discover(paths or [TESTS_DIR])
+    if not files:
+        sys.stderr.write("Error: no test files found\n")
+        return 1
+
+    def report(result):
+        print("%-7s %s (%.3f s)" % (result.status.upper(), os.path.basename(result.path), result.seconds))
+        if result.message:
+            print("        " + result.message)
+        if verbose and result.status != PASSED and result.output:
+            print("        output: " + result.output.rstrip("\n").replace("\n", "\n                "))
+
+    start = time.perf_counter()
+    results = run_tests(files, jobs, budget, fail_fast, report)
+    elapsed = time.perf_counter() - start
+    for r in results:
+        if r.status == SKIPPED:
+            report(r)
+
+    counts = {status: sum(r.status == status for r in results)
+              for status in (PASSED, FAILED, ERROR, SKIPPED)}
+    print("\n%d passed, %d failed, %d errors, %d skipped in %.3f s"
+          % (counts[PASSED], counts[FAILED], counts[ERROR], counts[SKIPPED], elapsed))
+    if junit is not None:
+        with open(junit, "wb") as fp:
+            fp.write(junit_report(results, elapsed))
+    return 1 if counts[FAILED] or counts[ERROR] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
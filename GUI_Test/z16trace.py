@@ -0,0 +1,295 @@
+"""
+Z16 structured trace protocol
+
+z16sim (both z16sim.c and z16sim.py) prints a human-readable trace by
+default. With --trace=binary or --trace=ndjson it writes one record per
+executed instruction instead, plus records for program output and the
+final machine state, so frontends never have to scrape text.
+
+Record kinds:
+- load:   number of bytes loaded into memory
+- step:   pc, inst, destination register and its new value, store address,
+          stored value and store size (0 = no store)
+- output: text printed by an ecall (emitted before the ecall's step record)
+- final:  stop reason, pc, retired instruction count, registers x0..x7
+          (reason codes: 0 ecall, 1 zero instruction, 2 end of memory,
+          3 instruction limit, 4 time limit, 5 output limit)
+
+Binary stream: the 5-byte header b"Z16T" + version, then records. Each
+record starts with its tag byte and is little-endian:
+  'L' u32 bytes
+  'S' u16 pc, u16 inst, i8 rd (-1 = none), u16 value,
+      u16 mem_addr, u16 mem_value, u8 mem_size
+  'O' u32 length, then 'length' bytes of latin-1 text
+  'F' u8 reason, u16 pc, u32 count, 8 x u16 regs
+
+NDJSON stream: one object per line with a "type" key of "load", "step",
+"output" or "final". Step records only carry "rd"/"value" when a
+register is written, and "mem_addr"/"mem_value"/"mem_size" when memory
+is written.
+
+The decoders are incremental: feed() accepts arbitrary chunks (for
+example whatever a pipe read returned) and yields only complete records,
+so a record split across two reads is never misparsed.
+"""
+
+import json
+import struct
+from collections import namedtuple
+
+from z16sim import (STOP_ECALL, STOP_ZERO_INSTRUCTION, STOP_END_OF_MEMORY,
+                    STOP_TIME_LIMIT, STOP_OUTPUT_LIMIT)
+
+TRACE_TEXT = "text"
+TRACE_BINARY = "binary"
+TRACE_NDJSON = "ndjson"
+TRACE_FORMATS = (TRACE_TEXT, TRACE_BINARY, TRACE_NDJSON)
+
+MAGIC = b"Z16T"
+VERSION = 1
+
+# Binary record layouts (tag byte included)
+LOAD_RECORD = struct.Struct("<cI")
+STEP_RECORD = struct.Struct("<cHHbHHHB")
+OUTPUT_HEADER = struct.Struct("<cI")
+FINAL_RECORD = struct.Struct("<cBHI8H")
+
+# Stop reasons on the wire; None (instruction limit) is encoded as 3
+_REASON_CODES = {STOP_ECALL: 0, STOP_ZERO_INSTRUCTION: 1, STOP_END_OF_MEMORY: 2, None: 3,
+                 STOP_TIME_LIMIT: 4, STOP_OUTPUT_LIMIT: 5}
+_REASONS = {code: reason for reason, code in _REASON_CODES.items()}
+_REASON_NAMES = {None: "instruction limit"}
+
+Load = namedtuple("Load", "size")
+Step = namedtuple("Step", "pc inst rd value mem_addr mem_value mem_size")
+Output = namedtuple("Output", "text")
+Final = namedtuple("Final", "reason pc count regs")
+
+
+class TraceFormatError(Exception):
+    """The stream does not follow the trace protocol"""
+
+
+# -----------------------
+# Encoders
+# -----------------------
+
+class BinaryTraceEncoder:
+    """Writes records in the binary format to 'write' (a bytes sink)"""
+
+    def __init__(self, write):
+        self.write = write
+        write(MAGIC + bytes((VERSION,)))
+
+    def load(self, size):
+        self.write(LOAD_RECORD.pack(b"L", size))
+
+    def step(self, pc, inst, rd=-1, value=0, mem_addr=0, mem_value=0, mem_size=0):
+        self.write(STEP_RECORD.pack(b"S", pc, inst, rd, value, mem_addr, mem_value, mem_size))
+
+    def output(self, text):
+        data = text.encode("latin-1")
+        self.write(OUTPUT_HEADER.pack(b"O", len(data)) + data)
+
+    def final(self, reason, pc, count, regs):
+        # Unlimited runs can outgrow the u32 count; it saturates
+        self.write(FINAL_RECORD.pack(b"F", _REASON_CODES[reason], pc, min(count, 0xFFFFFFFF), *regs))
+
+
+class NDJSONTraceEncoder:
+    """Writes records as JSON lines to 'write' (a bytes sink)"""
+
+    def __init__(self, write):
+        self.write = write
+
+    def _record(self, record):
+        self.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+
+    def load(self, size):
+        self._record({"type": "load", "bytes": size})
+
+    def step(self, pc, inst, rd=-1, value=0, mem_addr=0, mem_value=0, mem_size=0):
+        record = {"type": "step", "pc": pc, "inst": inst}
+        if rd >= 0:
+            record["rd"] = rd
+            record["value"] = value
+        if mem_size:
+            record["mem_addr"] = mem_addr
+            record["mem_value"] = mem_value
+            record["mem_size"] = mem_size
+        self._record(record)
+
+    def output(self, text):
+        self._record({"type": "output", "text": text})
+
+    def final(self, reason, pc, count, regs):
+        self._record({"type": "final", "reason": _REASON_NAMES.get(reason, reason),
+                      "pc": pc, "count": count, "regs": list(regs)})
+
+
+def encoder_for(fmt, write):
+    if fmt == TRACE_BINARY:
+        return BinaryTraceEncoder(write)
+    if fmt == TRACE_NDJSON:
+        return NDJSONTraceEncoder(write)
+    raise ValueError("no structured encoder for trace format %r" % fmt)
+
+
+class StepRecorder:
+    """
+    Turns Z16Simulator.run() trace callbacks into step records. The callback
+    fires before an instruction executes, so each instruction's record is
+    written when the next one is fetched (or on flush()), once its effects
+    are visible in the machine state.
+    """
+
+    def __init__(self, simulator, encoder):
+        self.simulator = simulator
+        self.encoder = encoder
+        self._pending = None
+
+    def trace(self, pc, inst):
+        if self._pending is not None:
+            self.flush()
+        self._pending = (pc, inst)
+
+    def flush(self):
+        """Write the record of the last executed instruction, if not written yet"""
+        if self._pending is not None:
+            pc, inst = self._pending
+            self._pending = None
+            self.encoder.step(pc, inst, *self.simulator.effects(inst))
+
+
+# -----------------------
+# Streaming Decoders
+# -----------------------
+
+class BinaryTraceDecoder:
+    """Incremental decoder for the binary format"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._header = False
+
+    def feed(self, data):
+        """Append a chunk of the stream; returns the records it completed"""
+        buf = self._buffer
+        buf += data
+        if not self._header:
+            if len(buf) < len(MAGIC) + 1:
+                return []
+            if buf[:len(MAGIC)] != MAGIC or buf[len(MAGIC)] != VERSION:
+                raise TraceFormatError("not a Z16 trace stream (version %d)" % VERSION)
+            del buf[:len(MAGIC) + 1]
+            self._header = True
+
+        records = []
+        pos = 0
+        end = len(buf)
+        step_size = STEP_RECORD.size
+        while pos < end:
+            tag = buf[pos]
+            if tag == 0x53:  # 'S'
+                if end - pos < step_size:
+                    break
+                _, pc, inst, rd, value, mem_addr, mem_value, mem_size = \
+                    STEP_RECORD.unpack_from(buf, pos)
+                records.append(Step(pc, inst, rd, value, mem_addr, mem_value, mem_size))
+                pos += step_size
+            elif tag == 0x4F:  # 'O'
+                if end - pos < OUTPUT_HEADER.size:
+                    break
+                length = OUTPUT_HEADER.unpack_from(buf, pos)[1]
+                start = pos + OUTPUT_HEADER.size
+                if end - start < length:
+                    break
+                records.append(Output(bytes(buf[start:start + length]).decode("latin-1")))
+                pos = start + length
+            elif tag == 0x4C:  # 'L'
+                if end - pos < LOAD_RECORD.size:
+                    break
+                records.append(Load(LOAD_RECORD.unpack_from(buf, pos)[1]))
+                pos += LOAD_RECORD.size
+            elif tag == 0x46:  # 'F'
+                if end - pos < FINAL_RECORD.size:
+                    break
+                fields = FINAL_RECORD.unpack_from(buf, pos)
+                if fields[1] not in _REASONS:
+                    raise TraceFormatError("unknown stop reason %d" % fields[1])
+                records.append(Final(_REASONS[fields[1]], fields[2], fields[3], fields[4:]))
+                pos += FINAL_RECORD.size
+            else:
+                raise TraceFormatError("unknown record tag 0x%02X" % tag)
+        del buf[:pos]
+        return records
+
+    def close(self):
+        """Signal end of stream; raises if it stopped in the middle of a record"""
+        if self._buffer:
+            raise TraceFormatError("trace stream ends inside a record")
+
+
+class NDJSONTraceDecoder:
+    """Incremental decoder for the JSON-lines format"""
+
+    def __init__(self):
+        self._partial = b""
+
+    def feed(self, data):
+        """Append a chunk of the stream; returns the records it completed"""
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        records = []
+        for line in lines:
+            if line.strip():
+                records.append(self._record(line))
+        return records
+
+    def close(self):
+        if self._partial.strip():
+            raise TraceFormatError("trace stream ends inside a record")
+
+    @staticmethod
+    def _record(line):
+        try:
+            obj = json.loads(line)
+            kind = obj["type"]
+            if kind == "step":
+                return Step(obj["pc"], obj["inst"], obj.get("rd", -1), obj.get("value", 0),
+                            obj.get("mem_addr", 0), obj.get("mem_value", 0),
+                            obj.get("mem_size", 0))
+            if kind == "output":
+                return Output(obj["text"])
+            if kind == "load":
+                return Load(obj["bytes"])
+            if kind == "final":
+                reason = obj["reason"]
+                if reason == _REASON_NAMES[None]:
+                    reason = None
+                elif reason not in _REASON_CODES:
+                    raise TraceFormatError("unknown stop reason %r" % reason)
+                return Final(reason, obj["pc"], obj["count"], tuple(obj["regs"]))
+        except (ValueError, KeyError, TypeError) as e:
+            raise TraceFormatError("malformed trace record: %s" % e)
+        raise TraceFormatError("unknown record type %r" % kind)
+
+
+def decoder_for(fmt):
+    if fmt == TRACE_BINARY:
+        return BinaryTraceDecoder()
+    if fmt == TRACE_NDJSON:
+        return NDJSONTraceDecoder()
+    raise ValueError("no structured decoder for trace format %r" % fmt)
+
+
+def read_records(stream, fmt=TRACE_BINARY, chunk_size=65536):
+    """Yield records from a binary file object (e.g. a pipe) as they arrive"""
+    decoder = decoder_for(fmt)
+    read = getattr(stream, "read1", stream.read)
+    while True:
+        data = read(chunk_size)
+        if not data:
+            break
+        yield from decoder.feed(data)
+    decoder.close()
@@ -31,9 +31,10 @@
  #include <ctype.h>
  #include <stdint.h>
  
+ // Initial size of the line reader's buffer; longer lines grow it
  #define MAX_LINE_LENGTH 256
- #define MAX_LABEL_LENGTH 64
- #define MAX_LINES 2048
+ // Line records and source text are carved out of blocks of this size
+ #define ARENA_BLOCK_SIZE 65536
  // Total memory is 64KB
  #define MEM_SIZE 65536
  
@@ -75,16 +76,74 @@
  // Count comma-separated values in a directive operand string.
  int countValues(const char *operands) {
      int count = 0;
-     char temp[MAX_LINE_LENGTH];
-     strncpy(temp, operands, MAX_LINE_LENGTH);
+     char *temp = strdup(operands);
+     if(!temp) { perror("malloc"); exit(1); }
      char *token = strtok(temp, ",");
      while(token != NULL) {
          count++;
          token = strtok(NULL, ",");
      }
+     free(temp);
      return count;
  }
  
+ // FNV-1a hash of a string, case-insensitive.
+ unsigned int hashIgnoreCase(const char *s) {
+     unsigned int h = 2166136261u;
+     for (; *s; s++) {
+         h ^= (unsigned char)tolower((unsigned char)*s);
+         h *= 16777619u;
+     }
+     return h;
+ }
+ 
+ // -----------------------
+ // Arena Allocator
+ // -----------------------
+ //
+ // Line records, their source text and symbols live until the assembler
+ // exits, so they are bump-allocated from large blocks and freed together.
+ 
+ typedef struct ArenaBlock {
+     struct ArenaBlock *next;
+     size_t used;
+     size_t size;
+     char data[];
+ } ArenaBlock;
+ 
+ ArenaBlock *arena = NULL;
+ 
+ void *arenaAlloc(size_t size) {
+     size = (size + 7) & ~(size_t)7;  // keep every allocation 8-byte aligned
+     if(!arena || arena->used + size > arena->size) {
+         size_t blockSize = size > ARENA_BLOCK_SIZE ? size : ARENA_BLOCK_SIZE;
+         ArenaBlock *block = (ArenaBlock *)malloc(sizeof(ArenaBlock) + blockSize);
+         if(!block) { perror("malloc"); exit(1); }
+         block->next = arena;
+         block->used = 0;
+         block->size = blockSize;
+         arena = block;
+     }
+     void *p = arena->data + arena->used;
+     arena->used += size;
+     return p;
+ }
+ 
+ char *arenaStrdup(const char *src, size_t len) {
+     char *dest = (char *)arenaAlloc(len + 1);
+     memcpy(dest, src, len);
+     dest[len] = '\0';
+     return dest;
+ }
+ 
+ void arenaFree() {
+     while(arena) {
+         ArenaBlock *block = arena;
+         arena = arena->next;
+         free(block);
+     }
+ }
+ 
  // -----------------------
  // Symbol Table Structures and Functions
  // -----------------------
@@ -92,47 +151,72 @@
  typedef enum { SECTION_NONE, SECTION_TEXT, SECTION_DATA } Section;
  
  typedef struct Symbol {
-     char name[MAX_LABEL_LENGTH]; // stored in lower-case
+     char *name;                  // stored in lower-case
      int address;                 // address where the label is defined
      Section section;             // TEXT or DATA
-     struct Symbol *next;         // chaining
+     unsigned int hash;           // hashIgnoreCase(name)
+     struct Symbol *next;         // all symbols, newest first
+     struct Symbol *hashNext;     // chaining within a bucket
  } Symbol;
  
  Symbol *symbolTable = NULL;
+ Symbol **symbolBuckets = NULL;   // power-of-two number of hash buckets
+ size_t symbolBucketCount = 0;
+ size_t symbolCount = 0;
  
- // Add a symbol to the symbol table (the name is stored in lower-case).
- int addSymbol(const char *name, int address, Section sec) {
-     Symbol *cur = symbolTable;
-     while(cur) {
-         if(cmpIgnoreCase(cur->name, name) == 0) {
-             fprintf(stderr, "Error: Duplicate label '%s'\n", name);
-             return -1;
-         }
-         cur = cur->next;
+ // Double the bucket array and rehash every symbol into it.
+ void growSymbolTable() {
+     size_t count = symbolBucketCount ? symbolBucketCount * 2 : 256;
+     Symbol **buckets = (Symbol **)calloc(count, sizeof(Symbol *));
+     if(!buckets) { perror("calloc"); exit(1); }
+     for (Symbol *cur = symbolTable; cur; cur = cur->next) {
+         size_t idx = cur->hash & (count - 1);
+         cur->hashNext = buckets[idx];
+         buckets[idx] = cur;
      }
-     Symbol *newSym = (Symbol *)malloc(sizeof(Symbol));
-     if(!newSym) { perror("malloc"); exit(1); }
-     strncpy(newSym->name, name, MAX_LABEL_LENGTH);
-     newSym->name[MAX_LABEL_LENGTH-1] = '\0';
-     toLowerStr(newSym->name);
-     newSym->address = address;
-     newSym->section = sec;
-     newSym->next = symbolTable;
-     symbolTable = newSym;
-     return 0;
+     free(symbolBuckets);
+     symbolBuckets = buckets;
+     symbolBucketCount = count;
  }
  
  // Lookup a symbol by name (case-insensitive).
  Symbol* findSymbol(const char *name) {
-     Symbol *cur = symbolTable;
+     if(!symbolBuckets)
+         return NULL;
+     unsigned int h = hashIgnoreCase(name);
+     Symbol *cur = symbolBuckets[h & (symbolBucketCount - 1)];
      while(cur) {
-         if(cmpIgnoreCase(cur->name, name) == 0)
+         if(cur->hash == h && cmpIgnoreCase(cur->name, name) == 0)
              return cur;
-         cur = cur->next;
+         cur = cur->hashNext;
      }
      return NULL;
  }
  
+ // Add a symbol to the symbol table (the name is stored in lower-case).
+ int addSymbol(const char *name, int address, Section sec) {
+     if(findSymbol(name)) {
+         fprintf(stderr, "Error: Duplicate label '%s'\n", name);
+         return -1;
+     }
+     // Grow before the table holds more symbols than it has buckets
+     if(symbolCount >= symbolBucketCount)
+         growSymbolTable();
+     Symbol *newSym = (Symbol *)arenaAlloc(sizeof(Symbol));
+     newSym->name = arenaStrdup(name, strlen(name));
+     toLowerStr(newSym->name);
+     newSym->address = address;
+     newSym->section = sec;
+     newSym->hash = hashIgnoreCase(name);
+     newSym->next = symbolTable;
+     symbolTable = newSym;
+     size_t idx = newSym->hash & (symbolBucketCount - 1);
+     newSym->hashNext = symbolBuckets[idx];
+     symbolBuckets[idx] = newSym;
+     symbolCount++;
+     return 0;
+ }
+ 
  // -----------------------
  // Instruction Encoding Structures and Table
  // -----------------------
@@ -192,11 +276,32 @@
      {NULL, 0, 0, 0, 0} // end marker
  };
 
+ // Open-addressed index into instructionSet, keyed by hashIgnoreCase and
+ // filled on first use. The slot count is a power of two at least twice the
+ // number of mnemonics, so probe sequences stay short.
+ #define MNEMONIC_SLOTS 128
+ InstructionDef *mnemonicSlots[MNEMONIC_SLOTS];
+ int mnemonicSlotsReady = 0;
+
+ void buildMnemonicSlots() {
+     for (int i = 0; instructionSet[i].mnemonic != NULL; i++) {
+         unsigned int idx = hashIgnoreCase(instructionSet[i].mnemonic) & (MNEMONIC_SLOTS - 1);
+         while(mnemonicSlots[idx])
+             idx = (idx + 1) & (MNEMONIC_SLOTS - 1);
+         mnemonicSlots[idx] = &instructionSet[i];
+     }
+     mnemonicSlotsReady = 1;
+ }
+
  // Lookup instruction definition (case-insensitive).
  InstructionDef* lookupInstruction(const char *mnemonic) {
-     for (int i = 0; instructionSet[i].mnemonic != NULL; i++) {
-         if (cmpIgnoreCase(mnemonic, instructionSet[i].mnemonic) == 0)
-             return &instructionSet[i];
+     if(!mnemonicSlotsReady)
+         buildMnemonicSlots();
+     unsigned int idx = hashIgnoreCase(mnemonic) & (MNEMONIC_SLOTS - 1);
+     while(mnemonicSlots[idx]) {
+         if (cmpIgnoreCase(mnemonic, mnemonicSlots[idx]->mnemonic) == 0)
+             return mnemonicSlots[idx];
+         idx = (idx + 1) & (MNEMONIC_SLOTS - 1);
      }
      return NULL;
  }
@@ -237,32 +342,32 @@
 
     if(strncmp(token, "%hi(", 4) == 0) {
         const char *p = token + 4;
-        char innerToken[64];
-        int i = 0;
-        while(*p && *p != ')') {
-            innerToken[i++] = *p++;
-        }
-        innerToken[i] = '\0';
+        size_t len = strcspn(p, ")");
+        char *innerToken = (char *)malloc(len + 1);
+        if(!innerToken) { perror("malloc"); exit(1); }
+        memcpy(innerToken, p, len);
+        innerToken[len] = '\0';
 
         // Check if inner token is a symbol
         Symbol* inner_symbol = findSymbol(innerToken);
         int value = inner_symbol ? inner_symbol->address : (int)strtol(innerToken, NULL, 0);
+        free(innerToken);
 
         return value >> 7;
     }
 
     if(strncmp(token, "%lo(", 4) == 0) {
         const char *p = token + 4;
-        char innerToken[64];
-        int i = 0;
-        while(*p && *p != ')') {
-            innerToken[i++] = *p++;
-        }
-        innerToken[i] = '\0';
+        size_t len = strcspn(p, ")");
+        char *innerToken = (char *)malloc(len + 1);
+        if(!innerToken) { perror("malloc"); exit(1); }
+        memcpy(innerToken, p, len);
+        innerToken[len] = '\0';
 
         // Check if inner token is a symbol
         Symbol* inner_symbol = findSymbol(innerToken);
         int value = inner_symbol ? inner_symbol->address : (int)strtol(innerToken, NULL, 0);
+        free(innerToken);
          return value & 0x7F;
      }
 
@@ -278,7 +383,7 @@
  // Each code element’s size: for instructions and .word, 2 bytes; for .byte and .asciiz, 1 byte.
  typedef struct {
      int lineNo;                      // source line number
-     char original[MAX_LINE_LENGTH];  // original source text
+     char *original;                  // original source text (arena)
      int address;                     // computed address
      Section section;                 // TEXT or DATA
      char *label;                     // label (if any)
@@ -289,8 +394,18 @@
      int elementSize;                 // size in bytes for each code element (1 or 2)
  } Line;
 
- Line *lines[MAX_LINES];
+ Line **lines = NULL;                 // grows by doubling
  int lineCount = 0;
+ int lineCapacity = 0;
+
+ void appendLine(Line *line) {
+     if(lineCount == lineCapacity) {
+         lineCapacity = lineCapacity ? lineCapacity * 2 : 1024;
+         lines = (Line **)realloc(lines, lineCapacity * sizeof(Line *));
+         if(!lines) { perror("realloc"); exit(1); }
+     }
+     lines[lineCount++] = line;
+ }
 
  // -----------------------
  // Global Location Counters and Section Tracking
@@ -304,11 +419,10 @@
  // Source Line Parsing Functions
  // -----------------------
 
- Line* newLine(int lineNo, const char *src) {
-     Line *l = (Line *)malloc(sizeof(Line));
-     if(!l) { perror("malloc"); exit(1); }
+ Line* newLine(int lineNo, const char *src, size_t len) {
+     Line *l = (Line *)arenaAlloc(sizeof(Line));
      l->lineNo = lineNo;
-     strncpy(l->original, src, MAX_LINE_LENGTH);
+     l->original = arenaStrdup(src, len);
      l->address = 0;
      l->section = currentSection;
      l->label = NULL;
@@ -325,7 +439,6 @@
          if(l->mnemonic) free(l->mnemonic);
          if(l->operands) free(l->operands);
          if(l->code) free(l->code);
-         free(l);
      }
  }
 
@@ -358,13 +471,15 @@
  // Parse a source line into label, mnemonic, and operands.
  // Comments (starting with '#' or ';') are removed and the mnemonic is converted to lower-case.
  void parseSourceLine(Line *line) {
-     char buffer[MAX_LINE_LENGTH];
-     strncpy(buffer, line->original, MAX_LINE_LENGTH);
+     char *buffer = strdup(line->original);
+     if(!buffer) { perror("malloc"); exit(1); }
      char *com = strpbrk(buffer, "#;");
      if(com) *com = '\0';
      trim(buffer);
-     if(strlen(buffer) == 0)
+     if(strlen(buffer) == 0) {
+         free(buffer);
          return;
+     }
      char *colon = strchr(buffer, ':');
      if(colon) {
          *colon = '\0';
@@ -377,9 +492,11 @@
          }
          char *rest = colon + 1;
          trim(rest);
-         if(strlen(rest)==0)
+         if(strlen(rest)==0) {
+             free(buffer);
              return;
-         strcpy(buffer, rest);
+         }
+         memmove(buffer, rest, strlen(rest) + 1);
      }
      char *token = strtok(buffer, " \t");
      if(token) {
@@ -391,6 +508,27 @@
              line->operands = unescapeString(ops);
          }
      }
+     free(buffer);
+ }
+
+ // Read one source line of any length, keeping its newline. The buffer is
+ // grown as needed; returns the line length, or -1 at end of file.
+ long readLine(FILE *fp, char **buf, size_t *cap) {
+     size_t len = 0;
+     if(*buf == NULL) {
+         *cap = MAX_LINE_LENGTH;
+         *buf = (char *)malloc(*cap);
+         if(!*buf) { perror("malloc"); exit(1); }
+     }
+     while(fgets(*buf + len, (int)(*cap - len), fp)) {
+         len += strlen(*buf + len);
+         if(len == 0 || (*buf)[len - 1] == '\n' || len + 1 < *cap)
+             return (long)len;
+         *cap *= 2;
+         *buf = (char *)realloc(*buf, *cap);
+         if(!*buf) { perror("realloc"); exit(1); }
+     }
+     return len > 0 ? (long)len : -1;
  }
 
  // -----------------------
@@ -398,11 +536,13 @@
  // -----------------------
 
  void pass1(FILE *fp) {
-     char srcLine[MAX_LINE_LENGTH];
+     char *srcLine = NULL;
+     size_t srcCapacity = 0;
+     long srcLength;
      int currentLineNo = 0;
-     while(fgets(srcLine, sizeof(srcLine), fp)) {
+     while((srcLength = readLine(fp, &srcLine, &srcCapacity)) >= 0) {
          currentLineNo++;
-         Line *line = newLine(currentLineNo, srcLine);
+         Line *line = newLine(currentLineNo, srcLine, (size_t)srcLength);
          parseSourceLine(line);
          line->section = currentSection;
          if(currentSection == SECTION_TEXT)
@@ -476,8 +616,9 @@
                  loc_text += 2;
              }
          }
-         lines[lineCount++] = line;
+         appendLine(line);
      }
+     free(srcLine);
      rewind(fp);
  }
 
@@ -891,6 +1032,64 @@
      printf("Listing file generated: %s\n", listingFilename);
  }
 
+ // -----------------------
+ // Source Map Generation (.map)
+ // -----------------------
+ //
+ // One little-endian uint16 per 16-bit word of memory: the source line of
+ // the instruction at address 2*i, or 0. Layout: "Z16M", uint16 count,
+ // uint16 line[count]; trailing words without an instruction are left out.
+ // Lines above SOURCE_MAP_MAX_LINE are written as 0, as in source_map.py.
+
+ #define SOURCE_MAP_WORDS 0x8000
+ #define SOURCE_MAP_MAX_LINE 0xFFFF
+
+ static void writeUint16(FILE *fp, unsigned value) {
+     fputc(value & 0xFF, fp);
+     fputc((value >> 8) & 0xFF, fp);
+ }
+
+ void generateSourceMap(const char *sourceFilename) {
+     char mapFilename[256];
+     strcpy(mapFilename, sourceFilename);
+     char *dot = strrchr(mapFilename, '.');
+     if(dot)
+         strcpy(dot, ".map");
+     else
+         strcat(mapFilename, ".map");
+
+     uint16_t *map = (uint16_t *)calloc(SOURCE_MAP_WORDS, sizeof(uint16_t));
+     if(!map) {
+         perror("calloc");
+         exit(1);
+     }
+     for (int i = 0; i < lineCount; i++) {
+         Line *l = lines[i];
+         if(l->section != SECTION_TEXT || l->elementSize != 2 || l->codeCount == 0)
+             continue;
+         int word = l->address >> 1;
+         uint16_t number = l->lineNo <= SOURCE_MAP_MAX_LINE ? (uint16_t)l->lineNo : 0;
+         for (int j = 0; j < l->codeCount && word + j < SOURCE_MAP_WORDS; j++)
+             map[word + j] = number;
+     }
+     int count = SOURCE_MAP_WORDS;
+     while(count > 0 && map[count - 1] == 0)
+         count--;
+
+     FILE *fp = fopen(mapFilename, "wb");
+     if(!fp) {
+         perror("Error opening source map file");
+         exit(1);
+     }
+     fwrite("Z16M", 1, 4, fp);
+     writeUint16(fp, count);
+     for (int i = 0; i < count; i++)
+         writeUint16(fp, map[i]);
+     fclose(fp);
+     free(map);
+     printf("Source map generated: %s\n", mapFilename);
+ }
+
  // -----------------------
  // Dump Binary: Write Memory Image to Output File
  // -----------------------
@@ -973,6 +1172,7 @@
      int debugModeFlag = 0;
      char *filename = NULL;
      char *binFilename = NULL;
+     char *derivedBinFilename = NULL;  // owned copy when -o is not given
      
      if(argc < 2) {
          fprintf(stderr, "Usage: %s [-v] [-d] [-o <binary_file>] <sourcefile>\n", argv[0]);
@@ -1008,7 +1208,7 @@
              strcpy(dot, ".bin");
          else
              strcat(temp, ".bin");
-         binFilename = strdup(temp);
+         binFilename = derivedBinFilename = strdup(temp);
      }
      
      FILE *fp = fopen(filename, "r");
@@ -1030,19 +1230,18 @@
          printf("Debug: Pass 2 complete\n");
      
      generateListing(filename);
+     generateSourceMap(filename);
      dumpBinary(binFilename);
      if(verbose)
          dumpVerbose();
      
      for (int i = 0; i < lineCount; i++)
          freeLine(lines[i]);
-     while(symbolTable) {
-         Symbol *temp = symbolTable;
-         symbolTable = symbolTable->next;
-         free(temp);
-     }
-     if(binFilename)
-         free(binFilename);
+     free(lines);
+     free(symbolBuckets);
+     arenaFree();
+     if(derivedBinFilename)
+         free(derivedBinFilename);
      
      return 0;
  }
@@ -24,7 +24,28 @@
  * - ecall 3: Terminate the simulation.
  *
  * Usage:
- * rvsim <machine_code_file_name>
+ * rvsim [--trace=text|binary|ndjson] [--fast] [--profile] [--save-snapshot=FILE]
+ *       <machine_code_file_name | --resume=SNAPSHOT>
+ *
+ * --trace=binary and --trace=ndjson replace the text trace on stdout with structured records
+ * (one per executed instruction, plus program output and the final machine state) so frontends
+ * do not have to parse the text. The record layouts are documented in GUI_Test/z16trace.py.
+ *
+ * --fast runs to completion without the per-instruction trace (or step records): only ecall
+ * output and the final state are reported, followed in text mode by an instruction count and
+ * elapsed-time summary.
+ *
+ * Budgets (0 = unlimited): --max-instructions=N (default 100000), --timeout=SECONDS of wall-clock
+ * time and --max-output=BYTES of ecall output. When one runs out the watchdog stops the run
+ * cleanly, reports the PC and instruction count, and the trace printed so far is kept.
+ *
+ * --profile ends the run with execution counts: instruction, load, store and taken/not-taken
+ * branch totals and the most executed PCs (on stderr when stdout carries trace records).
+ *
+ * --save-snapshot=FILE saves the machine as the run left it; --resume=FILE continues such a
+ * snapshot instead of loading a program. Budgets apply to the resumed run alone; reported
+ * instruction counts include the instructions before the snapshot. The format is documented in
+ * GUI_Test/z16snapshot.py.
  */
 
 #include <stdio.h>
@@ -32,7 +53,19 @@
 #include <stdint.h>
 #include <string.h>
 #include <stddef.h>
+#include <time.h>
+#ifdef _WIN32
+#include <io.h>
+#include <fcntl.h>
+#else
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#endif
 #define MEM_SIZE 65536 // 64KB memory
+#define MAX_INSTRUCTIONS 100000 // Default instruction budget
+#define WATCHDOG_INTERVAL 4096 // Instructions between two watchdog clock reads
 // Global simulated memory and register file.
 unsigned char memory[MEM_SIZE];
 uint16_t regs[8]; // 8 registers (16-bit each): x0, x1, x2, x3, x4, x5, x6, x7
@@ -41,6 +74,157 @@ uint16_t pc = 0; // Program counter (16-bit)
 // Register ABI names for display (x0 = t0, x1 = ra, x2 = sp, x3 = s0, x4 = s1, x5 = t1, x6 = a0, x7 = a1)
 const char *regNames[8] = {"t0", "ra", "sp", "s0", "s1", "t1", "a0", "a1"};
 
+// Trace output format selected with --trace=
+enum { TRACE_TEXT, TRACE_BINARY, TRACE_NDJSON };
+int traceMode = TRACE_TEXT;
+int fastMode = 0; // --fast: no per-instruction trace
+int profileMode = 0; // --profile: print the execution counts at the end
+
+// Profile counters indexed by PC: instructions retired, and taken conditional branches
+#define PROFILE_HOT_SPOTS 10
+uint64_t hits[MEM_SIZE];
+uint64_t taken[MEM_SIZE];
+
+// Run budgets set from the command line; 0 means unlimited
+long long maxInstructions = MAX_INSTRUCTIONS;
+double timeLimit = 0;
+long long outputLimit = 0;
+long long outputBytes = 0;
+int outputExceeded = 0;
+
+// Stop reasons reported in the final trace record
+enum { STOP_ECALL, STOP_ZERO_INSTRUCTION, STOP_END_OF_MEMORY, STOP_INSTRUCTION_LIMIT,
+       STOP_TIME_LIMIT, STOP_OUTPUT_LIMIT };
+const char *stopNames[6] = {"ecall", "zero instruction", "end of memory", "instruction limit",
+                            "time limit", "output limit"};
+
+// Wall-clock time in seconds, for the watchdog and the --fast summary
+double nowSeconds(void) {
+#ifdef TIME_UTC
+    struct timespec ts;
+    timespec_get(&ts, TIME_UTC);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+#else
+    return (double)clock() / CLOCKS_PER_SEC;
+#endif
+}
+
+// -----------------------
+// Structured Trace Records
+// -----------------------
+//
+// Binary records are little-endian and start with a tag byte; NDJSON records are one JSON object
+// per line. See GUI_Test/z16trace.py for the full description and the streaming decoder.
+
+static void putU16(unsigned char *p, uint16_t v) {
+    p[0] = v & 0xFF;
+    p[1] = v >> 8;
+}
+
+static void putU32(unsigned char *p, uint32_t v) {
+    putU16(p, v & 0xFFFF);
+    putU16(p + 2, v >> 16);
+}
+
+void traceHeader(void) {
+    if (traceMode == TRACE_BINARY)
+        fwrite("Z16T\x01", 1, 5, stdout);
+}
+
+void traceLoad(size_t n) {
+    if (traceMode == TRACE_BINARY) {
+        unsigned char rec[5] = {'L'};
+        putU32(rec + 1, (uint32_t)n);
+        fwrite(rec, 1, sizeof(rec), stdout);
+    } else {
+        printf("{\"type\":\"load\",\"bytes\":%zu}\n", n);
+    }
+}
+
+// rd is -1 when no register was written, memSize is 0 when nothing was stored
+void traceStep(uint16_t stepPc, uint16_t inst, int rd, uint16_t value,
+               uint16_t memAddr, uint16_t memValue, int memSize) {
+    if (traceMode == TRACE_BINARY) {
+        unsigned char rec[13] = {'S'};
+        putU16(rec + 1, stepPc);
+        putU16(rec + 3, inst);
+        rec[5] = (unsigned char)(int8_t)rd;
+        putU16(rec + 6, value);
+        putU16(rec + 8, memAddr);
+        putU16(rec + 10, memValue);
+        rec[12] = (unsigned char)memSize;
+        fwrite(rec, 1, sizeof(rec), stdout);
+        return;
+    }
+    printf("{\"type\":\"step\",\"pc\":%u,\"inst\":%u", stepPc, inst);
+    if (rd >= 0)
+        printf(",\"rd\":%d,\"value\":%u", rd, value);
+    if (memSize)
+        printf(",\"mem_addr\":%u,\"mem_value\":%u,\"mem_size\":%d", memAddr, memValue, memSize);
+    printf("}\n");
+}
+
+void traceFinal(int reason, long long count) {
+    if (traceMode == TRACE_BINARY) {
+        unsigned char rec[24] = {'F', (unsigned char)reason};
+        putU16(rec + 2, pc);
+        putU32(rec + 4, count > 0xFFFFFFFFLL ? 0xFFFFFFFFu : (uint32_t)count); // saturates
+        for (int i = 0; i < 8; i++)
+            putU16(rec + 8 + 2 * i, regs[i]);
+        fwrite(rec, 1, sizeof(rec), stdout);
+        return;
+    }
+    printf("{\"type\":\"final\",\"reason\":\"%s\",\"pc\":%u,\"count\":%lld,\"regs\":[",
+           stopNames[reason], pc, count);
+    for (int i = 0; i < 8; i++)
+        printf(i ? ",%u" : "%u", regs[i]);
+    printf("]}\n");
+}
+
+// Program output from an ecall: printed as-is in text mode, wrapped in an output record otherwise.
+// Output beyond the --max-output budget is dropped; returns 0 once the budget is exceeded.
+int emitOutput(const char *text, size_t len) {
+    if (outputLimit && outputBytes + (long long)len > outputLimit) {
+        len = (size_t)(outputLimit - outputBytes);
+        outputExceeded = 1;
+    }
+    outputBytes += len;
+    if (len == 0) {
+        // nothing left to print
+    } else if (traceMode == TRACE_TEXT) {
+        fwrite(text, 1, len, stdout);
+    } else if (traceMode == TRACE_BINARY) {
+        unsigned char hdr[5] = {'O'};
+        putU32(hdr + 1, (uint32_t)len);
+        fwrite(hdr, 1, sizeof(hdr), stdout);
+        fwrite(text, 1, len, stdout);
+    } else {
+        // Output bytes are latin-1, as in the Python engine; JSON-escape them
+        printf("{\"type\":\"output\",\"text\":\"");
+        for (size_t i = 0; i < len; i++) {
+            unsigned char c = (unsigned char)text[i];
+            if (c == '"' || c == '\\')
+                printf("\\%c", c);
+            else if (c == '\n')
+                printf("\\n");
+            else if (c == '\t')
+                printf("\\t");
+            else if (c == '\r')
+                printf("\\r");
+            else if (c == '\b')
+                printf("\\b");
+            else if (c == '\f')
+                printf("\\f");
+            else if (c < 0x20 || c >= 0x80)
+                printf("\\u%04x", c);
+            else
+                putchar(c);
+        }
+        printf("\"}\n");
+    }
+    return !outputExceeded;
+}
+
 // -----------------------
 // Disassembly Function
 // -----------------------
@@ -370,7 +554,7 @@ int executeInstruction(uint16_t inst) {
         memory[addr] = regs[rs2] & 0xFF;
     } else if (funct3 == 0x1) { // sw
         memory[addr] = regs[rs2] & 0xFF;
-        memory[addr + 1] = (regs[rs2] >> 8) & 0xFF;
+        memory[(uint16_t)(addr + 1)] = (regs[rs2] >> 8) & 0xFF; // wraps at the end of memory
     }
     break;
 }
@@ -386,7 +570,7 @@ case 0x4: { // L-type (load): [15:12] imm[3:0] | [11:9] rs2 | [8:6] rd | [5:3] f
         int8_t val = memory[addr]; // Sign-extended byte load
         regs[rd] = (int16_t)val;
     } else if (funct3 == 0x1) { // lw
-        regs[rd] = memory[addr] | (memory[addr + 1] << 8);
+        regs[rd] = memory[addr] | (memory[(uint16_t)(addr + 1)] << 8); // wraps at the end of memory
     } else if (funct3 == 0x4) { // lbu
         regs[rd] = memory[addr]; // Zero-extended byte load
     }
@@ -426,14 +610,22 @@ case 0x4: { // L-type (load): [15:12] imm[3:0] | [11:9] rs2 | [8:6] rd | [5:3] f
         case 0x7: { // System instruction (ecall)
 uint16_t service = (inst >> 6) & 0x3FF;
             if (service == 1) { // Print integer
-                printf("%d\n", (int16_t)regs[6]); // a0 is register 6
+                char text[16];
+                int len = snprintf(text, sizeof(text), "%d\n", (int16_t)regs[6]); // a0 is register 6
+                if (!emitOutput(text, len))
+                    return 0; // output budget used up: stop on this ecall
+
             } else if (service == 5) { // Print string
+    static char text[MEM_SIZE + 1];
+    size_t len = 0;
     uint16_t addr = regs[6]; // a0 is register 6
-    while (memory[addr] != 0) {
-        putchar(memory[addr]);
+    while (memory[addr] != 0 && len < MEM_SIZE) {
+        text[len++] = memory[addr];
         addr++;
     }
-    printf("\n"); // Add newline for better output formatting
+    text[len++] = '\n'; // Add newline for better output formatting
+    if (!emitOutput(text, len))
+        return 0; // output budget used up: stop on this ecall
 }
              else if (service == 3) { // Terminate
                 return 0;
@@ -451,6 +643,56 @@ uint16_t service = (inst >> 6) & 0x3FF;
     
     return 1;
 }
+// -----------------------
+// Instruction Effects
+// -----------------------
+//
+// After 'inst' has executed, reports the register it wrote (*rd = -1 if none) and the memory it
+// stored (*memSize = 0 if none) for structured trace records. Stores never modify registers, so
+// the store address can be recomputed after execution.
+void instructionEffects(uint16_t inst, int *rd, uint16_t *memAddr, uint16_t *memValue, int *memSize) {
+    uint8_t opcode = inst & 0x7;
+    uint8_t funct4 = (inst >> 12) & 0xF;
+    uint8_t rs2 = (inst >> 9) & 0x7;
+    uint8_t field6 = (inst >> 6) & 0x7;
+    uint8_t funct3 = (inst >> 3) & 0x7;
+    int writes = 0;
+
+    *memSize = 0;
+    switch (opcode) {
+        case 0x0: // R-type: jr and unassigned funct4 values write nothing
+            if (funct3 == 0x0)
+                writes = (funct4 == 0x0 || funct4 == 0x1 || funct4 == 0x8);
+            else if (funct3 == 0x3)
+                writes = (funct4 == 0x2 || funct4 == 0x4 || funct4 == 0x8);
+            else
+                writes = 1;
+            break;
+        case 0x1: { // I-type: only the defined shift types write
+            uint8_t shift_type = (inst >> 13) & 0x7;
+            writes = (funct3 != 0x3 || shift_type == 0x1 || shift_type == 0x2 || shift_type == 0x4);
+            break;
+        }
+        case 0x3: // S-type
+            if (funct3 == 0x0 || funct3 == 0x1) {
+                *memSize = funct3 == 0x0 ? 1 : 2;
+                *memAddr = regs[field6] + funct4;
+                *memValue = funct3 == 0x0 ? (regs[rs2] & 0xFF) : regs[rs2];
+            }
+            break;
+        case 0x4: // L-type
+            writes = (funct3 == 0x0 || funct3 == 0x1 || funct3 == 0x4);
+            break;
+        case 0x5: // J-type: only jal links
+            writes = (inst >> 15) & 0x1;
+            break;
+        case 0x6: // U-type
+            writes = 1;
+            break;
+    }
+    *rd = writes ? field6 : -1;
+}
+
 // -----------------------
 // Memory Loading
 // -----------------------
@@ -464,7 +706,152 @@ void loadMemoryFromFile(const char *filename) {
     }
     size_t n = fread(memory, 1, MEM_SIZE, fp);
     fclose(fp);
-    printf("Loaded %zu bytes into memory\n", n);
+    if (traceMode == TRACE_TEXT)
+        printf("Loaded %zu bytes into memory\n", n);
+    else
+        traceLoad(n);
+}
+
+// -----------------------
+// Snapshots
+// -----------------------
+//
+// A snapshot holds the registers, PC, instructions retired and memory as 256-byte pages:
+// identical pages are stored once and all-zero pages not at all. Layout (little-endian) as in
+// GUI_Test/z16snapshot.py: a 64-byte header, a directory of one uint16 per memory page at
+// SNAPSHOT_DIRECTORY (pool page + 1, 0 = zeros) and the page pool at SNAPSHOT_POOL.
+#define SNAPSHOT_PAGE 256
+#define SNAPSHOT_PAGES (MEM_SIZE / SNAPSHOT_PAGE)
+#define SNAPSHOT_DIRECTORY 64
+#define SNAPSHOT_POOL 1024
+
+static uint16_t getU16(const unsigned char *p) {
+    return p[0] | (p[1] << 8);
+}
+
+static void snapshotError(const char *message) {
+    fprintf(stderr, "Error reading snapshot file: %s\n", message);
+    exit(1);
+}
+
+// Writes the current machine state; returns 0 on failure
+int saveSnapshot(const char *filename, long long count) {
+    static unsigned char head[SNAPSHOT_POOL];
+    int pool[SNAPSHOT_PAGES]; // memory page stored as each pool page
+    int poolSize = 0;
+    memset(head, 0, sizeof(head));
+    for (int i = 0; i < SNAPSHOT_PAGES; i++) {
+        const unsigned char *page = memory + i * SNAPSHOT_PAGE;
+        int entry = 0, zero = 1;
+        for (int k = 0; k < SNAPSHOT_PAGE && zero; k++)
+            zero = page[k] == 0;
+        if (!zero) {
+            for (int j = 0; j < poolSize && !entry; j++)
+                if (memcmp(page, memory + pool[j] * SNAPSHOT_PAGE, SNAPSHOT_PAGE) == 0)
+                    entry = j + 1;
+            if (!entry) {
+                pool[poolSize++] = i;
+                entry = poolSize;
+            }
+        }
+        putU16(head + SNAPSHOT_DIRECTORY + 2 * i, (uint16_t)entry);
+    }
+    memcpy(head, "Z16S", 4);
+    putU16(head + 4, 1); // version
+    putU16(head + 6, (uint16_t)poolSize);
+    putU32(head + 8, (uint32_t)count);
+    putU32(head + 12, (uint32_t)((unsigned long long)count >> 32));
+    putU16(head + 16, pc);
+    for (int i = 0; i < 8; i++)
+        putU16(head + 18 + 2 * i, regs[i]);
+
+    FILE *fp = fopen(filename, "wb");
+    if (!fp) {
+        perror("Error writing snapshot file");
+        return 0;
+    }
+    int ok = fwrite(head, 1, sizeof(head), fp) == sizeof(head);
+    for (int j = 0; j < poolSize && ok; j++)
+        ok = fwrite(memory + pool[j] * SNAPSHOT_PAGE, 1, SNAPSHOT_PAGE, fp) == SNAPSHOT_PAGE;
+    if (fclose(fp) != 0 || !ok) {
+        perror("Error writing snapshot file");
+        return 0;
+    }
+    return 1;
+}
+
+// Restores the machine from a snapshot; returns the number of instructions it had retired.
+// The file is mapped copy-on-write (MAP_PRIVATE), so concurrent resumes share its pages and
+// only the pages copied into memory[] are read.
+long long resumeSnapshot(const char *filename) {
+    size_t size;
+    unsigned char *data;
+#ifdef _WIN32
+    FILE *fp = fopen(filename, "rb");
+    if (!fp) {
+        perror("Error opening snapshot file");
+        exit(1);
+    }
+    fseek(fp, 0, SEEK_END);
+    size = (size_t)ftell(fp);
+    fseek(fp, 0, SEEK_SET);
+    data = malloc(size ? size : 1);
+    if (!data || fread(data, 1, size, fp) != size) {
+        perror("Error opening snapshot file");
+        exit(1);
+    }
+    fclose(fp);
+#else
+    int fd = open(filename, O_RDONLY);
+    struct stat st;
+    if (fd < 0 || fstat(fd, &st) != 0) {
+        perror("Error opening snapshot file");
+        exit(1);
+    }
+    size = (size_t)st.st_size;
+    if (size < SNAPSHOT_POOL)
+        snapshotError("not a Z16 snapshot");
+    data = mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (data == MAP_FAILED) {
+        perror("Error opening snapshot file");
+        exit(1);
+    }
+#endif
+    if (size < SNAPSHOT_POOL || memcmp(data, "Z16S", 4) != 0)
+        snapshotError("not a Z16 snapshot");
+    if (getU16(data + 4) != 1) {
+        fprintf(stderr, "Error reading snapshot file: unsupported snapshot version %u\n", getU16(data + 4));
+        exit(1);
+    }
+    int poolSize = getU16(data + 6);
+    if (poolSize > SNAPSHOT_PAGES || size < SNAPSHOT_POOL + (size_t)poolSize * SNAPSHOT_PAGE)
+        snapshotError("truncated snapshot");
+    for (int i = 0; i < SNAPSHOT_PAGES; i++)
+        if (getU16(data + SNAPSHOT_DIRECTORY + 2 * i) > poolSize)
+            snapshotError("snapshot page directory is out of range");
+
+    memset(memory, 0, sizeof(memory));
+    for (int i = 0; i < SNAPSHOT_PAGES; i++) {
+        int entry = getU16(data + SNAPSHOT_DIRECTORY + 2 * i);
+        if (entry)
+            memcpy(memory + i * SNAPSHOT_PAGE, data + SNAPSHOT_POOL + (entry - 1) * SNAPSHOT_PAGE, SNAPSHOT_PAGE);
+    }
+    long long count = (long long)(getU16(data + 8) | (uint32_t)getU16(data + 10) << 16
+                                  | (uint64_t)getU16(data + 12) << 32 | (uint64_t)getU16(data + 14) << 48);
+    pc = getU16(data + 16);
+    for (int i = 0; i < 8; i++)
+        regs[i] = getU16(data + 18 + 2 * i);
+#ifdef _WIN32
+    free(data);
+#else
+    munmap(data, size);
+#endif
+    if (traceMode == TRACE_TEXT)
+        printf("Resumed from snapshot at 0x%04X after %lld instructions\n", pc, count);
+    else
+        traceLoad(MEM_SIZE);
+    return count;
 }
 
 void printRegisterState() {
@@ -476,25 +863,138 @@ printf("%s (x%d): 0x%04X (%d)\n", regNames[i], i, regs[i], (int16_t)regs[i]);
     printf("---------------------------\n");
 }
 
+// Prints the --profile report: totals by instruction class, then the most executed PCs
+// (most first, ties by address). PCs are classified by the instruction now in memory.
+void printProfile(FILE *out) {
+    long long total = 0, loads = 0, stores = 0, branches = 0, branchesTaken = 0;
+    for (int a = 0; a < MEM_SIZE; a++) {
+        if (!hits[a])
+            continue;
+        uint16_t inst = memory[a] | (memory[(a + 1) & 0xFFFF] << 8);
+        uint8_t opcode = inst & 0x7;
+        uint8_t funct3 = (inst >> 3) & 0x7;
+        total += hits[a];
+        if (opcode == 0x4 && (funct3 == 0x0 || funct3 == 0x1 || funct3 == 0x4)) // lb, lw, lbu
+            loads += hits[a];
+        else if (opcode == 0x3 && funct3 <= 0x1) // sb, sw
+            stores += hits[a];
+        else if (opcode == 0x2) {
+            branches += hits[a];
+            branchesTaken += taken[a];
+        }
+    }
+    fprintf(out, "\n--- Profile ---\n");
+    fprintf(out, "Instructions: %lld, loads: %lld, stores: %lld, branches: %lld (%lld taken, %lld not taken)\n",
+            total, loads, stores, branches, branchesTaken, branches - branchesTaken);
+    fprintf(out, "Hot spots:\n");
+    uint64_t lastHits = UINT64_MAX;
+    int lastPc = -1;
+    char disasmBuf[128];
+    for (int n = 0; n < PROFILE_HOT_SPOTS; n++) {
+        // Next PC after the last one shown in (hits descending, address ascending) order
+        int best = -1;
+        for (int a = 0; a < MEM_SIZE; a++) {
+            if (!hits[a] || hits[a] > lastHits || (hits[a] == lastHits && a <= lastPc))
+                continue;
+            if (best < 0 || hits[a] > hits[best])
+                best = a;
+        }
+        if (best < 0)
+            break;
+        uint16_t inst = memory[best] | (memory[(best + 1) & 0xFFFF] << 8);
+        disassemble(inst, best, disasmBuf, sizeof(disasmBuf));
+        fprintf(out, "  0x%04X %10llu %5.1f%%  %s", best, (unsigned long long)hits[best],
+                100.0 * hits[best] / total, disasmBuf);
+        if ((inst & 0x7) == 0x2)
+            fprintf(out, "  (taken %llu, not taken %llu)", (unsigned long long)taken[best],
+                    (unsigned long long)(hits[best] - taken[best]));
+        fprintf(out, "\n");
+        lastHits = hits[best];
+        lastPc = best;
+    }
+    fprintf(out, "---------------------------\n");
+}
+
+// Parses the value of a budget option; returns 0 if it is not a non-negative number
+static int parseBudget(const char *value, double *out) {
+    char *end;
+    *out = strtod(value, &end);
+    return *value != '\0' && *end == '\0' && *out >= 0;
+}
+
 int main(int argc, char **argv) {
-    if (argc != 2) {
-        fprintf(stderr, "Usage: %s <machine_code_file_name>\n", argv[0]);
+    const char *fileName = NULL;
+    const char *resumeName = NULL;
+    const char *snapshotName = NULL;
+    int badArgs = 0;
+    double value;
+    for (int i = 1; i < argc; i++) {
+        if (strcmp(argv[i], "--trace=text") == 0)
+            traceMode = TRACE_TEXT;
+        else if (strcmp(argv[i], "--trace=binary") == 0)
+            traceMode = TRACE_BINARY;
+        else if (strcmp(argv[i], "--trace=ndjson") == 0)
+            traceMode = TRACE_NDJSON;
+        else if (strcmp(argv[i], "--fast") == 0)
+            fastMode = 1;
+        else if (strcmp(argv[i], "--profile") == 0)
+            profileMode = 1;
+        else if (strncmp(argv[i], "--max-instructions=", 19) == 0 && parseBudget(argv[i] + 19, &value))
+            maxInstructions = (long long)value;
+        else if (strncmp(argv[i], "--timeout=", 10) == 0 && parseBudget(argv[i] + 10, &value))
+            timeLimit = value;
+        else if (strncmp(argv[i], "--max-output=", 13) == 0 && parseBudget(argv[i] + 13, &value))
+            outputLimit = (long long)value;
+        else if (strncmp(argv[i], "--resume=", 9) == 0 && argv[i][9] && !resumeName && !fileName)
+            resumeName = argv[i] + 9;
+        else if (strncmp(argv[i], "--save-snapshot=", 16) == 0 && argv[i][16])
+            snapshotName = argv[i] + 16;
+        else if (fileName == NULL && resumeName == NULL && strncmp(argv[i], "--", 2) != 0)
+            fileName = argv[i];
+        else
+            badArgs = 1;
+    }
+    if ((fileName == NULL && resumeName == NULL) || badArgs) {
+        fprintf(stderr, "Usage: %s [--trace=text|binary|ndjson] [--fast] [--profile] [--max-instructions=N] "
+                "[--timeout=SECONDS] [--max-output=BYTES] [--save-snapshot=FILE] "
+                "<machine_code_file_name | --resume=SNAPSHOT>\n", argv[0]);
         exit(1);
     }
+#ifdef _WIN32
+    if (traceMode == TRACE_BINARY)
+        _setmode(_fileno(stdout), _O_BINARY); // no CRLF translation inside records
+#endif
 
-    loadMemoryFromFile(argv[1]);
-    memset(regs, 0, sizeof(regs)); // initialize registers to 0
-    pc = 0; // starting at address 0
+    traceHeader();
+    // Instructions retired before this run (by the snapshot being resumed)
+    long long startCount = 0;
+    if (resumeName) {
+        startCount = resumeSnapshot(resumeName);
+    } else {
+        loadMemoryFromFile(fileName);
+        memset(regs, 0, sizeof(regs)); // initialize registers to 0
+        pc = 0; // starting at address 0
+    }
     char disasmBuf[128];
+    int stopReason = STOP_INSTRUCTION_LIMIT;
     
     // Added loop counter to prevent infinite loops
-    int instruction_count = 0;
-    #define MAX_INSTRUCTIONS 100000 // Define a reasonable limit for instructions
+    long long instruction_count = startCount;
+    double start = nowSeconds();
     
-        while (pc < MEM_SIZE && instruction_count < MAX_INSTRUCTIONS) {
+        while (pc < MEM_SIZE && (maxInstructions == 0 || instruction_count - startCount < maxInstructions)) {
+        // Watchdog: check the wall-clock budget every WATCHDOG_INTERVAL instructions
+        long long ran = instruction_count - startCount;
+        if (timeLimit > 0 && ran > 0 && ran % WATCHDOG_INTERVAL == 0
+                && nowSeconds() - start >= timeLimit) {
+            stopReason = STOP_TIME_LIMIT;
+            break;
+        }
+
         // Check if we're about to read past memory bounds
         if (pc + 1 >= MEM_SIZE) {
             fprintf(stderr, "Reached end of memory at 0x%04X\n", pc);
+            stopReason = STOP_END_OF_MEMORY;
             break;
         }
 
@@ -504,26 +1004,69 @@ int main(int argc, char **argv) {
         // Sanity check for zero instruction (potential halt condition)
         if (inst == 0) {
             fprintf(stderr, "Encountered zero instruction at 0x%04X\n", pc);
+            stopReason = STOP_ZERO_INSTRUCTION;
             break;
         }
 
-        disassemble(inst, pc, disasmBuf, sizeof(disasmBuf));
-        printf("0x%04X: %04X %s\n", pc, inst, disasmBuf);
+        if (traceMode == TRACE_TEXT && !fastMode) {
+            disassemble(inst, pc, disasmBuf, sizeof(disasmBuf));
+            printf("0x%04X: %04X %s\n", pc, inst, disasmBuf);
+        }
         
+        uint16_t instPc = pc;
         int exec_result = executeInstruction(inst);
-        if (!exec_result) {
-            printf("Simulation terminated by ecall\n");
+        if (traceMode != TRACE_TEXT && !fastMode) {
+            int rd, memSize;
+            uint16_t memAddr = 0, memValue = 0;
+            instructionEffects(inst, &rd, &memAddr, &memValue, &memSize);
+            traceStep(instPc, inst, rd, rd >= 0 ? regs[rd] : 0, memAddr, memValue, memSize);
+        }
+        if (!exec_result && outputExceeded) {
+            stopReason = STOP_OUTPUT_LIMIT;
+            break;
+        } else if (!exec_result) {
+            if (traceMode == TRACE_TEXT)
+                printf("Simulation terminated by ecall\n");
+            stopReason = STOP_ECALL;
             break;
         } else if (exec_result < 0) {
             fprintf(stderr, "Invalid instruction execution at 0x%04X\n", pc);
             break;
         }
 
+        hits[instPc]++;
+        if ((inst & 0x7) == 0x2 && pc != (uint16_t)(instPc + 2)) // branch taken
+            taken[instPc]++;
         instruction_count++;
     }
-if (instruction_count >= MAX_INSTRUCTIONS) {
-        fprintf(stderr, "Simulation terminated: Exceeded maximum instruction count (%d)\n", MAX_INSTRUCTIONS);
+    double elapsedMs = (nowSeconds() - start) * 1000.0;
+    fflush(stdout);
+    if (stopReason == STOP_INSTRUCTION_LIMIT) {
+        fprintf(stderr, "Simulation terminated: Exceeded maximum instruction count (%lld)\n", maxInstructions);
+    } else if (stopReason == STOP_TIME_LIMIT) {
+        fprintf(stderr, "Simulation terminated: Exceeded time limit (%g s) at 0x%04X after %lld instructions\n",
+                timeLimit, pc, instruction_count);
+    } else if (stopReason == STOP_OUTPUT_LIMIT) {
+        fprintf(stderr, "Simulation terminated: Exceeded output limit (%lld bytes) at 0x%04X after %lld instructions\n",
+                outputLimit, pc, instruction_count);
+    }
+    if (traceMode == TRACE_TEXT) {
+        printRegisterState();
+        if (fastMode)
+            printf("Executed %lld instructions in %.3f ms\n", instruction_count - startCount, elapsedMs);
+        if (profileMode)
+            printProfile(stdout);
+    } else {
+        traceFinal(stopReason, instruction_count);
+        if (profileMode) {
+            fflush(stdout);
+            printProfile(stderr);
+        }
+    }
+    if (snapshotName) {
+        fflush(stdout);
+        if (!saveSnapshot(snapshotName, instruction_count))
+            return 1;
     }
-    printRegisterState();
     return 0;
 }